@@ -0,0 +1,276 @@
+"""Benchmarks do pipeline de vídeo com fontes sintéticas do ffmpeg (lavfi)
+
+Gera vídeos reproduzíveis (testsrc2 + sine) de várias durações e
+resoluções, mede cada etapa (create_short, segmentos automáticos, marca
+d'água) e o processamento completo de process-video com o yt-dlp
+substituído por uma cópia local do vídeo de teste.
+
+Os resultados são gravados em JSON. Com um baseline, o script termina com
+código 1 se alguma medição ficar mais lenta do que o limite configurado.
+
+    cd backend
+    python benchmarks/run_benchmarks.py --save-baseline   # primeira execução
+    python benchmarks/run_benchmarks.py                   # comparar com o baseline
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+
+# Os serviços leem a configuração do ambiente na importação, por isso as
+# diretorias de trabalho e a cache do benchmark são definidas antes
+BENCHMARK_ROOT = os.environ.get('BENCHMARK_ROOT', os.path.join(tempfile.gettempdir(), 'shorts-benchmarks'))
+os.environ.setdefault('WORKSPACE_DIR', os.path.join(BENCHMARK_ROOT, 'workspace'))
+os.environ.setdefault('DOWNLOAD_CACHE_DIR', os.path.join(BENCHMARK_ROOT, 'download-cache'))
+sys.path.insert(0, SRC_DIR)
+
+from flask import Flask  # noqa: E402
+
+import services.downloads  # noqa: E402
+from routes import video_processing  # noqa: E402
+from services.jobs import Job  # noqa: E402
+from services.metadata import metadata_cache  # noqa: E402
+
+# Vídeos de teste: nome -> (duração em segundos, resolução)
+FIXTURES = {
+    'short_360p': (30, '640x360'),
+    'medium_720p': (120, '1280x720'),
+    'long_720p': (600, '1280x720'),
+}
+DEFAULT_FIXTURES = ('short_360p', 'medium_720p')
+FIXTURE_RATE = 30
+FIXTURE_DIR = os.path.join(BENCHMARK_ROOT, 'fixtures')
+
+# Duração dos shorts gerados nos benchmarks
+SHORT_DURATION = 15
+
+# Aumento relativo do tempo mediano a partir do qual há regressão
+REGRESSION_THRESHOLD = float(os.environ.get('BENCHMARK_REGRESSION_THRESHOLD', 0.2))
+# Diferenças absolutas abaixo deste valor (segundos) são ruído
+REGRESSION_MIN_SECONDS = float(os.environ.get('BENCHMARK_REGRESSION_MIN_SECONDS', 0.05))
+
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+DEFAULT_OUTPUT = os.path.join(RESULTS_DIR, 'latest.json')
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, 'baseline.json')
+
+
+def generate_fixture(name):
+    """Gerar (ou reutilizar) o vídeo de teste `name`
+
+    O volume do sine sobe durante 5 s a cada 20 s, para a deteção de
+    destaques ter momentos distintos a encontrar.
+    """
+    duration, size = FIXTURES[name]
+    path = os.path.join(FIXTURE_DIR, f'{name}.mp4')
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    staging_path = path + '.part.mp4'
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={FIXTURE_RATE}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-af', "volume='if(gt(mod(t,20),15),1,0.1)':eval=frame",
+        '-t', str(duration),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-g', str(FIXTURE_RATE * 2),
+        '-c:a', 'aac',
+        '-y', staging_path
+    ]
+    subprocess.run(cmd, capture_output=True, text=True, check=True)
+    os.replace(staging_path, path)
+    return path
+
+
+def stub_ytdlp(fixture_path, duration):
+    """Substituir a extração e o download do yt-dlp pelo vídeo de teste"""
+
+    def extract(url):
+        video_id = url.rsplit('/', 1)[-1]
+        return {
+            'id': video_id,
+            'webpage_url': url,
+            'title': f'Benchmark {video_id}',
+            'duration': duration,
+            'thumbnail': None
+        }
+
+    def download(info, format_selector, target_dir, progress_hooks=None, section=None):
+        output_path = os.path.join(target_dir, f"{info['id']}.mp4")
+        if section:
+            start, end = section
+            cmd = [
+                'ffmpeg', '-v', 'error', '-ss', str(start), '-i', fixture_path,
+                '-t', str(end - start), '-c', 'copy', '-y', output_path
+            ]
+            subprocess.run(cmd, capture_output=True, text=True, check=True)
+        else:
+            shutil.copyfile(fixture_path, output_path)
+        return output_path
+
+    metadata_cache._extractor = extract
+    services.downloads.download_with_ytdlp = download
+
+
+def measure(fn, repeat):
+    """Correr fn `repeat` vezes e devolver as durações em segundos"""
+    runs = []
+    for run in range(repeat):
+        started = time.perf_counter()
+        fn(run)
+        runs.append(time.perf_counter() - started)
+    return {
+        'median': round(statistics.median(runs), 4),
+        'min': round(min(runs), 4),
+        'runs': [round(value, 4) for value in runs]
+    }
+
+
+def benchmark_fixture(name, repeat, work_dir):
+    """Medir todas as etapas num vídeo de teste"""
+    duration, _ = FIXTURES[name]
+    fixture_path = generate_fixture(name)
+    output_dir = os.path.join(work_dir, name)
+    os.makedirs(output_dir, exist_ok=True)
+    end = min(SHORT_DURATION, duration)
+    results = {}
+
+    def create_short(run):
+        video_processing.create_short(fixture_path, 0, end, output_dir, f'short_{run}')
+
+    results['create_short'] = measure(create_short, repeat)
+
+    def auto_segments(run):
+        segments = video_processing.find_auto_segments(fixture_path, duration, SHORT_DURATION)
+        if not segments:
+            raise RuntimeError('Nenhum segmento encontrado')
+
+    results['auto_segments'] = measure(auto_segments, repeat)
+
+    app = Flask(__name__)
+    app.register_blueprint(video_processing.video_processing_bp, url_prefix='/api/video')
+    client = app.test_client()
+    short_path = os.path.join(output_dir, 'short_0.mp4')
+
+    def add_watermark(run):
+        response = client.post('/api/video/add-watermark', json={
+            'video_path': short_path,
+            'watermark_text': 'Benchmark'
+        })
+        if response.status_code != 200:
+            raise RuntimeError(response.get_json().get('error'))
+
+    results['add_watermark'] = measure(add_watermark, repeat)
+
+    stub_ytdlp(fixture_path, duration)
+
+    def process_video(run):
+        # Um id novo por execução para medir sempre o download (stub) e não a cache
+        job = Job('process_video', video_processing.PROCESS_VIDEO_STAGES)
+        url = f'bench://{name}/{name}-{time.time_ns()}'
+        result = video_processing.run_process_video(job, url, None, SHORT_DURATION)
+        if result['failed_segments'] or not result['shorts']:
+            raise RuntimeError(f"Falha no processamento: {result['failed_segments']}")
+
+    results['process_video'] = measure(process_video, repeat)
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD, min_seconds=REGRESSION_MIN_SECONDS):
+    """Listar as medições mais lentas do que o baseline além do limite"""
+    regressions = []
+    for fixture, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get(fixture, {}).get(stage)
+            if not previous:
+                continue
+            delta = current['median'] - previous['median']
+            if delta > min_seconds and current['median'] > previous['median'] * (1 + threshold):
+                regressions.append({
+                    'benchmark': f'{fixture}/{stage}',
+                    'baseline': previous['median'],
+                    'current': current['median'],
+                    'change': round(delta / previous['median'], 3)
+                })
+    return regressions
+
+
+def ffmpeg_version():
+    result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
+    return result.stdout.splitlines()[0] if result.returncode == 0 else None
+
+
+def load_results(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_results(path, report):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks do pipeline de vídeo')
+    parser.add_argument('--fixtures', nargs='+', choices=sorted(FIXTURES), default=list(DEFAULT_FIXTURES))
+    parser.add_argument('--repeat', type=int, default=3, help='execuções por medição (usa-se a mediana)')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='ficheiro JSON dos resultados')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='resultados de referência')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='aumento relativo da mediana considerado regressão')
+    parser.add_argument('--save-baseline', action='store_true', help='gravar também como baseline')
+    args = parser.parse_args()
+
+    os.makedirs(BENCHMARK_ROOT, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='run-', dir=BENCHMARK_ROOT)
+    try:
+        results = {name: benchmark_fixture(name, args.repeat, work_dir) for name in args.fixtures}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'created_at': time.time(),
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'ffmpeg': ffmpeg_version(),
+        'repeat': args.repeat,
+        'results': results
+    }
+    write_results(args.output, report)
+    if args.save_baseline:
+        write_results(args.baseline, report)
+
+    for fixture, stages in results.items():
+        for stage, timing in stages.items():
+            print(f"{fixture + '/' + stage:32} {timing['median']:8.3f}s (min {timing['min']:.3f}s)")
+    print(f'Resultados gravados em {args.output}')
+
+    baseline = load_results(args.baseline)
+    if not baseline or args.save_baseline:
+        return 0
+
+    regressions = compare(results, baseline['results'], args.threshold)
+    for regression in regressions:
+        print(
+            f"REGRESSÃO {regression['benchmark']}: {regression['baseline']:.3f}s -> "
+            f"{regression['current']:.3f}s (+{regression['change']:.0%})"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Tempo e memória de arranque da aplicação Flask
+
+Importa o main.py em processos novos (arranque a frio, como num worker
+acabado de criar ou num deploy serverless) e mede o tempo até a aplicação
+estar pronta e o pico de memória. Termina com código 1 se a mediana passar
+o orçamento de tempo ou de memória, ou se alguma dependência pesada que
+devia ser carregada só no primeiro uso já estiver importada.
+
+    cd backend
+    python benchmarks/startup_benchmark.py --repeat 5
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+
+# Orçamento de arranque: segundos até a aplicação estar criada e pico de memória (MB)
+STARTUP_TIME_BUDGET = float(os.environ.get('STARTUP_TIME_BUDGET', 1.5))
+STARTUP_MEMORY_BUDGET = float(os.environ.get('STARTUP_MEMORY_BUDGET', 80))
+
+# Dependências que só devem ser importadas quando são usadas
+LAZY_MODULES = (
+    'yt_dlp',
+    'numpy',
+    'moviepy',
+    'googleapiclient',
+    'google_auth_oauthlib',
+    'google_auth_httplib2',
+    'httplib2',
+)
+
+DEFAULT_OUTPUT = os.path.join(BENCHMARKS_DIR, 'results', 'startup.json')
+
+# Executado num interpretador novo; imprime uma linha JSON com as medições
+# O ru_maxrss passa para o processo novo pelo fork (e sobrevive ao exec), por
+# isso um processo pai grande, como o pytest, inflacionava-o; o VmHWM do Linux
+# é só do programa atual
+PROBE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {src!r})
+import main
+elapsed = time.perf_counter() - started
+
+def max_rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+print(json.dumps({{
+    'seconds': elapsed,
+    'max_rss_mb': max_rss_mb(),
+    'modules': len(sys.modules),
+    'lazy_loaded': sorted(name for name in {lazy!r} if name in sys.modules)
+}}))
+'''
+
+
+def measure_startup(work_dir):
+    """Arrancar a aplicação num processo novo e devolver as medições"""
+    env = {
+        **os.environ,
+        # Base de dados e diretorias próprias, para não tocar nas da aplicação
+        'DATABASE_URL': f"sqlite:///{os.path.join(work_dir, 'startup.db')}",
+        'WORKSPACE_DIR': os.path.join(work_dir, 'workspace'),
+        'DOWNLOAD_CACHE_DIR': os.path.join(work_dir, 'download-cache'),
+    }
+    code = PROBE.format(src=SRC_DIR, lazy=LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, cwd=work_dir)
+    if result.returncode != 0:
+        raise RuntimeError(f'A aplicação não arrancou: {result.stderr.strip()[-1000:]}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tempo e memória de arranque da aplicação')
+    parser.add_argument('--repeat', type=int, default=5, help='arranques medidos (usa-se a mediana)')
+    parser.add_argument('--time-budget', type=float, default=STARTUP_TIME_BUDGET, help='segundos')
+    parser.add_argument('--memory-budget', type=float, default=STARTUP_MEMORY_BUDGET, help='MB')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='ficheiro JSON dos resultados')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='startup-benchmark-') as work_dir:
+        # O primeiro arranque cria a base de dados e aquece a cache de bytecode
+        measure_startup(work_dir)
+        runs = [measure_startup(work_dir) for _ in range(args.repeat)]
+
+    seconds = statistics.median(run['seconds'] for run in runs)
+    memory = statistics.median(run['max_rss_mb'] for run in runs)
+    lazy_loaded = sorted({name for run in runs for name in run['lazy_loaded']})
+    report = {
+        'created_at': time.time(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'seconds': round(seconds, 4),
+        'max_rss_mb': round(memory, 1),
+        'modules': runs[-1]['modules'],
+        'lazy_loaded': lazy_loaded,
+        'budget': {'seconds': args.time_budget, 'max_rss_mb': args.memory_budget},
+        'runs': runs
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f'Arranque: {seconds:.3f}s (orçamento {args.time_budget:.3f}s)')
+    print(f'Memória:  {memory:.1f} MB (orçamento {args.memory_budget:.1f} MB)')
+    print(f"Módulos:  {report['modules']}")
+
+    failures = []
+    if seconds > args.time_budget:
+        failures.append('tempo de arranque acima do orçamento')
+    if memory > args.memory_budget:
+        failures.append('memória de arranque acima do orçamento')
+    if lazy_loaded:
+        failures.append(f"dependências carregadas no arranque: {', '.join(lazy_loaded)}")
+    for failure in failures:
+        print(f'FALHA: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,13 @@ from routes.video_processing import video_processing_bp
 from routes.auth import auth_bp
 from routes.upload import upload_bp
 from routes.user import user_bp # Assumindo que você tem um blueprint para user
+from routes.debug import debug_bp
+from models.user import db
+from services.jobs import job_queue
+from services.metrics import metrics
+from services.registry import add_missing_columns, current_owner, job_registry
+from services.tracing import request_tracer
+from services.workspace import workspace
 
 app = Flask(__name__, static_folder=".", static_url_path="/")
 CORS(app) # Habilitar CORS para todas as rotas
@@ -23,6 +30,29 @@ app.config["GOOGLE_CLIENT_ID"] = os.environ.get("GOOGLE_CLIENT_ID")
 app.config["GOOGLE_CLIENT_SECRET"] = os.environ.get("GOOGLE_CLIENT_SECRET")
 app.config["TIKTOK_CLIENT_ID"] = os.environ.get("TIKTOK_CLIENT_ID")
 app.config["TIKTOK_CLIENT_SECRET"] = os.environ.get("TIKTOK_CLIENT_SECRET")
+# Delegar o envio de ficheiros (shorts) ao servidor web com X-Sendfile, se suportado
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE", "false").lower() == "true"
+
+# Base de dados (jobs, shorts e uploads ficam registados aqui)
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "DATABASE_URL",
+    f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
+app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+db.init_app(app)
+with app.app_context():
+    db.create_all()
+    add_missing_columns()
+job_registry.init_app(app, job_queue)
+
+# Métricas dos pedidos e das etapas do pipeline em /metrics
+metrics.init_app(app)
+
+# Rastreio (X-Trace) e cProfile (X-Profile) opcionais por pedido
+request_tracer.init_app(app, owner=current_owner)
+
+# Limpeza periódica das diretorias de trabalho dos jobs
+workspace.start_sweeper()
 
 # Registrar blueprints
 app.register_blueprint(youtube_bp, url_prefix="/api/youtube")
@@ -30,6 +60,7 @@ app.register_blueprint(video_processing_bp, url_prefix="/api/video")
 app.register_blueprint(auth_bp, url_prefix="/api/auth")
 app.register_blueprint(upload_bp, url_prefix="/api/upload")
 app.register_blueprint(user_bp, url_prefix="/api/user") # Registrar blueprint para user
+app.register_blueprint(debug_bp, url_prefix="/api/debug")
 
 # Rota para servir o frontend (index.html)
 @app.route("/")
@@ -0,0 +1,182 @@
+import json
+import time
+
+from models.user import db
+
+
+class SourceVideo(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.String(64), unique=True, nullable=False)
+    url = db.Column(db.String(500))
+    title = db.Column(db.String(300))
+    duration = db.Column(db.Float)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+
+    def __repr__(self):
+        return f'<SourceVideo {self.video_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'video_id': self.video_id,
+            'url': self.url,
+            'title': self.title,
+            'duration': self.duration,
+            'created_at': self.created_at
+        }
+
+
+class Job(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    owner = db.Column(db.String(64))
+    source_video_id = db.Column(db.Integer, db.ForeignKey('source_video.id'), index=True)
+    stages = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    updated_at = db.Column(db.Float, nullable=False, default=time.time)
+
+    __table_args__ = (
+        db.Index('ix_job_owner_created', 'owner', 'created_at', 'id'),
+        db.Index('ix_job_status_updated', 'status', 'updated_at'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stages': json.loads(self.stages) if self.stages else {},
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+
+class Short(db.Model):
+    id = db.Column(db.String(64), primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('job.id'), nullable=False, index=True)
+    source_video_id = db.Column(db.Integer, db.ForeignKey('source_video.id'), index=True)
+    owner = db.Column(db.String(64))
+    path = db.Column(db.String(500), nullable=False)
+    title = db.Column(db.String(300))
+    start_time = db.Column(db.Float)
+    end_time = db.Column(db.Float)
+    status = db.Column(db.String(16), nullable=False, default='ready')
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+
+    __table_args__ = (
+        db.Index('ix_short_owner_created', 'owner', 'created_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<Short {self.id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_id': self.job_id,
+            'path': self.path,
+            'download_url': f'/api/video/download-short/{self.id}',
+            'title': self.title,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'duration': (self.end_time or 0) - (self.start_time or 0),
+            'status': self.status,
+            'created_at': self.created_at
+        }
+
+
+class Upload(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    short_id = db.Column(db.String(64), index=True)
+    owner = db.Column(db.String(64))
+    platform = db.Column(db.String(16), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='uploading')
+    remote_video_id = db.Column(db.String(64))
+    error = db.Column(db.Text)
+    # Estado do upload resumable, para o retomar depois de uma falha
+    video_path = db.Column(db.String(500))
+    request_body = db.Column(db.Text)
+    resumable_uri = db.Column(db.Text)
+    bytes_sent = db.Column(db.BigInteger, default=0)
+    total_bytes = db.Column(db.BigInteger)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    updated_at = db.Column(db.Float, nullable=False, default=time.time)
+
+    __table_args__ = (
+        db.Index('ix_upload_owner_created', 'owner', 'created_at', 'id'),
+        db.Index('ix_upload_status_updated', 'status', 'updated_at'),
+    )
+
+    def __repr__(self):
+        return f'<Upload {self.id} {self.platform} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'short_id': self.short_id,
+            'platform': self.platform,
+            'status': self.status,
+            'video_id': self.remote_video_id,
+            'error': self.error,
+            'bytes_sent': self.bytes_sent or 0,
+            'total_bytes': self.total_bytes,
+            'progress': round((self.bytes_sent or 0) / self.total_bytes, 3) if self.total_bytes else None,
+            'resumable': self.status != 'completed' and bool(self.resumable_uri),
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+
+class Task(db.Model):
+    """Tarefa da fila persistente executada pelos workers (ver worker.py)
+
+    O id é o do job cujo estado e progresso a tarefa vai atualizando. Um
+    worker só executa uma tarefa enquanto tiver o lease: se deixar de o
+    renovar (processo morto), a tarefa volta a ser distribuída.
+    """
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, completed, failed
+    owner = db.Column(db.String(64))
+    payload = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    worker_id = db.Column(db.String(64))
+    lease_expires_at = db.Column(db.Float)
+    available_at = db.Column(db.Float, nullable=False, default=time.time)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    updated_at = db.Column(db.Float, nullable=False, default=time.time)
+
+    __table_args__ = (
+        db.Index('ix_task_status_available', 'status', 'available_at'),
+        db.Index('ix_task_status_lease', 'status', 'lease_expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<Task {self.id} {self.kind} {self.status}>'
+
+    def load_payload(self):
+        return json.loads(self.payload)
+
+    def to_dict(self):
+        return {
+            'task_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'worker_id': self.worker_id,
+            'lease_expires_at': self.lease_expires_at,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
@@ -1,10 +1,7 @@
 from flask import Blueprint, request, jsonify, session, redirect, url_for
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 import os
 import json
+from services.google_clients import youtube_client
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -33,7 +30,8 @@ TIKTOK_SCOPES = [
 def google_login():
     """Iniciar o fluxo de autenticação do Google"""
     try:
-        # Criar o fluxo OAuth
+        # Criar o fluxo OAuth (importado só aqui para não atrasar o arranque)
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -73,7 +71,8 @@ def google_callback():
         if request.args.get('state') != session.get('state'):
             return jsonify({'error': 'State inválido'}), 400
         
-        # Criar o fluxo OAuth
+        # Criar o fluxo OAuth (importado só aqui para não atrasar o arranque)
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -183,14 +182,13 @@ def get_user_info():
         # Informações do Google
         if 'google_credentials' in session:
             try:
-                creds = Credentials.from_authorized_user_info(session['google_credentials'])
-                service = build('youtube', 'v3', credentials=creds)
+                client = youtube_client(session['google_credentials'])
                 
                 # Obter informações do canal
-                channels_response = service.channels().list(
+                channels_response = client.service.channels().list(
                     part='snippet,statistics',
                     mine=True
-                ).execute()
+                ).execute(http=client.http())
                 
                 if channels_response['items']:
                     channel = channels_response['items'][0]
@@ -0,0 +1,40 @@
+from flask import Blueprint, jsonify, request
+from services.registry import current_owner
+from services.tracing import trace_store
+
+debug_bp = Blueprint('debug', __name__)
+
+@debug_bp.route('/traces', methods=['GET'])
+def list_traces():
+    """Listar os últimos traces do utilizador (pedidos com X-Trace ou X-Profile)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        traces = []
+        for trace in trace_store.list(owner=current_owner())[:limit]:
+            root = trace.to_dict()['root']
+            traces.append({
+                'trace_id': trace.id,
+                'name': root['name'],
+                'created_at': trace.created_at,
+                'duration_ms': root['duration_ms'],
+                'attributes': root['attributes']
+            })
+        return jsonify({'traces': traces})
+        
+    except ValueError:
+        return jsonify({'error': 'limit inválido'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@debug_bp.route('/traces/<trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """Obter a árvore de spans de um trace, incluindo os jobs que o pedido lançou"""
+    try:
+        trace = trace_store.get(trace_id)
+        if not trace or trace.owner != current_owner():
+            return jsonify({'error': 'Trace não encontrado'}), 404
+        
+        return jsonify(trace.to_dict())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
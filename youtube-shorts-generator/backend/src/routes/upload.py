@@ -1,13 +1,27 @@
-from flask import Blueprint, request, jsonify, session
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import requests
+from flask import Blueprint, Response, current_app, request, jsonify, session, stream_with_context
 import os
 import json
+import time
+from models.media import Upload
+from models.user import db
+from services.credentials import open_credentials, seal_credentials
+from services.google_clients import youtube_client
+from services.metrics import bytes_total, track_stage, uploads_in_progress
+from services.registry import create_upload, current_owner, finish_upload, paginate_keyset, record_upload_progress
+from services.tasks import TASK_BACKEND, submit_job
+from services.uploads import (
+    UPLOAD_CHUNK_SIZE, call_with_backoff, rate_limiters, resumable_upload, run_bounded
+)
+from services.workspace import workspace
 
 upload_bp = Blueprint('upload', __name__)
 
+# Um upload em curso sem progresso há mais do que isto (segundos) foi interrompido
+UPLOAD_STALE_AFTER = int(os.environ.get('UPLOAD_STALE_AFTER', 300))
+
+# Etapas reportadas no progresso de um upload executado por um worker
+UPLOAD_STAGES = ('upload',)
+
 @upload_bp.route('/youtube', methods=['POST'])
 def upload_to_youtube():
     """Fazer upload de um short para o YouTube"""
@@ -25,37 +39,43 @@ def upload_to_youtube():
         if not video_path or not os.path.exists(video_path):
             return jsonify({'error': 'Ficheiro de vídeo não encontrado'}), 400
         
-        # Criar credenciais
-        creds = Credentials.from_authorized_user_info(session['google_credentials'])
-        youtube = build('youtube', 'v3', credentials=creds)
-        
-        # Metadados do vídeo
-        body = {
-            'snippet': {
-                'title': title,
-                'description': description,
-                'tags': tags,
-                'categoryId': '22'  # Categoria "People & Blogs"
-            },
-            'status': {
-                'privacyStatus': 'public',  # ou 'private', 'unlisted'
-                'selfDeclaredMadeForKids': False
-            }
-        }
-        
         # Upload do vídeo
-        media = MediaFileUpload(video_path, chunksize=-1, resumable=True)
-        
-        insert_request = youtube.videos().insert(
-            part=','.join(body.keys()),
-            body=body,
-            media_body=media
+        body = youtube_video_body(title, description, tags)
+        upload = create_upload(
+            data.get('short_id'), 'youtube', current_owner(), video_path=video_path, request_body=body
         )
         
-        response = insert_request.execute()
+        # Com workers o upload corre fora do processo web e o pedido devolve o job;
+        # as credenciais vão cifradas, porque os argumentos ficam na base de dados
+        if TASK_BACKEND == 'worker':
+            job = submit_job(
+                'upload_youtube',
+                run_youtube_upload,
+                upload.id,
+                seal_credentials(session['google_credentials']),
+                stages=UPLOAD_STAGES,
+                owner=current_owner()
+            )
+            return jsonify({
+                'success': True,
+                'upload_id': upload.id,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': f'/api/upload/status/{upload.id}'
+            }), 202
+        
+        # Cliente da API em cache para as credenciais da sessão
+        client = youtube_client(session['google_credentials'])
+        try:
+            response = send_youtube_upload(client.service, upload, http=client.http())
+        except Exception as e:
+            finish_upload(upload, 'failed', error=str(e))
+            raise
+        finish_upload(upload, 'completed', remote_video_id=response['id'])
         
         return jsonify({
             'success': True,
+            'upload_id': upload.id,
             'video_id': response['id'],
             'video_url': f"https://www.youtube.com/watch?v={response['id']}",
             'title': response['snippet']['title'],
@@ -65,6 +85,48 @@ def upload_to_youtube():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@upload_bp.route('/youtube/<upload_id>/resume', methods=['POST'])
+def resume_youtube_upload(upload_id):
+    """Retomar um upload para o YouTube que falhou ou foi interrompido"""
+    try:
+        if 'google_credentials' not in session:
+            return jsonify({'error': 'Utilizador não autenticado no Google'}), 401
+        
+        upload = db.session.get(Upload, upload_id)
+        if not upload or upload.owner != current_owner() or upload.platform != 'youtube':
+            return jsonify({'error': 'Upload não encontrado'}), 404
+        
+        stale = upload.status == 'uploading' and time.time() - upload.updated_at > UPLOAD_STALE_AFTER
+        if upload.status != 'failed' and not stale:
+            return jsonify({'error': f'Upload não pode ser retomado (estado: {upload.status})'}), 409
+        
+        if not upload.video_path or not os.path.exists(upload.video_path) or not upload.request_body:
+            return jsonify({'error': 'Ficheiro de vídeo não encontrado'}), 400
+        
+        client = youtube_client(session['google_credentials'])
+        
+        upload.status = 'uploading'
+        upload.error = None
+        upload.updated_at = time.time()
+        db.session.commit()
+        
+        try:
+            response = send_youtube_upload(client.service, upload, http=client.http())
+        except Exception as e:
+            finish_upload(upload, 'failed', error=str(e))
+            raise
+        finish_upload(upload, 'completed', remote_video_id=response['id'])
+        
+        return jsonify({
+            'success': True,
+            'upload_id': upload.id,
+            'video_id': response['id'],
+            'video_url': f"https://www.youtube.com/watch?v={response['id']}"
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @upload_bp.route('/tiktok', methods=['POST'])
 def upload_to_tiktok():
     """Fazer upload de um short para o TikTok"""
@@ -112,7 +174,13 @@ def upload_to_tiktok():
 
 @upload_bp.route('/bulk', methods=['POST'])
 def bulk_upload():
-    """Fazer upload em massa de shorts"""
+    """Fazer upload em massa de shorts
+
+    Os uploads correm em paralelo (UPLOAD_WORKERS) dentro dos limites de
+    ritmo e quota de cada plataforma, com um só cliente da API por pedido.
+    Com stream=true a resposta é NDJSON: uma linha por upload assim que
+    termina e uma linha final com o total.
+    """
     try:
         data = request.get_json()
         shorts = data.get('shorts', [])
@@ -121,31 +189,69 @@ def bulk_upload():
         if not shorts:
             return jsonify({'error': 'Nenhum short fornecido'}), 400
         
-        results = []
+        owner = current_owner()
+        app = current_app._get_current_object()
         
-        for short in shorts:
-            short_result = {
-                'short_id': short.get('id'),
-                'platforms': {}
-            }
-            
-            # Upload para YouTube
-            if 'youtube' in platforms and 'google_credentials' in session:
-                try:
-                    youtube_result = upload_single_to_youtube(short)
-                    short_result['platforms']['youtube'] = youtube_result
-                except Exception as e:
-                    short_result['platforms']['youtube'] = {'error': str(e)}
-            
-            # Upload para TikTok
+        # Um cliente do YouTube para todo o lote; cada thread usa a sua ligação
+        client = None
+        if 'youtube' in platforms and 'google_credentials' in session:
+            client = youtube_client(session['google_credentials'])
+        
+        tasks = []
+        for index, short in enumerate(shorts):
+            if client:
+                tasks.append((index, 'youtube'))
             if 'tiktok' in platforms and 'tiktok_credentials' in session:
+                tasks.append((index, 'tiktok'))
+        
+        def upload_task(task):
+            index, platform = task
+            short = shorts[index]
+            with app.app_context():
+                if platform == 'youtube':
+                    # Sem ficheiro não há upload: nem registo nem desconto na quota do dia
+                    if not short.get('path') or not os.path.exists(short['path']):
+                        return {'error': 'Ficheiro de vídeo não encontrado'}
+                    body = youtube_video_body(
+                        short.get('title', 'YouTube Short'),
+                        short.get('description', 'Criado com YouTube to Shorts Generator'),
+                        ['shorts', 'youtube']
+                    )
+                    upload = create_upload(
+                        short.get('id'), 'youtube', owner, video_path=short.get('path'), request_body=body
+                    )
+                    try:
+                        # Um só desconto na quota por upload; as repetições são feitas bloco a
+                        # bloco pelo resumable_upload, sem perder a sessão
+                        rate_limiters['youtube'].acquire()
+                        youtube_result = upload_single_to_youtube(
+                            client.service, upload, http=client.http(), limiter=rate_limiters['youtube']
+                        )
+                        finish_upload(upload, 'completed', remote_video_id=youtube_result['video_id'])
+                        return {**youtube_result, 'upload_id': upload.id}
+                    except Exception as e:
+                        finish_upload(upload, 'failed', error=str(e))
+                        return {'error': str(e), 'upload_id': upload.id}
+                
                 try:
-                    tiktok_result = upload_single_to_tiktok(short)
-                    short_result['platforms']['tiktok'] = tiktok_result
+                    return call_with_backoff(lambda: upload_single_to_tiktok(short), rate_limiters['tiktok'])
                 except Exception as e:
-                    short_result['platforms']['tiktok'] = {'error': str(e)}
+                    return {'error': str(e)}
+        
+        completed = run_bounded(upload_task, tasks)
+        
+        if data.get('stream'):
+            def generate():
+                for (index, platform), result in completed:
+                    line = {'short_id': shorts[index].get('id'), 'platform': platform, **result}
+                    yield json.dumps(line) + '\n'
+                yield json.dumps({'done': True, 'total_processed': len(shorts)}) + '\n'
             
-            results.append(short_result)
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        results = [{'short_id': short.get('id'), 'platforms': {}} for short in shorts]
+        for (index, platform), result in completed:
+            results[index]['platforms'][platform] = result
         
         return jsonify({
             'success': True,
@@ -156,25 +262,32 @@ def bulk_upload():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def upload_single_to_youtube(short):
-    """Helper para upload individual no YouTube"""
-    creds = Credentials.from_authorized_user_info(session['google_credentials'])
-    youtube = build('youtube', 'v3', credentials=creds)
-    
-    body = {
+def youtube_video_body(title, description, tags):
+    """Metadados de um vídeo para o videos.insert do YouTube"""
+    return {
         'snippet': {
-            'title': short.get('title', 'YouTube Short'),
-            'description': short.get('description', 'Criado com YouTube to Shorts Generator'),
-            'tags': ['shorts', 'youtube'],
-            'categoryId': '22'
+            'title': title,
+            'description': description,
+            'tags': tags,
+            'categoryId': '22'  # Categoria "People & Blogs"
         },
         'status': {
-            'privacyStatus': 'public',
+            'privacyStatus': 'public',  # ou 'private', 'unlisted'
             'selfDeclaredMadeForKids': False
         }
     }
+
+def send_youtube_upload(youtube, upload, http=None, on_progress=None, limiter=None):
+    """Enviar o vídeo de um upload por blocos, continuando a sessão guardada se existir
+
+    O URI da sessão resumable e os bytes confirmados ficam gravados no
+    registo do upload depois de cada bloco; on_progress(sent, total) é
+    chamado a seguir.
+    """
+    from googleapiclient.http import MediaFileUpload
     
-    media = MediaFileUpload(short['path'], chunksize=-1, resumable=True)
+    body = json.loads(upload.request_body)
+    media = MediaFileUpload(upload.video_path, chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
     
     insert_request = youtube.videos().insert(
         part=','.join(body.keys()),
@@ -182,7 +295,77 @@ def upload_single_to_youtube(short):
         media_body=media
     )
     
-    response = insert_request.execute()
+    confirmed = upload.bytes_sent or 0
+    
+    def chunk_sent(uri, sent, total):
+        nonlocal confirmed
+        bytes_total.inc(max(sent - confirmed, 0), direction='uploaded')
+        confirmed = sent
+        record_upload_progress(upload, uri, sent, total)
+        if on_progress:
+            on_progress(sent, total)
+    
+    # O short não pode ser apagado pela limpeza enquanto é enviado
+    with workspace.using(upload.video_path), uploads_in_progress.track_inprogress(platform='youtube'), track_stage('upload'):
+        return resumable_upload(
+            insert_request,
+            on_progress=chunk_sent,
+            resumable_uri=upload.resumable_uri,
+            http=http,
+            limiter=limiter
+        )
+
+def run_youtube_upload(job, upload_id, credentials):
+    """Enviar um upload já registado para o YouTube (executado por um worker)
+
+    credentials são as credenciais da sessão cifradas com seal_credentials.
+    Se a tarefa for repetida, o envio continua a sessão resumable gravada
+    no registo do upload em vez de recomeçar.
+    """
+    upload = db.session.get(Upload, upload_id)
+    if not upload:
+        raise RuntimeError('Upload não encontrado')
+    if not upload.video_path or not os.path.exists(upload.video_path):
+        finish_upload(upload, 'failed', error='Ficheiro de vídeo não encontrado')
+        raise FileNotFoundError('Ficheiro de vídeo não encontrado')
+    
+    client = youtube_client(open_credentials(credentials))
+    upload.status = 'uploading'
+    upload.error = None
+    upload.updated_at = time.time()
+    db.session.commit()
+    
+    job.start_stage('upload')
+    try:
+        response = send_youtube_upload(
+            client.service,
+            upload,
+            http=client.http(),
+            on_progress=lambda sent, total: job.set_progress('upload', sent / total if total else 0)
+        )
+    except Exception as e:
+        finish_upload(upload, 'failed', error=str(e))
+        raise
+    finish_upload(upload, 'completed', remote_video_id=response['id'])
+    job.complete_stage('upload')
+    
+    return {
+        'upload_id': upload.id,
+        'video_id': response['id'],
+        'video_url': f"https://www.youtube.com/watch?v={response['id']}"
+    }
+
+def upload_single_to_youtube(youtube, upload, http=None, limiter=None):
+    """Helper para upload individual no YouTube
+
+    youtube é o cliente da API partilhado pelo lote; http a ligação da
+    thread atual (ver GoogleClient.http); limiter o da plataforma, já
+    adquirido por quem chama.
+    """
+    if not upload.video_path or not os.path.exists(upload.video_path):
+        raise FileNotFoundError('Ficheiro de vídeo não encontrado')
+    
+    response = send_youtube_upload(youtube, upload, http=http, limiter=limiter)
     
     return {
         'success': True,
@@ -203,13 +386,33 @@ def upload_single_to_tiktok(short):
 def get_upload_status(upload_id):
     """Verificar o status de um upload"""
     try:
-        # Em produção, você consultaria uma base de dados para o status
+        upload = db.session.get(Upload, upload_id)
+        if not upload:
+            return jsonify({'error': 'Upload não encontrado'}), 404
+        
+        return jsonify(upload.to_dict())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@upload_bp.route('/uploads', methods=['GET'])
+def list_uploads():
+    """Listar os uploads do utilizador, do mais recente para o mais antigo"""
+    try:
+        query = Upload.query.filter_by(owner=current_owner())
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        
+        try:
+            uploads, next_cursor = paginate_keyset(
+                query, Upload, request.args.get('limit', 20), request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         return jsonify({
-            'upload_id': upload_id,
-            'status': 'completed',
-            'message': 'Upload concluído com sucesso'
+            'uploads': [upload.to_dict() for upload in uploads],
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-
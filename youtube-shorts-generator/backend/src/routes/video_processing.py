@@ -1,101 +1,786 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
+import math
 import os
-import tempfile
-import subprocess
-from moviepy.editor import VideoFileClip
-import yt_dlp
+import threading
 import uuid
+from models.media import Job as JobRecord, Short
+from models.user import db
+from services.downloads import download_cache, download_video_cached, download_window_cached, plan_download_windows
+from services.encoding import audio_encoder_args, resolve_profile, video_encoder_args
+from services.ffmpeg_progress import run_ffmpeg_progress
+from services.jobs import format_event, job_events, job_queue, poll_events
+from services.metadata import MAX_BATCH_VIDEOS, list_entries, metadata_cache
+from services.metrics import count_bytes, track_stage
+from services.previews import (
+    PREVIEW_ASSETS, PREVIEW_CACHE_MAX_AGE, PREVIEWS_ENABLED, create_source_preview, preview_graph,
+    preview_output_args, preview_urls, previews_ready, short_preview_paths, source_preview_paths,
+    sprite_layout, write_sprite_layout
+)
+from services.pipeline import PipelineStage, StagedPipeline
+from services.probe import clamp_segments, probe_media, probe_keyframes, snap_to_keyframe, validate_media
+from services.registry import current_owner, paginate_keyset
+from services.rendering import RenderProgress, cpu_pool, plan_cpu_budget, run_parallel
+from services.tasks import submit_job
+from services.watermark import image_inputs, parse_watermark, watermark_graph
+from services.workspace import InsufficientDiskSpace, workspace
 
 video_processing_bp = Blueprint('video_processing', __name__)
 
+# Limitar qualidade para economizar espaço
+DOWNLOAD_FORMAT = 'best[height<=720]'
+
+# Máximo de shorts gerados automaticamente por vídeo
+MAX_AUTO_SHORTS = 5
+
+# Etapas reportadas no progresso de um job de processamento
+PROCESS_VIDEO_STAGES = ('download', 'segment', 'encode')
+SOURCE_PREVIEW_STAGES = ('preview',)
+BATCH_STAGES = ('list', 'metadata', 'download', 'analyze', 'encode')
+WATERMARK_STAGES = ('encode',)
+
+# Máximo de vídeos num pedido de marca d'água em lote
+MAX_WATERMARK_BATCH = 50
+
+# Vídeos processados por omissão de uma playlist ou canal
+BATCH_DEFAULT_LIMIT = int(os.environ.get('BATCH_DEFAULT_LIMIT', 10))
+# Vídeos em simultâneo em cada etapa de um lote; os encodes já usam vários núcleos cada
+BATCH_METADATA_WORKERS = int(os.environ.get('BATCH_METADATA_WORKERS', 4))
+BATCH_DOWNLOAD_WORKERS = int(os.environ.get('BATCH_DOWNLOAD_WORKERS', 2))
+BATCH_ANALYZE_WORKERS = int(os.environ.get('BATCH_ANALYZE_WORKERS', 2))
+BATCH_ENCODE_WORKERS = int(os.environ.get('BATCH_ENCODE_WORKERS', 1))
+
+# single_pass: um só ffmpeg descodifica a fonte uma vez e escreve todos os shorts
+# parallel: um ffmpeg por segmento, em paralelo
+RENDER_MODES = ('parallel', 'single_pass')
+RENDER_MODE = os.environ.get('RENDER_MODE', 'parallel')
+
+# accurate: seek na entrada e re-encode exato dos limites pedidos
+# keyframe: início ajustado ao keyframe mais próximo e cópia de stream quando
+#           a fonte já está no formato final
+CUT_MODES = ('accurate', 'keyframe')
+CUT_MODE = os.environ.get('CUT_MODE', 'accurate')
+# Distância máxima (segundos) a que o início pode ser movido para um keyframe
+KEYFRAME_SNAP_TOLERANCE = float(os.environ.get('KEYFRAME_SNAP_TOLERANCE', 2.0))
+
+# full: descarregar o vídeo inteiro
+# ranges: descarregar só janelas de tempo à volta dos segmentos pedidos
+DOWNLOAD_MODES = ('full', 'ranges')
+DOWNLOAD_MODE = os.environ.get('DOWNLOAD_MODE', 'full')
+
+# Filtro que converte o vídeo para o formato vertical 9:16
+VERTICAL_FILTER = 'scale=720:1280:force_original_aspect_ratio=increase,crop=720:1280'
+
 @video_processing_bp.route('/process-video', methods=['POST'])
 def process_video():
-    """Processar vídeo do YouTube e criar shorts"""
+    """Colocar em fila o processamento de um vídeo do YouTube"""
     try:
         data = request.get_json()
         url = data.get('url')
         segments = data.get('segments', [])
         max_duration = data.get('max_duration', 60)
+        render_mode = data.get('render_mode', RENDER_MODE)
+        cut_mode = data.get('cut_mode', CUT_MODE)
+        download_mode = data.get('download_mode', DOWNLOAD_MODE)
+        profile = data.get('profile')
+        watermark = data.get('watermark')
+        previews = data.get('previews', PREVIEWS_ENABLED)
         
         if not url:
             return jsonify({'error': 'URL é obrigatório'}), 400
         
-        # Criar diretório temporário
-        temp_dir = tempfile.mkdtemp()
-        video_id = str(uuid.uuid4())
+        if not is_positive_number(max_duration):
+            return jsonify({'error': 'max_duration deve ser um número positivo'}), 400
         
-        # Download do vídeo
-        ydl_opts = {
-            'format': 'best[height<=720]',  # Limitar qualidade para economizar espaço
-            'outtmpl': os.path.join(temp_dir, f'{video_id}.%(ext)s'),
-            'quiet': True,
-            'no_warnings': True,
-        }
+        if render_mode not in RENDER_MODES:
+            return jsonify({'error': f"render_mode inválido, use um de: {', '.join(RENDER_MODES)}"}), 400
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            
-            # Encontrar o ficheiro descarregado
-            downloaded_file = None
-            for file in os.listdir(temp_dir):
-                if file.startswith(video_id):
-                    downloaded_file = os.path.join(temp_dir, file)
-                    break
-            
-            if not downloaded_file:
-                return jsonify({'error': 'Falha no download do vídeo'}), 500
-            
-            # Se não foram fornecidos segmentos, gerar automaticamente
-            if not segments:
-                video_duration = info.get('duration', 0)
-                segments = generate_auto_segments(video_duration, max_duration)
-            
-            # Processar cada segmento
-            shorts_info = []
-            for i, segment in enumerate(segments):
-                short_path = create_short(
-                    downloaded_file, 
-                    segment['start'], 
-                    segment['end'], 
-                    temp_dir, 
-                    f'short_{i+1}'
-                )
-                
-                if short_path:
-                    shorts_info.append({
-                        'id': f'short_{i+1}',
-                        'path': short_path,
-                        'start_time': segment['start'],
-                        'end_time': segment['end'],
-                        'duration': segment['end'] - segment['start'],
-                        'title': f"Short {i+1} - {info.get('title', 'Sem título')[:30]}...",
-                        'status': 'ready'
-                    })
+        if cut_mode not in CUT_MODES:
+            return jsonify({'error': f"cut_mode inválido, use um de: {', '.join(CUT_MODES)}"}), 400
+        
+        if download_mode not in DOWNLOAD_MODES:
+            return jsonify({'error': f"download_mode inválido, use um de: {', '.join(DOWNLOAD_MODES)}"}), 400
+        
+        if not isinstance(previews, bool):
+            return jsonify({'error': 'previews deve ser true ou false'}), 400
+        
+        try:
+            profile = resolve_profile(profile)
+            watermark = parse_watermark(watermark)
+            # A duração só é conhecida no job; aqui recusam-se já segmentos mal formados
+            segments = clamp_segments(segments)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Recusar trabalho novo se o disco estiver quase cheio
+        workspace.check_admission()
+        
+        job = submit_job(
+            'process_video',
+            run_process_video,
+            url,
+            segments,
+            max_duration,
+            render_mode,
+            cut_mode,
+            download_mode,
+            profile,
+            watermark,
+            previews,
+            stages=PROCESS_VIDEO_STAGES,
+            owner=current_owner()
+        )
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'profile': profile,
+            'status_url': f'/api/video/jobs/{job.id}'
+        }), 202
             
-            return jsonify({
-                'success': True,
-                'video_info': {
-                    'title': info.get('title'),
-                    'duration': info.get('duration'),
-                    'thumbnail': info.get('thumbnail')
-                },
-                'shorts': shorts_info,
-                'total_shorts': len(shorts_info)
+    except InsufficientDiskSpace as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '60'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@video_processing_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Consultar o estado e o progresso de um job"""
+    try:
+        # Jobs em curso estão em memória; os antigos só na base de dados
+        job = job_queue.get(job_id) or db.session.get(JobRecord, job_id)
+        if not job:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        
+        return jsonify(job.to_dict())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@video_processing_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Acompanhar o progresso de um job em Server-Sent Events
+
+    Cada evento 'progress' traz o estado do job (como em /jobs/<id>) com o
+    ETA de cada etapa e, no encode, as estatísticas do ffmpeg (frame, fps,
+    speed, out_time). O stream termina com um evento 'done'.
+    """
+    try:
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        job = job_queue.get(job_id)
+        if not job:
+            record = db.session.get(JobRecord, job_id)
+            if not record:
+                return jsonify({'error': 'Job não encontrado'}), 404
+            if record.status in ('completed', 'failed'):
+                return Response(format_event('done', record.to_dict()), mimetype='text/event-stream', headers=headers)
+            # Job executado por um worker: o progresso só chega pela base de dados
+            return Response(
+                stream_with_context(poll_events(lambda: load_job_record(job_id))),
+                mimetype='text/event-stream',
+                headers=headers
+            )
+        
+        return Response(job_events(job), mimetype='text/event-stream', headers=headers)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def load_job_record(job_id):
+    # Ler sempre da base de dados, não da cópia da sessão
+    db.session.expire_all()
+    return db.session.get(JobRecord, job_id).to_dict()
+
+@video_processing_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Listar os jobs do utilizador, do mais recente para o mais antigo"""
+    try:
+        query = JobRecord.query.filter_by(owner=current_owner())
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        
+        try:
+            jobs, next_cursor = paginate_keyset(
+                query, JobRecord, request.args.get('limit', 20), request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'jobs': [job.to_dict() for job in jobs],
+            'next_cursor': next_cursor
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@video_processing_bp.route('/shorts', methods=['GET'])
+def list_shorts():
+    """Listar os shorts do utilizador, do mais recente para o mais antigo"""
+    try:
+        try:
+            shorts, next_cursor = paginate_keyset(
+                Short.query.filter_by(owner=current_owner()),
+                Short,
+                request.args.get('limit', 20),
+                request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'shorts': [short.to_dict() for short in shorts],
+            'next_cursor': next_cursor
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@video_processing_bp.route('/workspace', methods=['GET'])
+def get_workspace_stats():
+    """Obter a ocupação das diretorias de trabalho e o espaço livre"""
+    try:
+        return jsonify(workspace.stats())
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def job_dir_name(job):
+    """Nome da diretoria de trabalho de um job
+
+    Cada tentativa de uma tarefa repetida por um worker escreve em
+    <job_id>/<tentativa>, para uma execução que perdeu o lease não escrever
+    os mesmos ficheiros que a que a substituiu.
+    """
+    return os.path.join(job.id, str(job.attempt)) if job.attempt else job.id
+
+def is_positive_number(value):
+    """Verificar que um campo numérico do pedido é um número finito maior do que zero (e não true/false)"""
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and math.isfinite(value) and value > 0
+
+def run_process_video(job, url, segments, max_duration, render_mode=None, cut_mode=None, download_mode=None,
+                      profile=None, watermark=None, previews=False):
+    """Descarregar o vídeo e criar os shorts (executado no pool de jobs)
+
+    Com previews cada short tem sprite e proxy feitos no mesmo render, e a
+    fonte tem os da sua linha temporal (só quando é descarregada inteira).
+    """
+    # Diretório de trabalho do job para os shorts, em uso até o job terminar
+    with workspace.job_dir(job_dir_name(job)) as temp_dir:
+        return _process_video(job, temp_dir, url, segments, max_duration, render_mode, cut_mode, download_mode,
+                              profile, watermark, previews)
+
+def _process_video(job, temp_dir, url, segments, max_duration, render_mode, cut_mode, download_mode, profile,
+                   watermark, previews):
+    ranges = (download_mode or DOWNLOAD_MODE) == 'ranges'
+    
+    def download_progress(status):
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        if status.get('status') == 'downloading' and total:
+            job.set_progress('download', status.get('downloaded_bytes', 0) / total)
+    
+    info = metadata_cache.get(url)
+    # Sem duração nos metadados (diretos e algumas fontes fora do YouTube) os
+    # segmentos automáticos só podem ser escolhidos com o vídeo inteiro
+    if ranges and not segments and not info.get('duration'):
+        ranges = False
+    
+    # No modo por janelas os segmentos têm de ser conhecidos antes do download,
+    # por isso são ajustados à duração dos metadados
+    if ranges:
+        if segments:
+            segments = clamp_segments(segments, info.get('duration'))
+        else:
+            segments = generate_auto_segments(info['duration'], max_duration)
+    
+    # Download do vídeo (reutilizado da cache se já foi descarregado)
+    job.start_stage('download')
+    if ranges:
+        downloaded_file = None
+        segments = download_segment_windows(
+            info,
+            segments,
+            on_progress=lambda progress: job.set_progress('download', progress)
+        )
+    else:
+        downloaded_file = download_video_cached(info, DOWNLOAD_FORMAT, [download_progress])
+    job.complete_stage('download')
+    
+    # Os ficheiros de origem não podem ser apagados pela limpeza enquanto são usados
+    sources = {downloaded_file} if downloaded_file else {segment['source'] for segment in segments}
+    with workspace.using(*sources):
+        # Se não foram fornecidos segmentos, detetar os melhores momentos do vídeo
+        job.start_stage('segment')
+        if downloaded_file:
+            # A duração do ficheiro descarregado manda sobre a dos metadados
+            media = probe_media(downloaded_file)
+            validate_media(media)
+            if segments:
+                segments = clamp_segments(segments, media['duration'])
+            else:
+                segments = find_auto_segments(downloaded_file, media['duration'], max_duration)
+        if (cut_mode or CUT_MODE) == 'keyframe' and not watermark:
+            segments = plan_keyframe_cuts(downloaded_file, segments)
+        job.complete_stage('segment')
+        
+        # Renderizar os shorts
+        job.start_stage('encode')
+        results = render_segments(
+            downloaded_file,
+            segments,
+            temp_dir,
+            render_mode=render_mode,
+            profile=profile,
+            watermark=watermark,
+            on_progress=lambda progress, stats: job.set_progress('encode', progress, stats),
+            previews=previews
+        )
+    
+    shorts_info, failed_segments = collect_shorts(job.id, info, segments, results, previews)
+    job.complete_stage('encode')
+    
+    # Linha temporal da fonte para o editor; falhar aqui não invalida os shorts
+    source_preview = None
+    if previews and downloaded_file:
+        try:
+            source_preview = schedule_source_preview(job, info.get('id'), downloaded_file, media['duration'])
+        except Exception as e:
+            print(f"Erro ao agendar a pré-visualização da fonte: {str(e)}")
+    
+    return {
+        'video_info': {
+            'video_id': info.get('id'),
+            'url': info.get('webpage_url') or url,
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'thumbnail': info.get('thumbnail'),
+            'preview': source_preview
+        },
+        'shorts': shorts_info,
+        'failed_segments': failed_segments,
+        'total_shorts': len(shorts_info)
+    }
+
+def schedule_source_preview(job, video_id, source_path, duration):
+    """URLs da linha temporal da fonte, criando-a num job à parte se ainda não existir
+
+    É um encode do vídeo inteiro, por isso corre depois do job dos shorts e
+    o resultado deles não espera por ele; até terminar os URLs dão 404 e o
+    progresso está no job indicado em job_id.
+    """
+    source_preview = preview_urls(f'/api/video/source-preview/{video_id}')
+    if previews_ready(source_preview_paths(source_path)):
+        return source_preview
+    
+    preview_job = submit_job(
+        'source_preview',
+        run_source_preview,
+        video_id,
+        source_path,
+        duration,
+        stages=SOURCE_PREVIEW_STAGES,
+        owner=job.owner
+    )
+    return {
+        **source_preview,
+        'job_id': preview_job.id,
+        'status_url': f'/api/video/jobs/{preview_job.id}'
+    }
+
+def run_source_preview(job, video_id, source_path, duration):
+    """Criar o sprite e o proxy da linha temporal da fonte (executado no pool de jobs)"""
+    if not os.path.exists(source_path):
+        raise RuntimeError('O vídeo de origem já não está na cache de downloads')
+    
+    job.start_stage('preview')
+    
+    def run_with_progress(cmd, duration=None):
+        return run_ffmpeg(
+            cmd,
+            duration=duration,
+            on_progress=lambda stats: job.set_progress('preview', stats.get('progress') or 0, stats)
+        )
+    
+    with workspace.using(source_path):
+        create_source_preview(source_path, duration, run_with_progress)
+    job.complete_stage('preview')
+    return {'video_id': video_id, 'preview': preview_urls(f'/api/video/source-preview/{video_id}')}
+
+def collect_shorts(id_prefix, info, segments, results, previews=False):
+    """Separar os shorts criados dos segmentos que falharam no render
+
+    Os ids são <id_prefix>_<n>, com id_prefix a começar pelo id do job.
+    """
+    shorts_info = []
+    failed_segments = []
+    for i, (segment, outcome) in enumerate(zip(segments, results)):
+        # Tempos no vídeo original (os das janelas descarregadas são relativos)
+        offset = segment.get('offset', 0)
+        short_id = f'{id_prefix}_{i+1}'
+        if outcome['error']:
+            failed_segments.append({
+                'id': short_id,
+                'start_time': segment['start'] + offset,
+                'end_time': segment['end'] + offset,
+                'error': outcome['error']
             })
+            continue
+        
+        shorts_info.append({
+            'id': short_id,
+            'path': outcome['result'],
+            'download_url': f'/api/video/download-short/{short_id}',
+            'start_time': segment['start'] + offset,
+            'end_time': segment['end'] + offset,
+            'duration': segment['end'] - segment['start'],
+            'title': f"Short {i+1} - {info.get('title', 'Sem título')[:30]}...",
+            'status': 'ready'
+        })
+        if previews and previews_ready(short_preview_paths(outcome['result'])):
+            shorts_info[-1]['preview'] = preview_urls(f'/api/video/preview/{short_id}')
+    return shorts_info, failed_segments
+
+@video_processing_bp.route('/process-batch', methods=['POST'])
+def process_batch():
+    """Colocar em fila os shorts de uma playlist ou dos últimos vídeos de um canal"""
+    try:
+        data = request.get_json()
+        url = data.get('url')
+        limit = data.get('limit', BATCH_DEFAULT_LIMIT)
+        max_duration = data.get('max_duration', 60)
+        render_mode = data.get('render_mode', RENDER_MODE)
+        cut_mode = data.get('cut_mode', CUT_MODE)
+        profile = data.get('profile')
+        watermark = data.get('watermark')
+        previews = data.get('previews', PREVIEWS_ENABLED)
+        
+        if not url:
+            return jsonify({'error': 'URL é obrigatório'}), 400
+        
+        # bool é subclasse de int: true não pode passar por 1
+        if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= MAX_BATCH_VIDEOS:
+            return jsonify({'error': f'limit deve estar entre 1 e {MAX_BATCH_VIDEOS}'}), 400
+        
+        if not is_positive_number(max_duration):
+            return jsonify({'error': 'max_duration deve ser um número positivo'}), 400
+        
+        if render_mode not in RENDER_MODES:
+            return jsonify({'error': f"render_mode inválido, use um de: {', '.join(RENDER_MODES)}"}), 400
+        
+        if cut_mode not in CUT_MODES:
+            return jsonify({'error': f"cut_mode inválido, use um de: {', '.join(CUT_MODES)}"}), 400
+        
+        if not isinstance(previews, bool):
+            return jsonify({'error': 'previews deve ser true ou false'}), 400
+        
+        try:
+            profile = resolve_profile(profile)
+            watermark = parse_watermark(watermark)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        workspace.check_admission()
+        
+        job = submit_job(
+            'process_batch',
+            run_process_batch,
+            url,
+            limit,
+            max_duration,
+            render_mode,
+            cut_mode,
+            profile,
+            watermark,
+            previews,
+            stages=BATCH_STAGES,
+            owner=current_owner()
+        )
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'profile': profile,
+            'status_url': f'/api/video/jobs/{job.id}'
+        }), 202
             
+    except InsufficientDiskSpace as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '60'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def run_process_batch(job, url, limit, max_duration, render_mode=None, cut_mode=None,
+                      profile=None, watermark=None, previews=False):
+    """Criar os shorts de cada vídeo de uma lista (executado no pool de jobs)
+
+    Os vídeos passam por metadata -> download -> analyze -> encode num
+    StagedPipeline: cada etapa tem o seu limite de concorrência e filas
+    limitadas entre elas, por isso os downloads param quando os encodes
+    não acompanham. O resultado vai sendo atualizado à medida que cada
+    vídeo termina, com os shorts já criados e os vídeos que falharam.
+    """
+    # Diretório de trabalho do lote, em uso até o job terminar
+    with workspace.job_dir(job_dir_name(job)) as temp_dir:
+        return _process_batch(job, temp_dir, url, limit, max_duration, render_mode, cut_mode, profile,
+                              watermark, previews)
+
+def _process_batch(job, temp_dir, url, limit, max_duration, render_mode, cut_mode, profile, watermark, previews):
+    job.start_stage('list')
+    title, entries = list_entries(url, limit)
+    if not entries:
+        raise ValueError('A lista não tem vídeos')
+    job.complete_stage('list')
+    
+    videos = [
+        {
+            'index': index,
+            'entry': entry,
+            'status': 'queued',
+            'video_info': {'video_id': entry['id'], 'url': entry['url'], 'title': entry['title'],
+                           'duration': entry['duration']},
+            'shorts': [],
+            'failed_segments': []
+        }
+        for index, entry in enumerate(entries)
+    ]
+    lock = threading.Lock()
+    
+    def snapshot():
+        with lock:
+            finished = [video for video in videos if video['status'] in ('completed', 'failed')]
+            return {
+                'batch': {
+                    'url': url,
+                    'title': title,
+                    'total': len(videos),
+                    'finished': len(finished),
+                    'failed': sum(1 for video in finished if video['status'] == 'failed')
+                },
+                'videos': [
+                    {key: value for key, value in video.items() if key in ('status', 'stage', 'error', 'video_info',
+                                                                           'shorts', 'failed_segments')}
+                    for video in videos
+                ],
+                'shorts': [short for video in videos for short in video['shorts']],
+                'total_shorts': sum(len(video['shorts']) for video in videos)
+            }
+    
+    def fetch_metadata(video):
+        info = metadata_cache.get(video['entry']['url'])
+        with lock:
+            video['info'] = info
+            video['video_info'] = {
+                'video_id': info.get('id'),
+                'url': info.get('webpage_url') or video['entry']['url'],
+                'title': info.get('title'),
+                'duration': info.get('duration'),
+                'thumbnail': info.get('thumbnail')
+            }
+        return video
+    
+    def download(video):
+        # Verificar o disco antes de cada download, não só quando o lote é aceite
+        workspace.check_admission()
+        path = download_video_cached(video['info'], DOWNLOAD_FORMAT)
+        if not path:
+            raise RuntimeError('Download falhou')
+        # Reservado até o vídeo sair do pipeline, para a limpeza não o apagar entre etapas
+        workspace.acquire(path)
+        video['path'] = path
+        return video
+    
+    def analyze(video):
+        media = probe_media(video['path'])
+        validate_media(media)
+        segments = find_auto_segments(video['path'], media['duration'], max_duration)
+        if cut_mode == 'keyframe' and not watermark:
+            segments = plan_keyframe_cuts(video['path'], segments)
+        if not segments:
+            raise RuntimeError('Nenhum segmento encontrado')
+        video['segments'] = segments
+        return video
+    
+    def encode(video):
+        output_dir = os.path.join(temp_dir, f"{video['index'] + 1:03d}")
+        os.makedirs(output_dir, exist_ok=True)
+        results = render_segments(
+            video['path'],
+            video['segments'],
+            output_dir,
+            render_mode=render_mode,
+            profile=profile,
+            watermark=watermark,
+            previews=previews
+        )
+        shorts, failed = collect_shorts(f"{job.id}_{video['index'] + 1}", video['info'], video['segments'],
+                                        results, previews)
+        if not shorts:
+            raise RuntimeError(failed[0]['error'] if failed else 'Nenhum short criado')
+        with lock:
+            video['shorts'] = shorts
+            video['failed_segments'] = failed
+        return video
+    
+    def release(video):
+        if video.get('path'):
+            workspace.release(video['path'])
+    
+    def item_done(index, outcome):
+        with lock:
+            video = videos[index]
+            video['status'] = 'failed' if outcome['error'] else 'completed'
+            if outcome['error']:
+                video['error'] = outcome['error']
+                video['stage'] = outcome['stage']
+        # Resultados parciais: os shorts prontos ficam disponíveis antes do fim do lote
+        job.result = snapshot()
+        job.notify()
+    
+    def stage_update(name, progress, stats):
+        if job.stages[name]['status'] == 'pending':
+            job.start_stage(name)
+        job.set_progress(name, progress, stats)
+        if progress >= 1:
+            job.complete_stage(name)
+    
+    pipeline = StagedPipeline(
+        [
+            PipelineStage('metadata', fetch_metadata, BATCH_METADATA_WORKERS),
+            PipelineStage('download', download, BATCH_DOWNLOAD_WORKERS),
+            PipelineStage('analyze', analyze, BATCH_ANALYZE_WORKERS),
+            PipelineStage('encode', encode, BATCH_ENCODE_WORKERS),
+        ],
+        on_update=stage_update,
+        on_item=item_done,
+        cleanup=release,
+        stop=job.is_cancelled
+    )
+    pipeline.run(videos)
+    for stage in pipeline.stages:
+        if job.stages[stage.name]['status'] != 'completed':
+            job.complete_stage(stage.name)
+    
+    result = snapshot()
+    if result['batch']['failed'] == len(videos):
+        raise RuntimeError(f"Nenhum vídeo processado: {videos[0].get('error')}")
+    return result
+
 @video_processing_bp.route('/download-short/<short_id>', methods=['GET'])
 def download_short(short_id):
-    """Fazer download de um short específico"""
+    """Fazer download de um short específico
+
+    O ficheiro é enviado em streaming com suporte de Range (206), ETag e
+    If-None-Match, para os players poderem fazer seek e retomar downloads.
+    """
+    try:
+        short_path = find_short_path(short_id)
+        if not short_path or not os.path.exists(short_path):
+            return jsonify({'error': 'Short não encontrado'}), 404
+        
+        response = send_in_use(
+            short_path,
+            mimetype='video/mp4',
+            as_attachment=request.args.get('download') == '1',
+            download_name=f'{short_id}.mp4',
+            conditional=True,
+            etag=True
+        )
+        # Anunciar suporte de Range também na primeira resposta (200)
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@video_processing_bp.route('/preview/<short_id>/<asset>', methods=['GET'])
+def get_short_preview(short_id, asset):
+    """Sprite (sprite.jpg e a grelha em sprite.json) ou proxy de baixo débito (proxy.mp4) de um short"""
     try:
-        # Em produção, você armazenaria o caminho do ficheiro numa base de dados
-        # Por agora, vamos simular
-        return jsonify({'message': 'Download endpoint - implementar com armazenamento persistente'})
+        short_path = find_short_path(short_id) if asset in PREVIEW_ASSETS else None
+        path = short_preview_paths(short_path)[asset] if short_path else None
+        if not path or not os.path.exists(path):
+            return jsonify({'error': 'Pré-visualização não encontrada'}), 404
+        
+        return send_preview(path, asset)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@video_processing_bp.route('/source-preview/<video_id>/<asset>', methods=['GET'])
+def get_source_preview(video_id, asset):
+    """Sprite ou proxy da linha temporal do vídeo original, para escolher e ajustar segmentos"""
+    try:
+        source_path = download_cache.peek(video_id, DOWNLOAD_FORMAT) if asset in PREVIEW_ASSETS else None
+        path = source_preview_paths(source_path)[asset] if source_path else None
+        if not path or not os.path.exists(path):
+            return jsonify({'error': 'Pré-visualização não encontrada'}), 404
+        
+        return send_preview(path, asset)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def send_in_use(path, **kwargs):
+    """send_file com path em uso até a resposta (enviada em streaming) terminar"""
+    workspace.acquire(path)
+    try:
+        response = send_file(path, **kwargs)
+    except Exception:
+        workspace.release(path)
+        raise
+    response.call_on_close(lambda: workspace.release(path))
+    return response
+
+def send_preview(path, asset):
+    """Enviar uma pré-visualização com cache HTTP longa
+
+    Os ficheiros não mudam depois de criados (cada short tem um id novo),
+    por isso o browser pode guardá-los sem voltar a validar. O proxy
+    suporta Range para o player fazer seek.
+    """
+    response = send_in_use(
+        path,
+        mimetype=PREVIEW_ASSETS[asset],
+        conditional=True,
+        etag=True,
+        max_age=PREVIEW_CACHE_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def find_short_path(short_id):
+    """Encontrar o ficheiro de um short a partir do seu id (<job_id>_<n>)"""
+    short = db.session.get(Short, short_id)
+    if short:
+        return short.path
+    
+    # O job pode ter terminado e ainda não estar gravado, ou ser um lote ainda em
+    # curso noutro processo (worker) com resultados parciais
+    job_id, _, _ = short_id.partition('_')
+    job = job_queue.get(job_id) or db.session.get(JobRecord, job_id)
+    result = job.to_dict()['result'] if job else None
+    if not result:
+        return None
+    
+    for short in result.get('shorts', []):
+        if short['id'] == short_id:
+            return short['path']
+    return None
+
+def find_auto_segments(input_path, video_duration, max_duration=60):
+    """Escolher segmentos automaticamente pelos destaques do vídeo
+
+    Usa a deteção de destaques (volume e mudanças de cena) e volta à divisão
+    em partes iguais se a análise falhar ou não encontrar nada.
+    """
+    # A deteção usa numpy, que só é carregado quando é preciso
+    from services.highlights import detect_highlights
+    
+    count = int(min(MAX_AUTO_SHORTS, video_duration // max_duration + 1))
+    try:
+        segments = detect_highlights(input_path, max_duration, count)
+        if segments:
+            return segments
+    except Exception as e:
+        print(f"Erro na deteção de destaques: {str(e)}")
+    return generate_auto_segments(video_duration, max_duration)
+
 def generate_auto_segments(video_duration, max_duration=60):
     """Gerar segmentos automaticamente baseado na duração do vídeo"""
     segments = []
@@ -105,7 +790,7 @@ def generate_auto_segments(video_duration, max_duration=60):
         segments.append({'start': 0, 'end': video_duration})
     else:
         # Dividir o vídeo em segmentos
-        num_segments = min(5, video_duration // max_duration + 1)  # Máximo 5 shorts
+        num_segments = min(MAX_AUTO_SHORTS, video_duration // max_duration + 1)
         segment_duration = min(max_duration, video_duration / num_segments)
         
         for i in range(int(num_segments)):
@@ -116,69 +801,488 @@ def generate_auto_segments(video_duration, max_duration=60):
     
     return segments
 
-def create_short(input_path, start_time, end_time, output_dir, filename):
-    """Criar um short a partir de um vídeo"""
-    try:
-        output_path = os.path.join(output_dir, f'{filename}.mp4')
+def download_segment_windows(info, segments, on_progress=None):
+    """Descarregar só as janelas de tempo que cobrem os segmentos
+
+    Devolve os segmentos com os tempos relativos ao ficheiro parcial da sua
+    janela ('source') e o início dessa janela no vídeo original ('offset').
+    """
+    windows = plan_download_windows(segments, duration=info.get('duration'))
+    local_segments = [None] * len(segments)
+    
+    for done, window in enumerate(windows):
+        def window_progress(status, done=done):
+            total = status.get('total_bytes') or status.get('total_bytes_estimate')
+            if on_progress and status.get('status') == 'downloading' and total:
+                fraction = status.get('downloaded_bytes', 0) / total
+                on_progress((done + fraction) / len(windows))
         
-        # Usar ffmpeg para criar o short com formato 9:16
-        cmd = [
-            'ffmpeg',
-            '-i', input_path,
-            '-ss', str(start_time),
-            '-t', str(end_time - start_time),
-            '-vf', 'scale=720:1280:force_original_aspect_ratio=increase,crop=720:1280',
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-y',  # Sobrescrever ficheiro se existir
-            output_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0 and os.path.exists(output_path):
-            return output_path
+        path = download_window_cached(
+            info, DOWNLOAD_FORMAT, window['start'], window['end'], [window_progress]
+        )
+        for index in window['segments']:
+            segment = segments[index]
+            local_segments[index] = {
+                **segment,
+                'start': segment['start'] - window['start'],
+                'end': segment['end'] - window['start'],
+                'source': path,
+                'offset': window['start']
+            }
+    
+    return local_segments
+
+def render_segments(input_path, segments, output_dir, render_mode=None, profile=None, watermark=None,
+                    on_progress=None, previews=False):
+    """Renderizar um short por segmento, pela ordem dos segmentos
+
+    Devolve uma lista de dicionários com 'result' (caminho do short) ou 'error'.
+    Um segmento com 'source' é cortado desse ficheiro em vez de input_path.
+    Se o modo single_pass falhar, volta a renderizar com um processo por segmento.
+    A marca d'água obriga a re-encode, por isso desativa a cópia de stream.
+    on_progress(progress, stats) recebe o progresso agregado dos encodes
+    (ver RenderProgress).
+    """
+    render_mode = render_mode or RENDER_MODE
+    filenames = [f'short_{i+1}' for i in range(len(segments))]
+    
+    stream_copy = not watermark and any(segment.get('stream_copy') for segment in segments)
+    sources = {segment.get('source', input_path) for segment in segments}
+    if render_mode == 'single_pass' and len(segments) > 1 and len(sources) == 1 and not stream_copy:
+        _, threads = plan_cpu_budget(1)
+        window = max(segment['end'] for segment in segments) - min(segment['start'] for segment in segments)
+        progress = RenderProgress([window], on_progress) if on_progress else None
+        try:
+            with cpu_pool.reserve(threads):
+                paths = create_shorts_single_pass(
+                    sources.pop(), segments, output_dir, filenames,
+                    threads=threads, profile=profile, watermark=watermark,
+                    on_progress=progress.reporter(0) if progress else None,
+                    previews=previews
+                )
+            if progress:
+                progress.finish(0)
+            return [{'result': path, 'error': None} for path in paths]
+        except Exception as e:
+            print(f"Render numa só passagem falhou, a usar um processo por segmento: {str(e)}")
+    
+    # Processar os segmentos em paralelo, dentro do orçamento de CPU
+    workers, threads = plan_cpu_budget(len(segments))
+    progress = RenderProgress(
+        [segment['end'] - segment['start'] for segment in segments], on_progress
+    ) if on_progress else None
+    
+    def encode_segment(item):
+        index, segment, filename = item
+        try:
+            return create_short(
+                segment.get('source', input_path), 
+                segment['start'], 
+                segment['end'], 
+                output_dir, 
+                filename,
+                threads=threads,
+                stream_copy=segment.get('stream_copy', False) and not watermark,
+                profile=profile,
+                watermark=watermark,
+                on_progress=progress.reporter(index) if progress else None,
+                previews=previews
+            )
+        finally:
+            if progress:
+                progress.finish(index)
+    
+    return run_parallel(
+        encode_segment,
+        [(index, segment, filename) for index, (segment, filename) in enumerate(zip(segments, filenames))],
+        workers,
+        threads=threads
+    )
+
+def create_short(input_path, start_time, end_time, output_dir, filename, threads=None, stream_copy=False,
+                 profile=None, watermark=None, on_progress=None, previews=False):
+    """Criar um short a partir de um vídeo
+
+    O -ss vai antes do -i para o ffmpeg saltar diretamente para o início do
+    segmento em vez de descodificar tudo o que está para trás. Com
+    stream_copy as faixas são copiadas sem re-encode (o início deve estar
+    num keyframe). A marca d'água (ver parse_watermark) é aplicada no mesmo
+    grafo do scale+crop. on_progress(stats) recebe o progresso do ffmpeg (ver
+    run_ffmpeg). Com previews o mesmo ffmpeg escreve também o sprite e o
+    proxy do short (ver services.previews). Levanta RuntimeError com o erro
+    do ffmpeg se falhar.
+    """
+    output_path = os.path.join(output_dir, f'{filename}.mp4')
+    duration = end_time - start_time
+    layout = sprite_layout(duration) if previews else None
+    
+    # Usar ffmpeg para criar o short com formato 9:16
+    cmd = [
+        'ffmpeg',
+        '-ss', str(start_time),
+        '-t', str(duration),
+        '-i', input_path,
+    ]
+    if stream_copy:
+        if previews:
+            # A cópia não passa pelo grafo; a fonte já está em 720x1280 e só é descodificada para as pré-visualizações
+            cmd += ['-filter_complex', preview_graph('0:v', layout), '-map', '0:v:0', '-map', '0:a?']
+        cmd += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+    else:
+        if watermark:
+            graph = f'[0:v]{VERTICAL_FILTER}[base];' + watermark_graph(watermark, ['base'], ['vout'], image_input=1)
         else:
-            print(f"Erro no ffmpeg: {result.stderr}")
-            return None
-            
-    except Exception as e:
-        print(f"Erro ao criar short: {str(e)}")
+            graph = f'[0:v]{VERTICAL_FILTER}[vout]'
+        if previews:
+            graph += ';' + preview_graph('vout', layout, main='vshort')
+        if watermark or previews:
+            cmd += image_inputs(watermark)
+            cmd += ['-filter_complex', graph, '-map', '[vshort]' if previews else '[vout]', '-map', '0:a?']
+        else:
+            cmd += ['-vf', VERTICAL_FILTER]
+        cmd += video_encoder_args(profile, threads) + audio_encoder_args(profile)
+    cmd += [
+        '-y',  # Sobrescrever ficheiro se existir
+        output_path
+    ]
+    if previews:
+        paths = short_preview_paths(output_path)
+        cmd += preview_output_args(paths, audio='0:a?')
+    
+    with track_stage('encode'):
+        run_ffmpeg(cmd, duration=duration, on_progress=on_progress)
+        if not os.path.exists(output_path):
+            raise RuntimeError('O ffmpeg não produziu o short')
+    
+    if previews:
+        write_sprite_layout(paths, layout)
+    count_bytes('encoded', output_path)
+    return output_path
+
+def plan_keyframe_cuts(input_path, segments, tolerance=None):
+    """Ajustar o início dos segmentos aos keyframes da fonte para cópia de stream
+
+    Só as fontes já em 720x1280 com codecs compatíveis com MP4 podem ser
+    copiadas; nas outras o segmento é re-encodado e mantém o início pedido.
+    Os segmentos cujo início ficou num keyframe são marcados com stream_copy.
+    """
+    tolerance = KEYFRAME_SNAP_TOLERANCE if tolerance is None else tolerance
+    sources = {}
+    
+    planned = []
+    for segment in segments:
+        source = segment.get('source', input_path)
+        if source not in sources:
+            copyable = can_stream_copy(probe_media(source))
+            sources[source] = probe_keyframes(source) if copyable else None
+        keyframes = sources[source]
+        if keyframes is None:
+            planned.append({**segment, 'stream_copy': False})
+            continue
+        
+        start, snapped = snap_to_keyframe(segment['start'], segment['end'], keyframes, tolerance)
+        planned.append({
+            **segment,
+            'start': start,
+            'stream_copy': snapped
+        })
+    return planned
+
+def can_stream_copy(media):
+    """Verificar se a fonte pode ser copiada sem re-enquadrar nem re-encode"""
+    video = media.get('video')
+    audio = media.get('audio')
+    # Com rotação os píxeis guardados não estão em 720x1280, só a apresentação
+    if not video or video.get('rotation') or (video.get('width'), video.get('height')) != (720, 1280):
+        return False
+    if video.get('codec') not in ('h264', 'hevc'):
+        return False
+    return audio is None or audio.get('codec') in ('aac', 'mp3')
+
+def create_shorts_single_pass(input_path, segments, output_dir, filenames, threads=None, profile=None,
+                              watermark=None, on_progress=None, previews=False):
+    """Criar todos os shorts com um só ffmpeg que descodifica a fonte uma vez
+
+    O grafo faz split/asplit da fonte, trim/atrim de cada segmento e o
+    scale+crop para 9:16, com uma saída por short. A fonte só é lida entre
+    o início do primeiro segmento e o fim do último; o progresso reportado
+    a on_progress(stats) é relativo a essa janela. Com previews cada short
+    tem também o seu sprite e proxy no mesmo grafo.
+    """
+    window_start = min(segment['start'] for segment in segments)
+    window_end = max(segment['end'] for segment in segments)
+    with_audio = probe_media(input_path)['audio'] is not None
+    count = len(segments)
+    # Com marca d'água o scale+crop de cada segmento passa por ela antes da saída
+    scaled = 'vbase' if watermark else 'vout'
+    layouts = [sprite_layout(segment['end'] - segment['start']) for segment in segments] if previews else None
+    
+    graph = ['[0:v]split={}{}'.format(count, ''.join(f'[v{i}]' for i in range(count)))]
+    if with_audio:
+        graph.append('[0:a]asplit={}{}'.format(count, ''.join(f'[a{i}]' for i in range(count))))
+    
+    for i, segment in enumerate(segments):
+        # Com -ss na entrada os timestamps começam em 0 no início da janela
+        start = segment['start'] - window_start
+        end = segment['end'] - window_start
+        graph.append(
+            f'[v{i}]trim=start={start}:end={end},setpts=PTS-STARTPTS,{VERTICAL_FILTER}[{scaled}{i}]'
+        )
+        if with_audio:
+            # O proxy precisa da sua própria cópia do áudio do segmento
+            audio_outputs = f',asplit=2[aout{i}][apx{i}]' if previews else f'[aout{i}]'
+            graph.append(f'[a{i}]atrim=start={start}:end={end},asetpts=PTS-STARTPTS{audio_outputs}')
+    if watermark:
+        graph.append(watermark_graph(
+            watermark,
+            [f'vbase{i}' for i in range(count)],
+            [f'vout{i}' for i in range(count)],
+            image_input=1
+        ))
+    if previews:
+        for i, layout in enumerate(layouts):
+            graph.append(preview_graph(f'vout{i}', layout, main=f'vshort{i}', suffix=str(i)))
+    
+    cmd = [
+        'ffmpeg',
+        '-ss', str(window_start),
+        '-t', str(window_end - window_start),
+        '-i', input_path,
+    ] + image_inputs(watermark) + [
+        '-filter_complex', ';'.join(graph),
+    ]
+    
+    output_paths = []
+    for i, filename in enumerate(filenames):
+        output_path = os.path.join(output_dir, f'{filename}.mp4')
+        cmd += ['-map', f'[vshort{i}]' if previews else f'[vout{i}]']
+        if with_audio:
+            cmd += ['-map', f'[aout{i}]'] + audio_encoder_args(profile)
+        cmd += video_encoder_args(profile, threads)
+        cmd += ['-y', output_path]
+        if previews:
+            cmd += preview_output_args(
+                short_preview_paths(output_path), audio=f'[apx{i}]' if with_audio else None, suffix=str(i)
+            )
+        output_paths.append(output_path)
+    
+    with track_stage('encode_single_pass'):
+        run_ffmpeg(cmd, duration=window_end - window_start, on_progress=on_progress)
+        missing = [path for path in output_paths if not os.path.exists(path)]
+        if missing:
+            raise RuntimeError(f'O ffmpeg não produziu {len(missing)} short(s)')
+    
+    if previews:
+        for output_path, layout in zip(output_paths, layouts):
+            write_sprite_layout(short_preview_paths(output_path), layout)
+    count_bytes('encoded', *output_paths)
+    return output_paths
+
+def run_ffmpeg(cmd, duration=None, on_progress=None):
+    """Executar o ffmpeg e levantar RuntimeError com o stderr se falhar
+
+    O progresso é lido do -progress do ffmpeg enquanto o encode corre;
+    on_progress(stats) recebe frame, fps, speed e out_time e, com a duração
+    da saída, a fração concluída e o ETA.
+    """
+    return run_ffmpeg_progress(cmd, duration=duration, on_progress=on_progress)
+
+def resolve_media_path(path):
+    """Caminho real de um vídeo do servidor, se for um ficheiro da aplicação
+
+    Só são aceites ficheiros dentro das diretorias de trabalho ou da cache de
+    downloads, para um pedido não poder ler nem escrever (o vídeo com marca
+    d'água fica ao lado do original) noutro sítio. Devolve None se o caminho
+    estiver fora delas ou o ficheiro não existir.
+    """
+    if not isinstance(path, str) or not path:
+        return None
+    real = os.path.realpath(path)
+    roots = (os.path.realpath(workspace.root), os.path.realpath(download_cache.root))
+    if not any(real.startswith(root + os.sep) for root in roots):
         return None
+    return real if os.path.isfile(real) else None
 
 @video_processing_bp.route('/add-watermark', methods=['POST'])
 def add_watermark():
-    """Adicionar marca d'água a um vídeo"""
+    """Adicionar marca d'água a um vídeo já renderizado
+
+    Para shorts novos é preferível pedir a marca d'água no process-video, que
+    a aplica no mesmo encode do short em vez de uma segunda passagem.
+    """
     try:
         data = request.get_json()
         video_path = data.get('video_path')
-        watermark_text = data.get('watermark_text', '@YourBrand')
+        profile = data.get('profile')
         
-        if not video_path or not os.path.exists(video_path):
+        video_path = resolve_media_path(video_path)
+        if not video_path:
             return jsonify({'error': 'Caminho do vídeo inválido'}), 400
         
-        # Criar novo ficheiro com marca d'água
-        output_path = video_path.replace('.mp4', '_watermarked.mp4')
+        try:
+            watermark = parse_watermark(data.get('watermark') or data.get('watermark_text', '@YourBrand'))
+            profile = resolve_profile(profile)
+            validate_media(probe_media(video_path))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-vf', f"drawtext=text='{watermark_text}':fontcolor=white:fontsize=24:x=10:y=h-th-10",
-            '-c:a', 'copy',
-            '-y',
-            output_path
-        ]
+        workspace.check_admission()
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        with workspace.using(video_path):
+            output_path = watermark_video(video_path, watermark, profile)
         
-        if result.returncode == 0:
-            return jsonify({
-                'success': True,
-                'watermarked_path': output_path
-            })
-        else:
-            return jsonify({'error': 'Falha ao adicionar marca d\'água'}), 500
+        return jsonify({
+            'success': True,
+            'watermarked_path': output_path
+        })
             
+    except InsufficientDiskSpace as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '60'}
+    except RuntimeError:
+        return jsonify({'error': 'Falha ao adicionar marca d\'água'}), 500
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@video_processing_bp.route('/add-watermark/batch', methods=['POST'])
+def add_watermark_batch():
+    """Colocar em fila a marca d'água de vários shorts ou vídeos"""
+    try:
+        data = request.get_json()
+        short_ids = data.get('short_ids', [])
+        video_paths = data.get('video_paths', [])
+        profile = data.get('profile')
+        
+        if not isinstance(short_ids, list) or not isinstance(video_paths, list):
+            return jsonify({'error': 'short_ids e video_paths devem ser listas'}), 400
+        if not short_ids and not video_paths:
+            return jsonify({'error': 'short_ids ou video_paths é obrigatório'}), 400
+        
+        if len(short_ids) + len(video_paths) > MAX_WATERMARK_BATCH:
+            return jsonify({'error': f'Máximo de {MAX_WATERMARK_BATCH} vídeos por pedido'}), 400
+        
+        try:
+            watermark = parse_watermark(data.get('watermark'))
+            profile = resolve_profile(profile)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if not watermark:
+            return jsonify({'error': 'watermark é obrigatório'}), 400
+        
+        # Resolver os shorts agora, porque o job corre fora do contexto do pedido
+        items = []
+        missing = []
+        for short_id in short_ids:
+            path = find_short_path(short_id) if isinstance(short_id, str) else None
+            path = resolve_media_path(path)
+            items.append({'short_id': short_id, 'video_path': path})
+            if not path:
+                missing.append(str(short_id))
+        for path in video_paths:
+            resolved = resolve_media_path(path)
+            items.append({'short_id': None, 'video_path': resolved})
+            if not resolved:
+                missing.append(str(path))
+        if missing:
+            return jsonify({'error': f"Vídeos não encontrados: {', '.join(missing)}"}), 400
+        
+        workspace.check_admission()
+        
+        job = submit_job(
+            'watermark',
+            run_watermark_batch,
+            items,
+            watermark,
+            profile,
+            stages=WATERMARK_STAGES,
+            owner=current_owner()
+        )
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/api/video/jobs/{job.id}'
+        }), 202
+            
+    except InsufficientDiskSpace as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '60'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def run_watermark_batch(job, items, watermark, profile=None):
+    """Aplicar a marca d'água a vários vídeos em paralelo (executado no pool de jobs)"""
+    job.start_stage('encode')
+    workers, threads = plan_cpu_budget(len(items))
+    
+    def encode_item(item):
+        path = item['video_path']
+        if not path or not os.path.exists(path):
+            raise RuntimeError('Vídeo não encontrado')
+        validate_media(probe_media(path))
+        with workspace.using(path):
+            return watermark_video(path, watermark, profile, threads=threads)
+    
+    outcomes = run_parallel(
+        encode_item,
+        items,
+        workers,
+        on_done=lambda done, total: job.set_progress('encode', done / total),
+        threads=threads
+    )
+    job.complete_stage('encode')
+    
+    results = [
+        {
+            **item,
+            'success': outcome['error'] is None,
+            'watermarked_path': outcome['result'],
+            'error': outcome['error']
+        }
+        for item, outcome in zip(items, outcomes)
+    ]
+    return {
+        'results': results,
+        'total': len(results),
+        'failed': sum(1 for result in results if not result['success'])
+    }
+
+def watermark_video(video_path, watermark, profile=None, threads=None):
+    """Re-encodar um vídeo com a marca d'água e devolver o novo ficheiro
+
+    O áudio é copiado. Levanta RuntimeError com o erro do ffmpeg se falhar.
+    """
+    root, _ = os.path.splitext(video_path)
+    output_path = f'{root}_watermarked.mp4'
+    # Escrito com outro nome e publicado no fim: duas execuções do mesmo vídeo
+    # (ex.: uma tarefa repetida) não escrevem no mesmo ficheiro ao mesmo tempo
+    staging_path = f'{root}_watermarked.{uuid.uuid4().hex[:8]}.partial.mp4'
+    
+    # A largura do vídeo só é precisa para dimensionar a imagem; o ffmpeg aplica a
+    # rotação antes dos filtros, por isso conta a largura de apresentação
+    video_width = 720
+    if watermark['image']:
+        video_width = (probe_media(video_path)['video'] or {}).get('display_width') or video_width
+    graph = watermark_graph(watermark, ['0:v'], ['vout'], image_input=1, video_width=video_width)
+    
+    cmd = ['ffmpeg', '-i', video_path] + image_inputs(watermark) + [
+        '-filter_complex', graph,
+        '-map', '[vout]',
+        '-map', '0:a?',
+    ] + video_encoder_args(profile, threads) + [
+        '-c:a', 'copy',
+        '-y',
+        staging_path
+    ]
+    
+    try:
+        with track_stage('watermark'):
+            run_ffmpeg(cmd)
+        os.replace(staging_path, output_path)
+    except Exception:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+        raise
+    
+    count_bytes('encoded', output_path)
+    return output_path
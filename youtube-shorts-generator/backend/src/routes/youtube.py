@@ -1,8 +1,11 @@
 from flask import Blueprint, request, jsonify
-import yt_dlp
 import os
-import tempfile
 import json
+from services.downloads import download_cache, download_video_cached
+from services.google_clients import google_clients
+from services.metadata import metadata_cache
+from services.probe import clamp_segments, probe_media, validate_media
+from services.workspace import InsufficientDiskSpace, workspace
 
 youtube_bp = Blueprint('youtube', __name__)
 
@@ -16,45 +19,38 @@ def get_video_info():
         if not url:
             return jsonify({'error': 'URL é obrigatório'}), 400
         
-        # Configurar yt-dlp para obter apenas informações
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
+        # Informação em cache: uma só extração por vídeo enquanto o TTL durar
+        info = metadata_cache.get(url)
+        
+        # Extrair informações relevantes
+        video_info = {
+            'id': info.get('id'),
+            'title': info.get('title'),
+            'description': info.get('description'),
+            'duration': info.get('duration'),
+            'thumbnail': info.get('thumbnail'),
+            'uploader': info.get('uploader'),
+            'upload_date': info.get('upload_date'),
+            'view_count': info.get('view_count'),
+            'formats': []
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Extrair informações relevantes
-            video_info = {
-                'id': info.get('id'),
-                'title': info.get('title'),
-                'description': info.get('description'),
-                'duration': info.get('duration'),
-                'thumbnail': info.get('thumbnail'),
-                'uploader': info.get('uploader'),
-                'upload_date': info.get('upload_date'),
-                'view_count': info.get('view_count'),
-                'formats': []
-            }
-            
-            # Obter formatos de vídeo disponíveis
-            if info.get('formats'):
-                for fmt in info['formats']:
-                    if fmt.get('vcodec') != 'none':  # Apenas formatos com vídeo
-                        video_info['formats'].append({
-                            'format_id': fmt.get('format_id'),
-                            'ext': fmt.get('ext'),
-                            'quality': fmt.get('quality'),
-                            'height': fmt.get('height'),
-                            'width': fmt.get('width'),
-                            'filesize': fmt.get('filesize'),
-                            'url': fmt.get('url')
-                        })
-            
-            return jsonify(video_info)
-            
+        # Obter formatos de vídeo disponíveis
+        if info.get('formats'):
+            for fmt in info['formats']:
+                if fmt.get('vcodec') != 'none':  # Apenas formatos com vídeo
+                    video_info['formats'].append({
+                        'format_id': fmt.get('format_id'),
+                        'ext': fmt.get('ext'),
+                        'quality': fmt.get('quality'),
+                        'height': fmt.get('height'),
+                        'width': fmt.get('width'),
+                        'filesize': fmt.get('filesize'),
+                        'url': fmt.get('url')
+                    })
+        
+        return jsonify(video_info)
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -69,37 +65,38 @@ def download_video():
         if not url:
             return jsonify({'error': 'URL é obrigatório'}), 400
         
-        # Criar diretório temporário para downloads
-        temp_dir = tempfile.mkdtemp()
+        # Recusar trabalho novo se o disco estiver quase cheio
+        workspace.check_admission()
         
-        # Configurar yt-dlp para download
-        ydl_opts = {
-            'format': format_id,
-            'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-            'quiet': True,
-            'no_warnings': True,
-        }
+        # Obter informações e descarregar através das caches partilhadas
+        info = metadata_cache.get(url)
+        downloaded_file = download_video_cached(info, format_id)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            
-            # Encontrar o ficheiro descarregado
-            downloaded_file = None
-            for file in os.listdir(temp_dir):
-                if file.endswith(('.mp4', '.webm', '.mkv')):
-                    downloaded_file = os.path.join(temp_dir, file)
-                    break
-            
-            if downloaded_file:
-                return jsonify({
-                    'success': True,
-                    'file_path': downloaded_file,
-                    'title': info.get('title'),
-                    'duration': info.get('duration')
-                })
-            else:
-                return jsonify({'error': 'Falha no download do vídeo'}), 500
+        if downloaded_file:
+            return jsonify({
+                'success': True,
+                'file_path': downloaded_file,
+                'title': info.get('title'),
+                'duration': info.get('duration')
+            })
+        else:
+            return jsonify({'error': 'Falha no download do vídeo'}), 500
                 
+    except InsufficientDiskSpace as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '60'}
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@youtube_bp.route('/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Obter contadores de hits/misses das caches de downloads, de informação e de clientes da API"""
+    try:
+        return jsonify({
+            'downloads': download_cache.stats(),
+            'metadata': metadata_cache.stats(),
+            'google_clients': google_clients.stats()
+        })
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -124,13 +121,22 @@ def generate_shorts():
             # Por agora, vamos criar um segmento do início do vídeo
             segments = [{'start': 0, 'end': min(max_duration, 60)}]
         
+        # Validar já os segmentos contra a duração real do ficheiro (ffprobe em cache)
+        try:
+            media = probe_media(video_path)
+            validate_media(media)
+            segments = clamp_segments(segments, media['duration'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         shorts_info = []
         for i, segment in enumerate(segments):
             short_info = {
                 'id': f'short_{i+1}',
-                'start_time': segment.get('start', 0),
-                'end_time': segment.get('end', max_duration),
-                'duration': segment.get('end', max_duration) - segment.get('start', 0),
+                'start_time': segment['start'],
+                'end_time': segment['end'],
+                'duration': segment['end'] - segment['start'],
+                'clamped': segment.get('clamped', False),
                 'title': f"Short {i+1}",
                 'status': 'ready'
             }
@@ -138,10 +144,13 @@ def generate_shorts():
         
         return jsonify({
             'success': True,
+            'video_duration': media['duration'],
             'shorts': shorts_info,
             'total_shorts': len(shorts_info)
         })
         
+    except RuntimeError:
+        return jsonify({'error': 'Não foi possível analisar o ficheiro de vídeo'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
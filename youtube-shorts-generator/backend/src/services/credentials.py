@@ -0,0 +1,39 @@
+import base64
+import hashlib
+import json
+
+from flask import current_app
+
+# A cryptography só é importada quando há credenciais a cifrar, para não
+# atrasar o arranque da aplicação
+
+
+def _fernet():
+    from cryptography.fernet import Fernet
+
+    key = hashlib.sha256(current_app.config['SECRET_KEY'].encode('utf-8')).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def seal_credentials(credentials):
+    """Cifrar umas credenciais OAuth (dicionário) com a SECRET_KEY da aplicação
+
+    Para as credenciais poderem ser guardadas fora da sessão, por exemplo
+    nos argumentos de uma tarefa da fila, sem o refresh token em claro.
+    Precisa de um contexto da aplicação.
+    """
+    return _fernet().encrypt(json.dumps(credentials).encode('utf-8')).decode('ascii')
+
+
+def open_credentials(sealed):
+    """Decifrar credenciais de seal_credentials
+
+    Levanta ValueError se tiverem sido cifradas com outra SECRET_KEY (o
+    servidor web e os workers têm de usar a mesma).
+    """
+    from cryptography.fernet import InvalidToken
+
+    try:
+        return json.loads(_fernet().decrypt(sealed.encode('ascii')))
+    except (InvalidToken, AttributeError):
+        raise ValueError('Credenciais inválidas ou cifradas com outra SECRET_KEY')
@@ -0,0 +1,306 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from services.metrics import cache_source, count_bytes, track_stage
+from services.probe import SIDECAR_SUFFIX
+from services.singleflight import SingleFlight
+from services.workspace import workspace
+
+# Diretório partilhado pelos downloads em cache
+DOWNLOAD_CACHE_DIR = os.environ.get(
+    'DOWNLOAD_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'shorts-download-cache')
+)
+# Espaço máximo em disco ocupado pela cache (por omissão 10 GiB)
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('DOWNLOAD_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+# Margem (segundos) descarregada antes e depois de cada segmento no modo por janelas
+RANGE_PADDING = float(os.environ.get('RANGE_PADDING', 2.0))
+# Re-encode nos cortes das janelas em vez de copiar a partir do keyframe anterior
+RANGE_PRECISE_CUTS = os.environ.get('RANGE_PRECISE_CUTS', 'false').lower() == 'true'
+
+STAGING_PREFIX = '.staging-'
+
+
+class DownloadCache:
+    """Cache de vídeos descarregados com chave (id do vídeo, seletor de formato)
+
+    Cada entrada é uma diretoria com o nome da chave. O download é feito numa
+    diretoria de staging e publicado com um rename atómico, por isso uma
+    entrada visível está sempre completa. Quando o total passa de max_bytes
+    são removidas as entradas usadas há mais tempo. O tamanho de uma entrada
+    conta tudo o que está na diretoria, incluindo o <vídeo>.probe.json e as
+    pré-visualizações da fonte criados depois do download.
+
+    A diretoria pode ser partilhada por vários processos (servidor web e
+    workers): as entradas e o último uso (mtime da diretoria da entrada) são lidos do disco
+    antes de cada remoção e as entradas são apagadas com workspace.remove(),
+    que não apaga ficheiros em uso noutro processo.
+    """
+
+    def __init__(self, root=DOWNLOAD_CACHE_DIR, max_bytes=DOWNLOAD_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # chave -> (caminho, tamanho), do menos para o mais recente
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._load_existing()
+
+    @staticmethod
+    def make_key(video_id, format_selector):
+        return hashlib.sha256(f'{video_id}\0{format_selector}'.encode('utf-8')).hexdigest()[:32]
+
+    def get_or_download(self, video_id, format_selector, download):
+        """Devolver o ficheiro em cache ou chamar download(diretoria) para o obter
+
+        download recebe a diretoria de staging e devolve o caminho do ficheiro
+        descarregado dentro dela. Pedidos concorrentes para a mesma chave
+        esperam pelo mesmo download.
+        """
+        key = self.make_key(video_id, format_selector)
+
+        path = self._lookup(key)
+        if path:
+            with self._lock:
+                self.hits += 1
+            return path
+
+        def fetch():
+            # Outro pedido pode ter publicado a entrada entretanto
+            return self._lookup(key) or self._fetch(key, download)
+
+        path, shared = self._flights.do(key, fetch)
+        with self._lock:
+            if shared:
+                self.shared += 1
+            else:
+                self.misses += 1
+        return path
+
+    def peek(self, video_id, format_selector):
+        """Ficheiro em cache de (video_id, format_selector), sem descarregar nem contar como hit"""
+        return self._lookup(self.make_key(video_id, format_selector))
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            path = entry[0] if entry and os.path.exists(entry[0]) else None
+            if not path:
+                # Pode ter sido publicada por outro processo
+                entry_dir = os.path.join(self.root, key)
+                path = _entry_video(entry_dir)
+                if not path:
+                    self._entries.pop(key, None)
+                    return None
+                self._entries[key] = (path, _entry_bytes(entry_dir))
+            self._entries.move_to_end(key)
+            # O último uso fica na diretoria: o mtime do vídeo indexa a cache do ffprobe
+            _touch(os.path.join(self.root, key))
+            return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': sum(size for _, size in self._entries.values()),
+                'max_bytes': self.max_bytes
+            }
+
+    def _fetch(self, key, download):
+        staging_dir = tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.root)
+        final_dir = os.path.join(self.root, key)
+        try:
+            # Em uso para a limpeza de outro processo que arranque não o apagar
+            with workspace.using(staging_dir), track_stage('download'):
+                staged_path = download(staging_dir)
+                if not staged_path or not os.path.exists(staged_path):
+                    raise RuntimeError('Falha no download do vídeo')
+            count_bytes('downloaded', staged_path)
+            path = self._publish(staging_dir, final_dir, staged_path)
+        finally:
+            # Depois do rename já não existe
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        with self._lock:
+            self._entries[key] = (path, _entry_bytes(final_dir))
+            self._entries.move_to_end(key)
+            self._evict(keep=key)
+        return path
+
+    @staticmethod
+    def _publish(staging_dir, final_dir, staged_path):
+        """Publicar a entrada com um rename e devolver o caminho do vídeo publicado"""
+        if os.path.isdir(final_dir) and not _entry_video(final_dir):
+            workspace.remove(final_dir)
+        try:
+            os.rename(staging_dir, final_dir)
+        except OSError:
+            # Outro processo publicou a mesma entrada entretanto: fica a dele
+            path = _entry_video(final_dir)
+            if not path:
+                raise
+            return path
+        return os.path.join(final_dir, os.path.relpath(staged_path, staging_dir))
+
+    def _evict(self, keep):
+        # Reler do disco: outros processos publicam entradas e os sidecars e as
+        # pré-visualizações aparecem depois da publicação
+        self._entries = self._scan()
+        total = sum(size for _, size in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            # Não apagar a entrada acabada de publicar nem ficheiros em uso por um job
+            if key == keep or not workspace.remove(os.path.join(self.root, key)):
+                continue
+            _, size = self._entries.pop(key)
+            total -= size
+            self.evictions += 1
+
+    def _scan(self):
+        """Entradas publicadas em disco, da usada há mais tempo para a mais recente"""
+        found = []
+        for name in os.listdir(self.root):
+            entry_dir = os.path.join(self.root, name)
+            if name.startswith(STAGING_PREFIX) or not os.path.isdir(entry_dir):
+                continue
+            path = _entry_video(entry_dir)
+            if not path:
+                continue
+            try:
+                found.append((os.path.getmtime(entry_dir), name, path, _entry_bytes(entry_dir)))
+            except OSError:
+                continue
+        return OrderedDict((key, (path, size)) for _, key, path, size in sorted(found))
+
+    def _load_existing(self):
+        # Downloads interrompidos por um reinício; os que outro processo ainda
+        # está a fazer estão em uso e ficam
+        for name in os.listdir(self.root):
+            if name.startswith(STAGING_PREFIX):
+                workspace.remove(os.path.join(self.root, name))
+        with self._lock:
+            self._evict(keep=None)
+
+
+def _entry_video(entry_dir):
+    """Vídeo de uma entrada da cache: o maior ficheiro, sem contar os sidecars do ffprobe"""
+    try:
+        names = os.listdir(entry_dir)
+    except OSError:
+        return None
+    files = [os.path.join(entry_dir, name) for name in names if SIDECAR_SUFFIX not in name]
+    files = [f for f in files if os.path.isfile(f)]
+    return max(files, key=os.path.getsize) if files else None
+
+
+def _entry_bytes(entry_dir):
+    """Espaço ocupado por todos os ficheiros de uma entrada da cache"""
+    size = 0
+    for dirpath, _, filenames in os.walk(entry_dir):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+    return size
+
+
+def _touch(path):
+    try:
+        now = time.time()
+        os.utime(path, (now, now))
+    except OSError:
+        pass
+
+
+def download_with_ytdlp(info, format_selector, target_dir, progress_hooks=None, section=None):
+    """Descarregar um vídeo já extraído (info do yt-dlp) para target_dir
+
+    Com section=(início, fim) só é descarregado esse intervalo de tempo; o
+    ffmpeg do yt-dlp faz seek por pedidos HTTP Range em vez de ler o vídeo todo.
+    """
+    # O yt-dlp é pesado de importar, por isso só é carregado quando há downloads
+    import yt_dlp
+    from yt_dlp.utils import download_range_func
+
+    ydl_opts = {
+        'format': format_selector,
+        'outtmpl': os.path.join(target_dir, '%(id)s.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'progress_hooks': progress_hooks or [],
+    }
+    if section:
+        ydl_opts['download_ranges'] = download_range_func(None, [section])
+        ydl_opts['force_keyframes_at_cuts'] = RANGE_PRECISE_CUTS
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.process_ie_result(info, download=True)
+
+    files = [
+        os.path.join(target_dir, f) for f in os.listdir(target_dir)
+        if f.endswith(('.mp4', '.webm', '.mkv'))
+    ]
+    if not files:
+        return None
+    return max(files, key=os.path.getsize)
+
+
+def download_video_cached(info, format_selector, progress_hooks=None):
+    """Obter o vídeo de info pela cache, descarregando-o só se necessário"""
+    return download_cache.get_or_download(
+        info['id'],
+        format_selector,
+        lambda target_dir: download_with_ytdlp(info, format_selector, target_dir, progress_hooks)
+    )
+
+
+def download_window_cached(info, format_selector, start, end, progress_hooks=None):
+    """Obter pela cache só o intervalo [start, end] do vídeo de info"""
+    return download_cache.get_or_download(
+        info['id'],
+        f'{format_selector}@{start:.3f}-{end:.3f}',
+        lambda target_dir: download_with_ytdlp(
+            info, format_selector, target_dir, progress_hooks, section=(start, end)
+        )
+    )
+
+
+def plan_download_windows(segments, padding=RANGE_PADDING, duration=None):
+    """Agrupar os segmentos em janelas de tempo a descarregar
+
+    Cada segmento é alargado em `padding` segundos de cada lado e as janelas
+    que se sobrepõem são juntas. Cada janela indica os índices dos
+    segmentos que cobre.
+    """
+    windows = []
+    for index, segment in sorted(enumerate(segments), key=lambda item: item[1]['start']):
+        start = max(0, segment['start'] - padding)
+        end = segment['end'] + padding
+        if duration:
+            end = min(end, duration)
+
+        if windows and start <= windows[-1]['end']:
+            windows[-1]['end'] = max(windows[-1]['end'], end)
+            windows[-1]['segments'].append(index)
+        else:
+            windows.append({'start': start, 'end': end, 'segments': [index]})
+    return windows
+
+
+download_cache = DownloadCache()
+cache_source('downloads', download_cache)
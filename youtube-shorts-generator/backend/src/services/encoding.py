@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+# Perfis de encode: preset e CRF do libx264, threads (None = orçamento de CPU) e bitrate do AAC
+ENCODING_PROFILES = {
+    'preview': {'preset': 'veryfast', 'crf': 30, 'threads': None, 'audio_bitrate': '96k'},
+    'standard': {'preset': 'medium', 'crf': 23, 'threads': None, 'audio_bitrate': '128k'},
+    'archive': {'preset': 'slow', 'crf': 18, 'threads': None, 'audio_bitrate': '192k'},
+}
+ENCODING_PROFILE = os.environ.get('ENCODING_PROFILE', 'standard')
+# Resultados do último benchmark nesta máquina
+ENCODING_BENCHMARK_FILE = os.environ.get(
+    'ENCODING_BENCHMARK_FILE',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'encoding_benchmark.json')
+)
+# Alvos usados pelo perfil 'auto': CRF máximo (qualidade) e bitrate máximo (tamanho)
+ENCODING_TARGET_MAX_CRF = int(os.environ.get('ENCODING_TARGET_MAX_CRF', 28))
+ENCODING_TARGET_MAX_KBPS = int(os.environ.get('ENCODING_TARGET_MAX_KBPS', 0))
+
+# Filtro do benchmark, igual ao usado nos shorts
+BENCHMARK_FILTER = 'scale=720:1280:force_original_aspect_ratio=increase,crop=720:1280'
+
+
+def resolve_profile(name=None):
+    """Devolver o nome de um perfil válido ('auto' escolhe pelo benchmark)"""
+    name = name or ENCODING_PROFILE
+    if name == 'auto':
+        return select_profile()
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"Perfil de encode inválido, use um de: {', '.join(list(ENCODING_PROFILES) + ['auto'])}")
+    return name
+
+
+def video_encoder_args(profile=None, threads=None):
+    """Argumentos do ffmpeg para o vídeo de um perfil"""
+    settings = ENCODING_PROFILES[resolve_profile(profile)]
+    args = [
+        '-c:v', 'libx264',
+        '-preset', settings['preset'],
+        '-crf', str(settings['crf']),
+        '-pix_fmt', 'yuv420p',
+    ]
+    threads = settings['threads'] or threads
+    if threads:
+        args += ['-threads', str(threads)]
+    return args
+
+
+def audio_encoder_args(profile=None):
+    """Argumentos do ffmpeg para o áudio de um perfil"""
+    settings = ENCODING_PROFILES[resolve_profile(profile)]
+    return ['-c:a', 'aac', '-b:a', settings['audio_bitrate']]
+
+
+def load_benchmark(path=ENCODING_BENCHMARK_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def select_profile(max_crf=ENCODING_TARGET_MAX_CRF, max_kbps=ENCODING_TARGET_MAX_KBPS, benchmark=None):
+    """Escolher o perfil mais rápido nesta máquina que cumpre os alvos
+
+    A qualidade é medida pelo CRF do perfil e o tamanho pelo bitrate obtido
+    no benchmark. Sem benchmark ou sem nenhum perfil que cumpra os alvos,
+    devolve o perfil por omissão.
+    """
+    benchmark = benchmark or load_benchmark()
+    default = ENCODING_PROFILE if ENCODING_PROFILE in ENCODING_PROFILES else 'standard'
+    if not benchmark:
+        return default
+
+    candidates = []
+    for name, result in benchmark.get('profiles', {}).items():
+        if name not in ENCODING_PROFILES or result.get('error'):
+            continue
+        if ENCODING_PROFILES[name]['crf'] > max_crf:
+            continue
+        if max_kbps and result['bitrate_kbps'] > max_kbps:
+            continue
+        candidates.append((result['speed'], name))
+
+    if not candidates:
+        return default
+    return max(candidates)[1]
+
+
+def generate_test_clip(output_path, duration=10, size='1280x720', rate=30):
+    """Gerar um clip sintético reproduzível (testsrc2 + sine) com o ffmpeg"""
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate={rate}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-t', str(duration),
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-y', output_path
+    ]
+    subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return output_path
+
+
+def benchmark_profile(name, clip_path, output_dir, duration, rate):
+    """Medir o encode de um perfil sobre o clip de teste"""
+    output_path = os.path.join(output_dir, f'{name}.mp4')
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', clip_path,
+        '-vf', BENCHMARK_FILTER,
+    ] + video_encoder_args(name, threads=os.cpu_count()) + audio_encoder_args(name) + ['-y', output_path]
+
+    started = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        return {'error': result.stderr.strip()[-500:]}
+
+    size = os.path.getsize(output_path)
+    return {
+        'seconds': round(elapsed, 3),
+        'fps': round(duration * rate / elapsed, 1),
+        'speed': round(duration / elapsed, 2),
+        'bytes': size,
+        'bitrate_kbps': round(size * 8 / duration / 1000, 1)
+    }
+
+
+def benchmark_profiles(duration=10, size='1280x720', rate=30, output_path=ENCODING_BENCHMARK_FILE):
+    """Correr todos os perfis num clip sintético e gravar os resultados"""
+    work_dir = tempfile.mkdtemp(prefix='encoding-benchmark-')
+    try:
+        clip_path = generate_test_clip(os.path.join(work_dir, 'clip.mp4'), duration, size, rate)
+        results = {
+            name: benchmark_profile(name, clip_path, work_dir, duration, rate)
+            for name in ENCODING_PROFILES
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    benchmark = {
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'created_at': time.time(),
+        'clip': {'duration': duration, 'size': size, 'rate': rate},
+        'profiles': results
+    }
+    if output_path:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(benchmark, f, indent=2)
+    return benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dos perfis de encode nesta máquina')
+    parser.add_argument('--duration', type=int, default=10, help='duração do clip de teste (segundos)')
+    parser.add_argument('--size', default='1280x720', help='resolução do clip de teste')
+    parser.add_argument('--output', default=ENCODING_BENCHMARK_FILE, help='ficheiro JSON dos resultados')
+    args = parser.parse_args()
+
+    benchmark = benchmark_profiles(args.duration, args.size, output_path=args.output)
+    for name, result in benchmark['profiles'].items():
+        if result.get('error'):
+            print(f"{name:10} erro: {result['error']}")
+        else:
+            print(f"{name:10} {result['fps']:8.1f} fps  {result['speed']:6.2f}x  {result['bitrate_kbps']:8.1f} kb/s")
+    print(f"Perfil escolhido para 'auto': {select_profile(benchmark=benchmark)}")
+    print(f"Resultados gravados em {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os
+import subprocess
+import threading
+from collections import deque
+
+from services.jobs import JobCancelled
+from services.metrics import ffmpeg_processes
+from services.tracing import span
+
+# Linhas finais do stderr guardadas para a mensagem de erro
+STDERR_TAIL_LINES = 50
+
+
+def parse_speed(value):
+    """Velocidade do ffmpeg ('1.52x', 'N/A') como número ou None"""
+    try:
+        return float(value.strip().rstrip('x'))
+    except (AttributeError, ValueError):
+        return None
+
+
+def progress_stats(block, duration=None):
+    """Converter um bloco de -progress (chave=valor) nas estatísticas do encode
+
+    out_time são os segundos de saída já escritos. Com a duração esperada
+    calcula-se também a fração concluída e o ETA a partir da velocidade.
+    """
+    try:
+        out_time = int(block.get('out_time_us') or block.get('out_time_ms') or 0) / 1_000_000
+    except ValueError:
+        out_time = 0.0
+    try:
+        frame = int(block.get('frame') or 0)
+        fps = float(block.get('fps') or 0)
+    except ValueError:
+        frame, fps = 0, 0.0
+    speed = parse_speed(block.get('speed'))
+
+    stats = {
+        'frame': frame,
+        'fps': fps,
+        'speed': speed,
+        'out_time': round(max(out_time, 0.0), 3),
+        'finished': block.get('progress') == 'end',
+    }
+    if duration:
+        remaining = max(duration - stats['out_time'], 0.0)
+        stats['progress'] = 1.0 if stats['finished'] else round(min(stats['out_time'] / duration, 1.0), 3)
+        stats['eta'] = round(remaining / speed, 1) if speed else None
+    return stats
+
+
+def parse_progress(lines, duration=None):
+    """Ler as linhas de -progress e devolver as estatísticas de cada bloco
+
+    O ffmpeg escreve um bloco de pares chave=valor a cada atualização,
+    terminado por progress=continue ou progress=end.
+    """
+    block = {}
+    for line in lines:
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            continue
+        block[key] = value
+        if key == 'progress':
+            yield progress_stats(block, duration)
+            block = {}
+
+
+def run_ffmpeg_progress(cmd, duration=None, on_progress=None):
+    """Executar o ffmpeg reportando o progresso à medida que avança
+
+    Acrescenta -progress pipe:1 ao comando e chama on_progress(stats) a
+    cada bloco lido do stdout (ver progress_stats). O stderr é lido numa
+    thread à parte para o pipe não encher. Levanta RuntimeError com o fim
+    do stderr se o ffmpeg falhar.
+    """
+    with span('ffmpeg', output=os.path.basename(str(cmd[-1])), duration=duration) as current:
+        stderr, returncode, stats = _run(cmd, duration, on_progress)
+        if current:
+            current.set(returncode=returncode, frames=stats.get('frame'), speed=stats.get('speed'))
+
+    if returncode != 0:
+        print(f"Erro no ffmpeg: {stderr}")
+        raise RuntimeError(f"Erro no ffmpeg: {stderr.strip()[-500:]}")
+    return stderr
+
+
+def _run(cmd, duration, on_progress):
+    cmd = [cmd[0], '-nostats', '-progress', 'pipe:1'] + list(cmd[1:])
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1
+    )
+
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    reader = threading.Thread(target=stderr_tail.extend, args=(process.stderr,), daemon=True)
+    reader.start()
+
+    last = {}
+    ffmpeg_processes.inc()
+    try:
+        for stats in parse_progress(process.stdout, duration):
+            last = stats
+            if not on_progress:
+                continue
+            try:
+                on_progress(stats)
+            except JobCancelled:
+                # O ffmpeg é terminado no finally
+                raise
+            except Exception as e:
+                # Um erro ao reportar o progresso não deve interromper o encode
+                print(f"Erro ao reportar o progresso do ffmpeg: {str(e)}")
+        returncode = process.wait()
+    finally:
+        ffmpeg_processes.dec()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        reader.join()
+        process.stdout.close()
+        process.stderr.close()
+
+    return ''.join(stderr_tail), returncode, last
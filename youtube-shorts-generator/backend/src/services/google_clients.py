@@ -0,0 +1,127 @@
+import hashlib
+import os
+import threading
+from functools import lru_cache
+
+from cachetools import TTLCache
+
+from services.metrics import cache_source
+
+# As bibliotecas da Google são importadas no primeiro uso, para não atrasarem
+# o arranque da aplicação
+
+# Número máximo de clientes da API guardados (um por credencial e serviço)
+GOOGLE_CLIENT_CACHE_SIZE = int(os.environ.get('GOOGLE_CLIENT_CACHE_SIZE', 256))
+# Tempo (segundos) durante o qual um cliente é reutilizado
+GOOGLE_CLIENT_TTL = int(os.environ.get('GOOGLE_CLIENT_TTL', 3600))
+
+
+@lru_cache(maxsize=None)
+def discovery_document(service, version):
+    """Documento de discovery incluído na biblioteca, sem pedidos à rede
+
+    Guarda-se o texto e não o dicionário porque o build_from_document altera
+    o documento que recebe.
+    """
+    from googleapiclient.discovery_cache import get_static_doc
+
+    document = get_static_doc(service, version)
+    if document is None:
+        raise ValueError(f'Documento de discovery de {service} {version} não incluído na biblioteca')
+    return document
+
+
+def credentials_key(info, service, version):
+    """Identidade de umas credenciais, estável quando o access token é renovado"""
+    identity = info.get('refresh_token') or info.get('token') or ''
+    raw = '\0'.join([service, version, info.get('client_id') or '', identity])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class PerThreadHttp:
+    """Um AuthorizedHttp por thread para as mesmas credenciais
+
+    O httplib2 não é thread-safe, por isso as threads partilham o cliente da
+    API mas executam os pedidos com execute(http=...) na sua própria
+    ligação. O build_http não segue o 308 dos uploads resumable como se
+    fosse um redirecionamento.
+    """
+
+    def __init__(self, credentials):
+        self._credentials = credentials
+        self._local = threading.local()
+
+    def get(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.http import build_http
+
+            http = self._local.http = AuthorizedHttp(self._credentials, http=build_http())
+        return http
+
+
+class GoogleClient:
+    """Cliente de um serviço da Google API já construído para umas credenciais"""
+
+    def __init__(self, service, credentials):
+        self.service = service
+        self.credentials = credentials
+        self._http = PerThreadHttp(credentials)
+
+    def http(self):
+        """Ligação da thread atual, para usar em execute(http=...)"""
+        return self._http.get()
+
+
+class GoogleClientCache:
+    """Cache LRU com TTL dos clientes da Google API por credencial
+
+    Construir um cliente com build() lê e processa o documento de discovery
+    e cria toda a árvore de recursos; aqui isso acontece uma vez por
+    credencial e o documento vem da cópia estática da biblioteca.
+    """
+
+    def __init__(self, maxsize=GOOGLE_CLIENT_CACHE_SIZE, ttl=GOOGLE_CLIENT_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, info, service, version):
+        key = credentials_key(info, service, version)
+        with self._lock:
+            client = self._cache.get(key)
+            if client is not None:
+                self.hits += 1
+                return client
+            self.misses += 1
+
+        from google.oauth2.credentials import Credentials
+        from googleapiclient.discovery import build_from_document
+
+        credentials = Credentials.from_authorized_user_info(info)
+        client = GoogleClient(
+            build_from_document(discovery_document(service, version), credentials=credentials),
+            credentials
+        )
+        with self._lock:
+            self._cache[key] = client
+        return client
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+
+google_clients = GoogleClientCache()
+cache_source('google_clients', google_clients)
+
+
+def youtube_client(info):
+    """Cliente da YouTube Data API v3 para as credenciais da sessão"""
+    return google_clients.get(info, 'youtube', 'v3')
@@ -0,0 +1,177 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Resolução da análise: um valor de áudio e de movimento por cada HOP segundos
+HOP = 0.5
+AUDIO_SAMPLE_RATE = 8000
+FRAME_WIDTH = 64
+FRAME_HEIGHT = 36
+# Segundos de áudio/vídeo lidos do pipe de cada vez (limita a memória usada)
+CHUNK_SECONDS = 60
+# Peso do volume face às mudanças de cena na pontuação de cada janela
+AUDIO_WEIGHT = float(os.environ.get('HIGHLIGHT_AUDIO_WEIGHT', 0.6))
+# Distância máxima (segundos) a que um limite pode ser movido para um silêncio
+SILENCE_SNAP = float(os.environ.get('HIGHLIGHT_SILENCE_SNAP', 3.0))
+MIN_SEGMENT_DURATION = 10
+
+
+def read_audio_levels(input_path):
+    """Volume (dB RMS) de cada HOP do áudio, lido por blocos de um pipe do ffmpeg"""
+    hop_samples = int(AUDIO_SAMPLE_RATE * HOP)
+    chunk_bytes = hop_samples * int(CHUNK_SECONDS / HOP) * 2
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', input_path,
+        '-vn', '-ac', '1', '-ar', str(AUDIO_SAMPLE_RATE),
+        '-f', 's16le', '-'
+    ]
+
+    levels = []
+    pending = np.empty(0, dtype=np.float32)
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype='<i2').astype(np.float32) / 32768.0
+            samples = np.concatenate([pending, samples])
+            usable = len(samples) - len(samples) % hop_samples
+            frames = samples[:usable].reshape(-1, hop_samples)
+            pending = samples[usable:]
+            levels.append(np.sqrt(np.mean(frames ** 2, axis=1)))
+
+    if not levels:
+        return np.empty(0, dtype=np.float32)
+    rms = np.concatenate(levels)
+    return 20 * np.log10(rms + 1e-6)
+
+
+def read_scene_changes(input_path):
+    """Diferença média entre frames consecutivos (em tons de cinzento, baixa resolução)"""
+    frame_bytes = FRAME_WIDTH * FRAME_HEIGHT
+    chunk_bytes = frame_bytes * int(CHUNK_SECONDS / HOP)
+    cmd = [
+        'ffmpeg', '-v', 'error',
+        '-i', input_path,
+        '-an',
+        '-vf', f'fps={1 / HOP},scale={FRAME_WIDTH}:{FRAME_HEIGHT},format=gray',
+        '-f', 'rawvideo', '-'
+    ]
+
+    changes = []
+    previous = None
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % frame_bytes
+            frames = np.frombuffer(data[:usable], dtype=np.uint8).reshape(-1, frame_bytes).astype(np.int16)
+            if previous is not None:
+                frames = np.concatenate([previous[None, :], frames])
+            else:
+                changes.append(np.zeros(1, dtype=np.float32))
+            changes.append(np.mean(np.abs(np.diff(frames, axis=0)), axis=1).astype(np.float32))
+            previous = frames[-1]
+
+    if not changes:
+        return np.empty(0, dtype=np.float32)
+    return np.concatenate(changes)
+
+
+def _normalize(values):
+    if values.size == 0:
+        return values
+    std = values.std()
+    if std < 1e-6:
+        return np.zeros_like(values)
+    return (values - values.mean()) / std
+
+
+def score_windows(audio_db, motion, window_hops):
+    """Pontuação de cada janela de window_hops, com somas cumulativas"""
+    length = max(audio_db.size, motion.size)
+    audio = np.zeros(length, dtype=np.float32)
+    audio[:audio_db.size] = _normalize(audio_db)
+    scene = np.zeros(length, dtype=np.float32)
+    scene[:motion.size] = _normalize(motion)
+
+    weight = AUDIO_WEIGHT if audio_db.size else 0.0
+    hop_scores = weight * audio + (1 - weight) * scene
+
+    window_hops = min(window_hops, length)
+    cumulative = np.concatenate([[0.0], np.cumsum(hop_scores)])
+    return (cumulative[window_hops:] - cumulative[:-window_hops]) / window_hops
+
+
+def pick_top_windows(window_scores, window_hops, count):
+    """Escolher as `count` janelas com maior pontuação que não se sobrepõem"""
+    taken = np.zeros(window_scores.size + window_hops, dtype=bool)
+    picked = []
+    for start in np.argsort(window_scores)[::-1]:
+        if len(picked) >= count:
+            break
+        if taken[start:start + window_hops].any():
+            continue
+        taken[start:start + window_hops] = True
+        picked.append(int(start))
+    return picked
+
+
+def snap_to_silence(position, audio_db, radius):
+    """Mover um limite (em hops) para o ponto mais silencioso à sua volta"""
+    if audio_db.size == 0:
+        return position
+    low = max(0, position - radius)
+    high = min(audio_db.size, position + radius + 1)
+    if low >= high:
+        return position
+    return low + int(np.argmin(audio_db[low:high]))
+
+
+def detect_highlights(input_path, max_duration=60, count=5):
+    """Detetar os melhores segmentos de um vídeo pelo volume e pelas mudanças de cena
+
+    O áudio e os frames são lidos por blocos de pipes do ffmpeg (em paralelo),
+    por isso a memória não depende da duração do vídeo. Devolve até `count`
+    segmentos sem sobreposição, ordenados pelo início, com os limites
+    ajustados a silêncios próximos.
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        audio_future = executor.submit(read_audio_levels, input_path)
+        motion_future = executor.submit(read_scene_changes, input_path)
+        audio_db = audio_future.result()
+        motion = motion_future.result()
+
+    length = max(audio_db.size, motion.size)
+    if length == 0:
+        return []
+
+    window_hops = max(1, int(max_duration / HOP))
+    window_scores = score_windows(audio_db, motion, window_hops)
+    window_hops = min(window_hops, length)
+    starts = pick_top_windows(window_scores, window_hops, count)
+
+    radius = int(SILENCE_SNAP / HOP)
+    segments = []
+    for start in sorted(starts):
+        end = start + window_hops
+        snapped_start = snap_to_silence(start, audio_db, radius)
+        snapped_end = min(snap_to_silence(end, audio_db, radius), snapped_start + window_hops, length)
+        if (snapped_end - snapped_start) * HOP < min(MIN_SEGMENT_DURATION, length * HOP):
+            snapped_start, snapped_end = start, end
+        # Não invadir o segmento anterior
+        if segments and snapped_start * HOP < segments[-1]['end']:
+            snapped_start = int(np.ceil(segments[-1]['end'] / HOP))
+        if (snapped_end - snapped_start) * HOP < min(MIN_SEGMENT_DURATION, length * HOP):
+            continue
+
+        segments.append({
+            'start': round(snapped_start * HOP, 2),
+            'end': round(snapped_end * HOP, 2),
+            'score': round(float(window_scores[min(start, window_scores.size - 1)]), 3)
+        })
+    return segments
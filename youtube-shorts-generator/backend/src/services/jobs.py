@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from services.metrics import metrics
+from services.tracing import bind_context, profiled, span
+
+# Número de jobs processados em simultâneo por instância
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Tempo (segundos) que um job terminado fica disponível para consulta
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 3600))
+# Intervalo (segundos) entre comentários keep-alive no stream de eventos de um job
+JOB_EVENTS_KEEPALIVE = int(os.environ.get('JOB_EVENTS_KEEPALIVE', 15))
+# Intervalo (segundos) entre leituras do estado de um job executado noutro processo
+JOB_EVENTS_POLL_INTERVAL = float(os.environ.get('JOB_EVENTS_POLL_INTERVAL', 1.0))
+
+
+class JobCancelled(Exception):
+    """O job foi cancelado a meio (ex.: o worker perdeu o lease da tarefa)"""
+
+
+class Job:
+    """Estado de um job de processamento e do progresso de cada etapa"""
+
+    def __init__(self, kind, stages, owner=None, on_change=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        # Tentativa da tarefa executada por um worker (None no pool do processo web)
+        self.attempt = None
+        self.status = 'queued'  # queued, running, completed, failed
+        self.stages = {
+            name: {'status': 'pending', 'progress': 0.0}
+            for name in stages
+        }
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+        self._stage_started = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._on_change = on_change
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Pedir a paragem do job: a próxima atualização do progresso levanta JobCancelled"""
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled('Job cancelado')
+
+    def start_stage(self, name):
+        self.check_cancelled()
+        with self._lock:
+            self.stages[name]['status'] = 'running'
+            self.updated_at = self._stage_started[name] = time.time()
+        self.notify()
+
+    def set_progress(self, name, progress, stats=None):
+        """Atualizar o progresso de uma etapa e estimar o tempo que falta
+
+        stats são as estatísticas do encode (frame, fps, speed, out_time...);
+        se trouxerem um ETA calculado pela velocidade do ffmpeg é esse que
+        se usa, senão o ETA é extrapolado do tempo já gasto na etapa.
+        """
+        self.check_cancelled()
+        progress = min(max(progress, 0.0), 1.0)
+        with self._lock:
+            stage = self.stages[name]
+            stage['progress'] = round(progress, 3)
+            self.updated_at = time.time()
+            eta = stats.get('eta') if stats else None
+            started = self._stage_started.get(name)
+            if eta is None and started and progress > 0:
+                eta = (self.updated_at - started) * (1 - progress) / progress
+            stage['eta'] = round(eta, 1) if eta is not None else None
+            if stats:
+                stage['stats'] = dict(stats)
+        self.notify()
+
+    def complete_stage(self, name):
+        self.check_cancelled()
+        with self._lock:
+            self.stages[name]['status'] = 'completed'
+            self.stages[name]['progress'] = 1.0
+            self.stages[name]['eta'] = 0.0
+            self.updated_at = time.time()
+        self.notify()
+
+    def notify(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+        if self._on_change:
+            self._on_change(self)
+
+    def wait_for_change(self, version, timeout=None):
+        """Esperar até a versão do estado ser diferente de `version` e devolvê-la"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'updated_at': self.updated_at
+            }
+
+
+def format_event(event, data, event_id=None):
+    """Mensagem de Server-Sent Events com os dados em JSON"""
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def job_events(job, keepalive=JOB_EVENTS_KEEPALIVE):
+    """Gerar os eventos SSE de um job até ele terminar
+
+    Emite 'progress' com o estado completo a cada alteração (as alterações
+    que chegam enquanto o cliente lê são juntas numa só) e 'done' com o
+    estado final. Sem alterações, envia um comentário a cada `keepalive`
+    segundos para os proxies não fecharem a ligação.
+    """
+    version = None
+    while True:
+        current = job.wait_for_change(version, timeout=keepalive)
+        if current == version:
+            yield ': keep-alive\n\n'
+            continue
+        version = current
+        if job.is_finished():
+            yield format_event('done', job.to_dict(), event_id=version)
+            return
+        yield format_event('progress', job.to_dict(), event_id=version)
+
+
+def poll_events(load, interval=JOB_EVENTS_POLL_INTERVAL, keepalive=JOB_EVENTS_KEEPALIVE):
+    """Gerar os eventos SSE de um job lendo o estado com load() a cada `interval`
+
+    Para jobs executados por um worker noutro processo, cujo estado só está
+    na base de dados. Os eventos são os mesmos de job_events.
+    """
+    last_update = None
+    last_sent = time.time()
+    while True:
+        state = load()
+        if state['status'] in ('completed', 'failed'):
+            yield format_event('done', state, event_id=state['updated_at'])
+            return
+        if state['updated_at'] != last_update:
+            last_update = state['updated_at']
+            last_sent = time.time()
+            yield format_event('progress', state, event_id=last_update)
+        elif time.time() - last_sent >= keepalive:
+            last_sent = time.time()
+            yield ': keep-alive\n\n'
+        time.sleep(interval)
+
+
+class JobQueue:
+    """Fila de jobs em memória executada por um pool de threads do processo"""
+
+    def __init__(self, max_workers=JOB_WORKERS, retention=JOB_RETENTION):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._retention = retention
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Registar listener(job), chamado sempre que o estado de um job muda"""
+        self._listeners.append(listener)
+
+    def submit(self, kind, fn, *args, stages=(), owner=None, **kwargs):
+        """Criar um job e agendar fn(job, *args, **kwargs) no pool"""
+        job = Job(kind, stages, owner=owner, on_change=self._notify)
+        self._notify(job)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        # O job continua o trace (e o perfil) do pedido que o criou, se houver
+        self._executor.submit(bind_context(self._run), job, fn, args, kwargs)
+        return job
+
+    def run(self, kind, fn, *args, job_id=None, created_at=None, attempt=None, stages=(), owner=None, **kwargs):
+        """Executar fn(job, *args, **kwargs) já, na thread atual, como um job da fila
+
+        Usado pelo worker, em que o job já existe na base de dados com
+        job_id. Devolve o job terminado (completed ou failed).
+        """
+        job = Job(kind, stages, owner=owner, on_change=self._notify)
+        job.id = job_id or job.id
+        job.created_at = created_at or job.created_at
+        job.attempt = attempt
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._run(job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def counts(self):
+        """Número de jobs em memória por (tipo, estado)"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[(job.kind, job.status)] = counts.get((job.kind, job.status), 0) + 1
+        return counts
+
+    def _notify(self, job):
+        for listener in self._listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                print(f"Erro ao notificar alteração do job {job.id}: {str(e)}")
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        job.updated_at = time.time()
+        job.notify()
+        try:
+            with span('job', kind=job.kind, job_id=job.id), profiled(f'job-{job.kind}-{job.id}'):
+                job.result = fn(job, *args, **kwargs)
+            job.status = 'completed'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            for stage in job.stages.values():
+                if stage['status'] == 'running':
+                    stage['status'] = 'failed'
+        job.updated_at = time.time()
+        job.notify()
+
+    def _prune(self):
+        # Descartar jobs terminados há mais tempo do que a retenção configurada
+        cutoff = time.time() - self._retention
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.is_finished() and job.updated_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_queue = JobQueue()
+metrics.gauge('shorts_jobs', 'Jobs em memória por tipo e estado', ('kind', 'status')).add_source(job_queue.counts)
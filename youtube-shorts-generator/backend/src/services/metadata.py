@@ -0,0 +1,165 @@
+import copy
+import os
+import re
+import threading
+
+from cachetools import TTLCache
+
+from services.metrics import cache_source, track_stage
+from services.singleflight import SingleFlight
+
+# Tempo (segundos) durante o qual a informação de um vídeo é reutilizada
+METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', 600))
+# Número máximo de vídeos guardados na cache
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', 512))
+# Número máximo de vídeos listados de uma playlist ou canal
+MAX_BATCH_VIDEOS = int(os.environ.get('MAX_BATCH_VIDEOS', 50))
+
+# watch?v=ID, youtu.be/ID, /shorts/ID, /embed/ID, /live/ID, /v/ID
+YOUTUBE_ID_PATTERN = re.compile(
+    r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/|/v/)([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])'
+)
+# Página inicial de um canal: /@nome, /channel/ID, /c/nome ou /user/nome (sem separador)
+CHANNEL_PATTERN = re.compile(r'youtube\.com/(?:@|channel/|c/|user/)[^/?#]+/?(?:[?#].*)?$')
+
+
+def canonical_video_id(url):
+    """Extrair o id de um URL do YouTube (ou devolver o URL se não for reconhecido)"""
+    match = YOUTUBE_ID_PATTERN.search(url)
+    return match.group(1) if match else url.strip()
+
+
+def is_channel_url(url):
+    return bool(CHANNEL_PATTERN.search(url))
+
+
+def extract_with_ytdlp(url):
+    """Obter a informação completa de um vídeo com o yt-dlp, sem download
+
+    Um URL de um vídeo dentro de uma playlist devolve só o vídeo.
+    """
+    # O yt-dlp é pesado de importar, por isso só é carregado quando é preciso
+    import yt_dlp
+
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,
+        # A cache é indexada pelo id do vídeo: watch?v=ID&list=... é só o vídeo
+        'noplaylist': True,
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def list_with_ytdlp(url, limit):
+    """Listar as entradas de uma playlist ou canal sem extrair cada vídeo
+
+    Com extract_flat o yt-dlp só lê as páginas da lista (id, título e
+    duração de cada entrada), o que custa um pedido por página em vez de
+    um por vídeo.
+    """
+    import yt_dlp
+
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'playlistend': limit,
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def list_entries(url, limit=MAX_BATCH_VIDEOS):
+    """Vídeos de uma playlist ou dos últimos uploads de um canal
+
+    Devolve (título da lista, [{'id', 'url', 'title', 'duration'}]), sem
+    repetidos e com no máximo `limit` vídeos. Levanta ValueError se o URL
+    não for uma lista.
+    """
+    if is_channel_url(url):
+        # A página inicial de um canal tem separadores; os uploads estão em /videos
+        url = re.sub(r'/?(?:[?#].*)?$', '', url) + '/videos'
+
+    with track_stage('list_entries'):
+        info = list_with_ytdlp(url, limit)
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        raise ValueError('O URL não é uma playlist nem um canal')
+
+    entries = []
+    seen = set()
+    for entry in info.get('entries') or []:
+        # Separadores de canal e playlists encaixadas não são vídeos
+        if not entry or entry.get('_type') == 'playlist' or not entry.get('id') or entry['id'] in seen:
+            continue
+        seen.add(entry['id'])
+        entry_url = entry.get('url') or ''
+        entries.append({
+            'id': entry['id'],
+            'url': entry_url if entry_url.startswith('http') else f"https://www.youtube.com/watch?v={entry['id']}",
+            'title': entry.get('title'),
+            'duration': entry.get('duration')
+        })
+        if len(entries) >= limit:
+            break
+    return info.get('title'), entries
+
+
+class MetadataCache:
+    """Cache com TTL da informação dos vídeos, indexada pelo id canónico
+
+    Pedidos concorrentes para o mesmo vídeo partilham uma só extração. Cada
+    chamada recebe uma cópia, porque o yt-dlp altera o dicionário ao
+    processar formatos e downloads.
+    """
+
+    def __init__(self, extractor=extract_with_ytdlp, ttl=METADATA_CACHE_TTL, maxsize=METADATA_CACHE_SIZE):
+        self._extractor = extractor
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def get(self, url):
+        key = canonical_video_id(url)
+
+        with self._lock:
+            info = self._cache.get(key)
+            if info is not None:
+                self.hits += 1
+                return copy.deepcopy(info)
+
+        info, shared = self._flights.do(key, lambda: self._extract(key, url))
+        with self._lock:
+            if shared:
+                self.shared += 1
+            else:
+                self.misses += 1
+        return copy.deepcopy(info)
+
+    def _extract(self, key, url):
+        with track_stage('extract_info'):
+            info = self._extractor(url)
+        with self._lock:
+            self._cache[key] = info
+        return info
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'entries': len(self._cache),
+                'max_entries': int(self._cache.maxsize),
+                'ttl': self._cache.ttl
+            }
+
+
+metadata_cache = MetadataCache()
+cache_source('metadata', metadata_cache)
@@ -0,0 +1,272 @@
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+from services.tracing import span
+
+# Limites (segundos) dos buckets da duração das etapas do pipeline
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Limites (segundos) dos buckets da duração dos pedidos HTTP
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metric:
+    """Métrica com etiquetas no formato de texto do Prometheus
+
+    Além dos valores registados, add_source(fn) junta valores lidos no
+    momento da recolha: fn() devolve {(valores das etiquetas): valor}. Serve
+    para expor contadores que já existem noutros serviços (ex.: hits das
+    caches) sem os contar duas vezes.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._sources = []
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} precisa das etiquetas: {', '.join(self.labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def add_source(self, fn):
+        self._sources.append(fn)
+
+    def samples(self):
+        """Lista de (sufixo, etiquetas, valor) para a exposição"""
+        with self._lock:
+            values = dict(self._values)
+        for source in self._sources:
+            try:
+                values.update({tuple(str(v) for v in key): value for key, value in source().items()})
+            except Exception as e:
+                print(f"Erro ao recolher a métrica {self.name}: {str(e)}")
+        return [('', dict(zip(self.labels, key)), value) for key, value in sorted(values.items())]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Um contador só pode aumentar')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        """Somar 1 enquanto o bloco corre"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', {**labels, 'le': _format_value(float(bound))}, cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Registo das métricas da aplicação e exposição em /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'A métrica {name} já existe com outro tipo')
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        return self._register(Histogram, name, documentation, labels, buckets)
+
+    def render(self):
+        """Todas as métricas no formato de texto do Prometheus (0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            documentation = metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')
+            lines.append(f'# HELP {metric.name} {documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app):
+        """Medir a duração de todos os pedidos e expor GET /metrics"""
+
+        @app.before_request
+        def start_timer():
+            g.metrics_started = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            started = g.get('metrics_started')
+            if started is not None and request.endpoint != 'metrics':
+                http_request_duration.observe(
+                    time.perf_counter() - started,
+                    endpoint=request.endpoint or 'not_found',
+                    method=request.method,
+                    status=response.status_code
+                )
+            return response
+
+        app.add_url_rule('/metrics', 'metrics', lambda: Response(self.render(), content_type=CONTENT_TYPE))
+
+
+metrics = MetricsRegistry()
+
+stage_duration = metrics.histogram(
+    'shorts_stage_duration_seconds',
+    'Duração de cada etapa do pipeline (extract_info, download, encode, watermark, upload)',
+    ('stage',)
+)
+stage_errors = metrics.counter('shorts_stage_errors_total', 'Etapas do pipeline que terminaram com erro', ('stage',))
+bytes_total = metrics.counter(
+    'shorts_bytes_total',
+    'Bytes descarregados, encodados e enviados para as plataformas',
+    ('direction',)
+)
+cache_requests = metrics.counter('shorts_cache_requests_total', 'Pedidos às caches por resultado', ('cache', 'result'))
+ffmpeg_processes = metrics.gauge('shorts_ffmpeg_processes', 'Processos ffmpeg em execução')
+uploads_in_progress = metrics.gauge('shorts_uploads_in_progress', 'Uploads em curso por plataforma', ('platform',))
+http_request_duration = metrics.histogram(
+    'shorts_http_request_duration_seconds',
+    'Duração dos pedidos HTTP por endpoint',
+    ('endpoint', 'method', 'status'),
+    HTTP_BUCKETS
+)
+
+
+@contextmanager
+def track_stage(stage, **attributes):
+    """Medir a duração de uma etapa do pipeline e contar as que falham
+
+    A etapa fica também como span no trace do pedido, se houver (ver
+    services.tracing), com os atributos indicados.
+    """
+    started = time.perf_counter()
+    try:
+        with span(stage, **attributes) as current:
+            yield current
+    except Exception:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        stage_duration.observe(time.perf_counter() - started, stage=stage)
+
+
+def count_bytes(direction, *paths):
+    """Somar ao contador de bytes o tamanho dos ficheiros indicados"""
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except (OSError, TypeError):
+            pass
+    bytes_total.inc(size, direction=direction)
+
+
+def cache_source(name, cache):
+    """Expor os hits/misses de stats() de uma cache em shorts_cache_requests_total"""
+    results = {'hit': 'hits', 'miss': 'misses', 'shared': 'shared'}
+
+    def collect():
+        stats = cache.stats()
+        return {(name, result): stats[key] for result, key in results.items() if key in stats}
+
+    cache_requests.add_source(collect)
@@ -0,0 +1,182 @@
+import os
+import queue
+import threading
+
+from services.metrics import metrics
+from services.tracing import bind_context
+
+# Itens à espera entre duas etapas de um pipeline em lote
+BATCH_QUEUE_SIZE = int(os.environ.get('BATCH_QUEUE_SIZE', 2))
+
+# Marca de fim de trabalho para os workers de uma etapa
+_DONE = object()
+
+pipeline_queued = metrics.gauge(
+    'shorts_pipeline_queued',
+    'Itens à espera de cada etapa dos pipelines em lote (na fila ou bloqueados à entrada)',
+    ('stage',)
+)
+
+
+class PipelineStage:
+    """Etapa de um pipeline: fn(item) devolve o item para a etapa seguinte"""
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+
+
+class StagedPipeline:
+    """Etapas com concorrência própria ligadas por filas limitadas
+
+    Cada etapa tem `workers` threads que tiram itens da sua fila de entrada e
+    põem o resultado na fila da etapa seguinte. Cada fila guarda no máximo
+    queue_size itens; se a seguinte estiver cheia, os workers da etapa
+    anterior ficam bloqueados. Assim uma etapa rápida (downloads) não se
+    adianta mais do que workers + queue_size itens a uma lenta (encodes) e
+    o disco só guarda os ficheiros que estão quase a ser usados.
+
+    Um item que falha numa etapa sai do pipeline e os outros continuam.
+    on_update(stage, progress, stats) é chamado sempre que uma etapa muda;
+    on_item(index, outcome) quando um item sai do pipeline, com sucesso ou
+    não; cleanup(item) recebe o último valor de cada item nessa altura (ex.:
+    para libertar ficheiros reservados por uma etapa). Quando stop() for
+    verdadeiro os itens que ainda não entraram numa etapa falham sem a correr.
+    """
+
+    def __init__(self, stages, queue_size=BATCH_QUEUE_SIZE, on_update=None, on_item=None, cleanup=None,
+                 stop=None):
+        self.stages = list(stages)
+        self.queue_size = max(1, queue_size)
+        self._on_update = on_update
+        self._on_item = on_item
+        self._cleanup = cleanup
+        self._stop = stop
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        """Passar items por todas as etapas e devolver os resultados pela ordem de items
+
+        Cada resultado é um dicionário com 'result' ou 'error' e, em caso de
+        erro, 'stage' com o nome da etapa que falhou.
+        """
+        items = list(items)
+        self._total = len(items)
+        self._outcomes = [None] * len(items)
+        self._counts = {
+            stage.name: {'queued': 0, 'active': 0, 'done': 0, 'failed': 0, 'skipped': 0}
+            for stage in self.stages
+        }
+        self._remaining = {stage.name: stage.workers for stage in self.stages}
+        self._queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        if not items:
+            return []
+
+        threads = [threading.Thread(target=bind_context(self._feed), args=(items,), name='pipeline-feed', daemon=True)]
+        for position, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=bind_context(self._work),
+                    args=(position,),
+                    name=f'pipeline-{stage.name}-{n}',
+                    daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self._outcomes
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._counts.items()}
+
+    def _feed(self, items):
+        for index, item in enumerate(items):
+            self._put(0, (index, item))
+        for _ in range(self.stages[0].workers):
+            self._queues[0].put(_DONE)
+
+    def _put(self, position, entry):
+        name = self.stages[position].name
+        with self._lock:
+            self._counts[name]['queued'] += 1
+        pipeline_queued.inc(stage=name)
+        # Bloqueia enquanto a fila estiver cheia: é aqui que a pressão recua
+        self._queues[position].put(entry)
+        self._update(name)
+
+    def _work(self, position):
+        stage = self.stages[position]
+        last = position == len(self.stages) - 1
+        while True:
+            entry = self._queues[position].get()
+            if entry is _DONE:
+                break
+            index, item = entry
+            with self._lock:
+                self._counts[stage.name]['queued'] -= 1
+                self._counts[stage.name]['active'] += 1
+            pipeline_queued.dec(stage=stage.name)
+            self._update(stage.name)
+
+            try:
+                if self._stop and self._stop():
+                    raise RuntimeError('Pipeline interrompido')
+                item = stage.fn(item)
+            except Exception as e:
+                self._finish_stage(stage.name, 'failed')
+                self._skip(position + 1)
+                self._leave(index, item, {'result': None, 'error': str(e), 'stage': stage.name})
+                continue
+
+            self._finish_stage(stage.name, 'done')
+            if last:
+                self._leave(index, item, {'result': item, 'error': None})
+            else:
+                self._put(position + 1, (index, item))
+
+        # O último worker a sair avisa os da etapa seguinte
+        with self._lock:
+            self._remaining[stage.name] -= 1
+            exhausted = self._remaining[stage.name] == 0
+        if exhausted and not last:
+            for _ in range(self.stages[position + 1].workers):
+                self._queues[position + 1].put(_DONE)
+
+    def _finish_stage(self, name, result):
+        with self._lock:
+            self._counts[name]['active'] -= 1
+            self._counts[name][result] += 1
+        self._update(name)
+
+    def _skip(self, position):
+        # Um item que falhou já não passa pelas etapas seguintes
+        for stage in self.stages[position:]:
+            with self._lock:
+                self._counts[stage.name]['skipped'] += 1
+            self._update(stage.name)
+
+    def _leave(self, index, item, outcome):
+        self._outcomes[index] = outcome
+        # Um erro aqui não pode parar o worker, senão as etapas seguintes nunca terminam
+        try:
+            if self._cleanup:
+                self._cleanup(item)
+            if self._on_item:
+                self._on_item(index, outcome)
+        except Exception as e:
+            print(f"Erro ao concluir o item {index} do pipeline: {str(e)}")
+
+    def _update(self, name):
+        if not self._on_update:
+            return
+        with self._lock:
+            counts = dict(self._counts[name])
+        processed = counts['done'] + counts['failed'] + counts['skipped']
+        # Como em _leave, um erro a reportar não pode parar os workers
+        try:
+            self._on_update(name, processed / self._total, counts)
+        except Exception as e:
+            print(f"Erro ao reportar o progresso da etapa {name}: {str(e)}")
@@ -0,0 +1,167 @@
+import json
+import math
+import os
+
+from services.metrics import track_stage
+from services.singleflight import SingleFlight
+
+# Gerar sprite e proxy de pré-visualização no render dos shorts
+PREVIEWS_ENABLED = os.environ.get('PREVIEWS_ENABLED', 'true').lower() == 'true'
+# Segundos entre as imagens do sprite de um short
+PREVIEW_INTERVAL = float(os.environ.get('PREVIEW_INTERVAL', 2.0))
+# Largura (píxeis) de cada imagem do sprite e colunas por linha
+PREVIEW_TILE_WIDTH = int(os.environ.get('PREVIEW_TILE_WIDTH', 90))
+PREVIEW_COLUMNS = int(os.environ.get('PREVIEW_COLUMNS', 10))
+# Altura (píxeis) e débito máximo do proxy de um short
+PROXY_HEIGHT = int(os.environ.get('PROXY_HEIGHT', 320))
+PROXY_MAXRATE = os.environ.get('PROXY_MAXRATE', '250k')
+PROXY_AUDIO_BITRATE = os.environ.get('PROXY_AUDIO_BITRATE', '32k')
+
+# Na linha temporal da fonte (16:9): largura das imagens, máximo de imagens e altura do proxy
+SOURCE_TILE_WIDTH = int(os.environ.get('SOURCE_TILE_WIDTH', 160))
+SOURCE_MAX_FRAMES = int(os.environ.get('SOURCE_MAX_FRAMES', 100))
+SOURCE_PROXY_HEIGHT = int(os.environ.get('SOURCE_PROXY_HEIGHT', 180))
+
+# Tempo (segundos) de cache HTTP dos ficheiros de pré-visualização; não mudam depois de criados
+PREVIEW_CACHE_MAX_AGE = int(os.environ.get('PREVIEW_CACHE_MAX_AGE', 365 * 24 * 3600))
+
+# Ficheiros servidos em /preview e /source-preview: nome -> mimetype
+PREVIEW_ASSETS = {
+    'sprite.jpg': 'image/jpeg',
+    'sprite.json': 'application/json',
+    'proxy.mp4': 'video/mp4',
+}
+
+_flights = SingleFlight()
+
+
+def preview_paths(output_dir, basename):
+    """Caminhos do sprite, da descrição do sprite e do proxy de um vídeo"""
+    return {
+        asset: os.path.join(output_dir, f'{basename}.{asset}')
+        for asset in PREVIEW_ASSETS
+    }
+
+
+def short_preview_paths(short_path):
+    """Caminhos das pré-visualizações de um short a partir do seu ficheiro"""
+    root, _ = os.path.splitext(short_path)
+    return preview_paths(os.path.dirname(root), os.path.basename(root))
+
+
+def sprite_layout(duration, interval=PREVIEW_INTERVAL, tile_width=PREVIEW_TILE_WIDTH,
+                  columns=PREVIEW_COLUMNS, max_frames=None):
+    """Grelha do sprite: uma imagem a cada `interval` segundos
+
+    Com max_frames o intervalo aumenta para o sprite não passar desse
+    número de imagens (vídeos longos).
+    """
+    duration = max(float(duration or 0), 0.1)
+    if max_frames:
+        interval = max(interval, duration / max_frames)
+    frames = max(1, math.ceil(duration / interval))
+    columns = min(columns, frames)
+    return {
+        'interval': round(interval, 3),
+        'frames': frames,
+        'columns': columns,
+        'rows': math.ceil(frames / columns),
+        'tile_width': tile_width
+    }
+
+
+def preview_graph(source, layout, proxy_height=PROXY_HEIGHT, main=None, suffix=''):
+    """Ramos do grafo que produzem o sprite e o proxy a partir de [source]
+
+    Com main, [source] é também repartido para essa etiqueta, que segue
+    para a saída principal. As saídas são [sprite<suffix>] e [proxy<suffix>].
+    """
+    branches = [f'[ps{suffix}]', f'[pp{suffix}]']
+    if main:
+        branches.insert(0, f'[{main}]')
+    return ';'.join([
+        f"[{source}]split={len(branches)}{''.join(branches)}",
+        f"[ps{suffix}]fps=1/{layout['interval']},scale={layout['tile_width']}:-2,"
+        f"tile={layout['columns']}x{layout['rows']}[sprite{suffix}]",
+        f'[pp{suffix}]scale=-2:{proxy_height}[proxy{suffix}]',
+    ])
+
+
+def preview_output_args(paths, audio=None, suffix=''):
+    """Saídas do ffmpeg para o sprite e o proxy de preview_graph
+
+    audio é o stream (ex.: '0:a?' ou '[apx0]') que vai para o proxy, ou None.
+    O proxy tem o moov no início para o player começar sem o ler todo.
+    """
+    args = [
+        '-map', f'[sprite{suffix}]', '-frames:v', '1', '-q:v', '5', '-y', paths['sprite.jpg'],
+        '-map', f'[proxy{suffix}]',
+    ]
+    args += ['-map', audio, '-c:a', 'aac', '-b:a', PROXY_AUDIO_BITRATE, '-ac', '1'] if audio else ['-an']
+    args += [
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '32',
+        '-maxrate', PROXY_MAXRATE, '-bufsize', PROXY_MAXRATE,
+        '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+        '-y', paths['proxy.mp4']
+    ]
+    return args
+
+
+def write_sprite_layout(paths, layout):
+    """Gravar a grelha do sprite ao lado dele, para o editor saber onde está cada imagem"""
+    with open(paths['sprite.json'], 'w') as f:
+        json.dump(layout, f)
+
+
+def previews_ready(paths):
+    return all(os.path.exists(path) for path in paths.values())
+
+
+def preview_urls(prefix):
+    """URLs das pré-visualizações servidas em `prefix` (ex.: /api/video/preview/<id>)"""
+    return {
+        'sprite_url': f'{prefix}/sprite.jpg',
+        'sprite_layout_url': f'{prefix}/sprite.json',
+        'proxy_url': f'{prefix}/proxy.mp4'
+    }
+
+
+def source_preview_paths(source_path):
+    """Pré-visualizações da fonte, guardadas ao lado dela na cache de downloads
+
+    Ficam na diretoria da entrada da cache, por isso são removidas com ela.
+    """
+    return preview_paths(os.path.join(os.path.dirname(source_path), 'preview'), 'source')
+
+
+def create_source_preview(source_path, duration, run_ffmpeg):
+    """Criar (uma só vez por fonte) o sprite e o proxy da linha temporal do vídeo
+
+    run_ffmpeg(cmd, duration=...) executa o comando. Pedidos concorrentes
+    para a mesma fonte esperam pela mesma geração. Devolve os caminhos.
+    """
+    paths = source_preview_paths(source_path)
+    if previews_ready(paths):
+        return paths
+
+    def generate():
+        if previews_ready(paths):
+            return paths
+        os.makedirs(os.path.dirname(paths['sprite.jpg']), exist_ok=True)
+        layout = sprite_layout(duration, tile_width=SOURCE_TILE_WIDTH, max_frames=SOURCE_MAX_FRAMES)
+        # Gravar com nomes temporários, para um ficheiro visível estar sempre completo
+        staging = {asset: f'{path}.part{os.path.splitext(path)[1]}' for asset, path in paths.items()}
+        cmd = [
+            'ffmpeg', '-i', source_path,
+            '-filter_complex', preview_graph('0:v', layout, proxy_height=SOURCE_PROXY_HEIGHT),
+        ] + preview_output_args(staging, audio='0:a?')
+        with track_stage('source_preview'):
+            run_ffmpeg(cmd, duration=duration)
+        write_sprite_layout(staging, layout)
+        # O sprite.json é o último a ser publicado e marca as pré-visualizações como prontas
+        for asset in ('sprite.jpg', 'proxy.mp4', 'sprite.json'):
+            os.replace(staging[asset], paths[asset])
+        return paths
+
+    paths, _ = _flights.do(source_path, generate)
+    return paths
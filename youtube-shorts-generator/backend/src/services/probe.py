@@ -0,0 +1,319 @@
+import bisect
+import hashlib
+import json
+import math
+import os
+import subprocess
+import threading
+
+from cachetools import LRUCache
+
+from services.metrics import cache_source, track_stage
+from services.singleflight import SingleFlight
+
+# Número de ficheiros cujo resultado do ffprobe fica em memória
+PROBE_CACHE_SIZE = int(os.environ.get('PROBE_CACHE_SIZE', 1024))
+# Gravar o resultado num ficheiro <vídeo>.probe.json ao lado do vídeo
+PROBE_SIDECAR = os.environ.get('PROBE_SIDECAR', 'true').lower() == 'true'
+# Bytes lidos do início e do fim do ficheiro para a impressão digital do conteúdo
+PROBE_HASH_BYTES = 64 * 1024
+# Duração mínima (segundos) de um segmento depois de ajustado à duração do vídeo
+MIN_SEGMENT_DURATION = float(os.environ.get('MIN_SEGMENT_DURATION', 1.0))
+
+SIDECAR_SUFFIX = '.probe.json'
+SIDECAR_VERSION = 1
+
+
+def _ffprobe(args):
+    result = subprocess.run(['ffprobe', '-v', 'error'] + args, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Erro no ffprobe: {result.stderr.strip()[-500:]}")
+    return result.stdout
+
+
+def _rotation(stream):
+    """Rotação de apresentação (0, 90, 180, 270) pela tag rotate ou pela display matrix"""
+    rotate = (stream.get('tags') or {}).get('rotate')
+    if rotate is None:
+        for side_data in stream.get('side_data_list') or []:
+            if 'rotation' in side_data:
+                # A display matrix indica a rotação no sentido contrário ao da tag
+                rotate = -float(side_data['rotation'])
+                break
+    try:
+        return int(round(float(rotate or 0))) % 360
+    except ValueError:
+        return 0
+
+
+def _frame_rate(value):
+    num, _, den = (value or '').partition('/')
+    try:
+        return round(float(num) / float(den or 1), 3) if float(den or 1) else None
+    except ValueError:
+        return None
+
+
+def ffprobe_media(path):
+    """Executar o ffprobe e obter a duração, as faixas e a rotação de um ficheiro
+
+    video e audio são a primeira faixa de cada tipo (ou None); streams
+    conta as faixas de cada tipo. Em video, display_width/display_height
+    são as dimensões depois de aplicada a rotação.
+    """
+    data = json.loads(_ffprobe([
+        '-show_entries',
+        'format=duration,format_name'
+        ':stream=index,codec_type,codec_name,width,height,pix_fmt,avg_frame_rate,channels,sample_rate'
+        ':stream_tags=rotate:stream_side_data=rotation',
+        '-of', 'json',
+        path
+    ]) or '{}')
+
+    media = {
+        'duration': float(data.get('format', {}).get('duration') or 0),
+        'format': data.get('format', {}).get('format_name'),
+        'video': None,
+        'audio': None,
+        'streams': {}
+    }
+    for stream in data.get('streams', []):
+        kind = stream.get('codec_type')
+        media['streams'][kind] = media['streams'].get(kind, 0) + 1
+        if kind not in ('video', 'audio') or media[kind] is not None:
+            continue
+        info = {
+            'index': stream.get('index'),
+            'codec': stream.get('codec_name'),
+            'width': stream.get('width'),
+            'height': stream.get('height')
+        }
+        if kind == 'video':
+            rotation = _rotation(stream)
+            swapped = rotation in (90, 270)
+            info.update({
+                'pix_fmt': stream.get('pix_fmt'),
+                'frame_rate': _frame_rate(stream.get('avg_frame_rate')),
+                'rotation': rotation,
+                'display_width': stream.get('height') if swapped else stream.get('width'),
+                'display_height': stream.get('width') if swapped else stream.get('height')
+            })
+        else:
+            info.update({
+                'channels': stream.get('channels'),
+                'sample_rate': int(stream.get('sample_rate') or 0) or None
+            })
+        media[kind] = info
+    return media
+
+
+def ffprobe_keyframes(path):
+    """Listar os timestamps (segundos) dos keyframes da primeira faixa de vídeo
+
+    Lê apenas os pacotes do contentor, sem descodificar frames.
+    """
+    output = _ffprobe([
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path
+    ])
+
+    keyframes = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframes.append(float(pts_time))
+    keyframes.sort()
+    return keyframes
+
+
+def content_fingerprint(path, stat=None):
+    """Impressão digital do conteúdo de um ficheiro: tamanho e hash do início e do fim
+
+    Não lê o ficheiro todo, por isso custa o mesmo num vídeo de 10 MB ou de
+    10 GB. Não depende do mtime, que muda quando o ficheiro é copiado ou
+    restaurado, mas muda se o ficheiro for reescrito ou truncado.
+    """
+    stat = stat or os.stat(path)
+    digest = hashlib.sha256(str(stat.st_size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(PROBE_HASH_BYTES))
+        if stat.st_size > PROBE_HASH_BYTES:
+            f.seek(max(stat.st_size - PROBE_HASH_BYTES, PROBE_HASH_BYTES))
+            digest.update(f.read(PROBE_HASH_BYTES))
+    return digest.hexdigest()[:32]
+
+
+class MediaProbeCache:
+    """Resultados do ffprobe por ficheiro, em memória e num ficheiro ao lado do vídeo
+
+    Cada ficheiro é analisado uma só vez enquanto não mudar: a entrada em
+    memória é indexada por (caminho, tamanho, mtime) e o sidecar
+    <vídeo>.probe.json guarda a impressão digital do conteúdo, por isso
+    sobrevive a reinícios e deixa de valer se o ficheiro for substituído.
+    Os keyframes são obtidos só quando pedidos e juntos à mesma entrada.
+    """
+
+    def __init__(self, maxsize=PROBE_CACHE_SIZE, sidecar=PROBE_SIDECAR):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._sidecar = sidecar
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def media(self, path):
+        """Duração, faixas e rotação (ver ffprobe_media)"""
+        return self._get(path, 'media', ffprobe_media)
+
+    def keyframes(self, path):
+        """Timestamps dos keyframes (ver ffprobe_keyframes)"""
+        return self._get(path, 'keyframes', ffprobe_keyframes)
+
+    def _get(self, path, field, probe):
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry and field in entry:
+                self.hits += 1
+                return entry[field]
+
+        def load():
+            entry = self._cache.get(key) or self._read_sidecar(path, stat) or {
+                'fingerprint': content_fingerprint(path, stat)
+            }
+            if field in entry:
+                return entry, True
+            with track_stage('probe', field=field):
+                entry = {**entry, field: probe(path)}
+            self._write_sidecar(path, entry)
+            return entry, False
+
+        (entry, cached), _ = self._flights.do((key, field), load)
+        with self._lock:
+            self._cache[key] = entry
+            if cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[field]
+
+    def _read_sidecar(self, path, stat):
+        if not self._sidecar:
+            return None
+        try:
+            with open(path + SIDECAR_SUFFIX) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != SIDECAR_VERSION or entry.get('fingerprint') != content_fingerprint(path, stat):
+            return None
+        return entry
+
+    def _write_sidecar(self, path, entry):
+        if not self._sidecar:
+            return
+        sidecar_path = path + SIDECAR_SUFFIX
+        staging_path = f'{sidecar_path}.{threading.get_ident()}.tmp'
+        try:
+            with open(staging_path, 'w') as f:
+                json.dump({**entry, 'version': SIDECAR_VERSION}, f)
+            os.replace(staging_path, sidecar_path)
+        except OSError:
+            # Diretoria só de leitura: fica só a cache em memória
+            try:
+                os.remove(staging_path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._cache),
+                'max_entries': int(self._cache.maxsize)
+            }
+
+
+media_probe = MediaProbeCache()
+cache_source('probe', media_probe)
+
+
+def probe_media(path):
+    """Obter duração e faixas de vídeo/áudio de um ficheiro (com cache)"""
+    return media_probe.media(path)
+
+
+def probe_keyframes(path):
+    """Listar os timestamps dos keyframes da primeira faixa de vídeo (com cache)"""
+    return media_probe.keyframes(path)
+
+
+def validate_media(media):
+    """Verificar que o ffmpeg tem uma faixa de vídeo com duração para cortar"""
+    if not media.get('video'):
+        raise ValueError('O ficheiro não tem nenhuma faixa de vídeo')
+    if not media.get('duration'):
+        raise ValueError('Não foi possível determinar a duração do vídeo')
+
+
+def clamp_segments(segments, duration=None, min_duration=MIN_SEGMENT_DURATION):
+    """Validar os segmentos de um pedido e ajustá-los à duração real do vídeo
+
+    Cada segmento precisa de start e end numéricos com start < end. Com a
+    duração, o início e o fim são limitados a [0, duration] e os segmentos
+    ajustados ficam com 'clamped'. Levanta ValueError se um segmento for
+    inválido ou ficar mais curto do que min_duration.
+    """
+    if not isinstance(segments, list):
+        raise ValueError('segments deve ser uma lista')
+
+    clamped = []
+    for i, segment in enumerate(segments, start=1):
+        if not isinstance(segment, dict):
+            raise ValueError(f'Segmento {i}: deve ser um objeto com start e end')
+        try:
+            start = float(segment['start'])
+            end = float(segment['end'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'Segmento {i}: start e end devem ser números')
+        if not (math.isfinite(start) and math.isfinite(end)) or start >= end:
+            raise ValueError(f'Segmento {i}: start deve ser menor do que end')
+
+        limited_start, limited_end = max(start, 0.0), end
+        if duration:
+            limited_start, limited_end = min(limited_start, duration), min(end, duration)
+        if limited_end - limited_start < min_duration:
+            raise ValueError(
+                f'Segmento {i}: fica com {max(limited_end - limited_start, 0):.1f}s '
+                f'depois de ajustado à duração do vídeo ({duration or 0:.1f}s)'
+            )
+
+        item = {**segment, 'start': limited_start, 'end': limited_end}
+        if (limited_start, limited_end) != (start, end):
+            item['clamped'] = True
+        clamped.append(item)
+    return clamped
+
+
+def snap_to_keyframe(start, end, keyframes, tolerance):
+    """Mover o início de um segmento para o keyframe mais próximo
+
+    Com cópia de stream o corte só é exato se o início cair num keyframe; o
+    fim pode ser cortado em qualquer pacote. Devolve (start, snapped), em que
+    snapped indica se havia um keyframe a menos de `tolerance` segundos do
+    início e antes do fim do segmento.
+    """
+    i = bisect.bisect_left(keyframes, start)
+    candidates = keyframes[max(i - 1, 0):i + 1]
+    if not candidates:
+        return start, False
+
+    keyframe = min(candidates, key=lambda k: abs(k - start))
+    if abs(keyframe - start) > tolerance or keyframe >= end:
+        return start, False
+    return keyframe, True
@@ -0,0 +1,255 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+from flask import session
+
+from models.media import Job as JobRecord, Short, SourceVideo, Upload
+from models.user import db
+
+# Intervalo (segundos) entre escritas agrupadas do estado dos jobs
+REGISTRY_FLUSH_INTERVAL = float(os.environ.get('REGISTRY_FLUSH_INTERVAL', 1.0))
+# Tamanho máximo de uma página nas listagens
+MAX_PAGE_SIZE = 100
+
+
+def current_owner():
+    """Identificador do dono dos jobs, shorts e uploads na sessão atual"""
+    if 'owner_id' not in session:
+        session['owner_id'] = uuid.uuid4().hex
+    return session['owner_id']
+
+
+def paginate_keyset(query, model, limit, cursor=None):
+    """Página de `query` ordenada por (created_at, id) decrescente
+
+    Em vez de OFFSET usa o cursor "<created_at>:<id>" da última linha da
+    página anterior, por isso cada página é uma leitura direta do índice
+    (owner, created_at, id), independentemente de quantas linhas há antes.
+    Devolve (linhas, próximo cursor ou None). Levanta ValueError se limit
+    ou o cursor forem inválidos.
+    """
+    try:
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise ValueError('limit deve ser um número inteiro')
+    if cursor:
+        created_at, _, last_id = cursor.partition(':')
+        try:
+            created_at = float(created_at)
+        except ValueError:
+            created_at = None
+        if created_at is None or not math.isfinite(created_at) or not last_id:
+            raise ValueError('cursor inválido')
+        query = query.filter(db.tuple_(model.created_at, model.id) < (created_at, last_id))
+
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f'{rows[-1].created_at!r}:{rows[-1].id}'
+    return rows, next_cursor
+
+
+class JobRegistry:
+    """Persistir na base de dados o estado dos jobs da fila em memória
+
+    As alterações de um job (progresso de cada etapa) acumulam-se em memória
+    e só o último estado de cada job é escrito, em lote, a cada
+    REGISTRY_FLUSH_INTERVAL segundos. Quando um job termina a escrita é
+    imediata e os seus shorts e o vídeo de origem ficam registados.
+    """
+
+    def __init__(self, flush_interval=REGISTRY_FLUSH_INTERVAL):
+        self._flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._app = None
+
+    def init_app(self, app, job_queue):
+        self._app = app
+        job_queue.add_listener(self.record)
+        threading.Thread(target=self._flush_loop, name='job-registry', daemon=True).start()
+        atexit.register(self.flush)
+
+    def record(self, job):
+        # Um job cancelado (lease perdido) já pertence a outro worker
+        if job.is_cancelled():
+            return
+        snapshot = job.to_dict()
+        snapshot['owner'] = job.owner
+        with self._lock:
+            self._pending[job.id] = snapshot
+        if job.is_finished():
+            self._wakeup.set()
+
+    def discard(self, job_id):
+        """Esquecer os estados de job_id ainda não gravados"""
+        with self._lock:
+            self._pending.pop(job_id, None)
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Erro ao gravar o estado dos jobs: {str(e)}")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or not self._app:
+            return
+
+        with self._app.app_context():
+            try:
+                self._write(pending)
+            except Exception:
+                # Ex.: "database is locked" com vários workers; os estados voltam
+                # para a próxima escrita, sem substituir os que entretanto chegaram
+                db.session.rollback()
+                with self._lock:
+                    self._pending = {**pending, **self._pending}
+                raise
+
+    def _write(self, pending):
+        existing = {
+            job_id for (job_id,) in
+            db.session.query(JobRecord.id).filter(JobRecord.id.in_(list(pending)))
+        }
+        inserts, updates = [], []
+        for snapshot in pending.values():
+            row = {
+                'id': snapshot['job_id'],
+                'kind': snapshot['kind'],
+                'status': snapshot['status'],
+                'owner': snapshot['owner'],
+                'stages': json.dumps(snapshot['stages']),
+                'result': json.dumps(snapshot['result']) if snapshot['result'] is not None else None,
+                'error': snapshot['error'],
+                'created_at': snapshot['created_at'],
+                'updated_at': snapshot['updated_at']
+            }
+            if snapshot['status'] == 'completed' and snapshot['result']:
+                row['source_video_id'] = self._register_results(snapshot)
+            (updates if row['id'] in existing else inserts).append(row)
+
+        db.session.bulk_insert_mappings(JobRecord, inserts)
+        db.session.bulk_update_mappings(JobRecord, updates)
+        db.session.commit()
+
+    def _register_results(self, snapshot):
+        result = snapshot['result']
+        # Um job em lote (playlist ou canal) tem um vídeo de origem por entrada
+        videos = result.get('videos') or [{'video_info': result.get('video_info'), 'shorts': result.get('shorts', [])}]
+
+        source_video = None
+        for video in videos:
+            if video.get('status') == 'failed':
+                continue
+            source_video = self._register_source_video(video.get('video_info') or {})
+            for short in video.get('shorts', []):
+                self._register_short(snapshot, short, source_video)
+        # O job só fica ligado a um vídeo de origem quando tem um só
+        return source_video.id if source_video and len(videos) == 1 else None
+
+    def _register_source_video(self, video_info):
+        if not video_info.get('video_id'):
+            return None
+        source_video = SourceVideo.query.filter_by(video_id=video_info['video_id']).first()
+        if not source_video:
+            source_video = SourceVideo(video_id=video_info['video_id'])
+            db.session.add(source_video)
+        source_video.url = video_info.get('url')
+        source_video.title = video_info.get('title')
+        source_video.duration = video_info.get('duration')
+        db.session.flush()
+        return source_video
+
+    def _register_short(self, snapshot, short, source_video):
+        db.session.merge(Short(
+            id=short['id'],
+            job_id=snapshot['job_id'],
+            source_video_id=source_video.id if source_video else None,
+            owner=snapshot['owner'],
+            path=short['path'],
+            title=short.get('title'),
+            start_time=short.get('start_time'),
+            end_time=short.get('end_time'),
+            status=short.get('status', 'ready'),
+            created_at=snapshot['updated_at']
+        ))
+
+
+def add_missing_columns():
+    """Acrescentar às tabelas existentes as colunas novas dos modelos
+
+    O create_all só cria as tabelas que ainda não existem, por isso uma base
+    de dados criada por uma versão anterior não teria as colunas novas.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def create_upload(short_id, platform, owner=None, video_path=None, request_body=None):
+    """Registar o início de um upload e devolver o seu registo"""
+    upload = Upload(
+        id=uuid.uuid4().hex,
+        short_id=short_id,
+        owner=owner,
+        platform=platform,
+        status='uploading',
+        video_path=video_path,
+        request_body=json.dumps(request_body) if request_body is not None else None,
+        bytes_sent=0,
+        total_bytes=os.path.getsize(video_path) if video_path and os.path.exists(video_path) else None
+    )
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def record_upload_progress(upload, resumable_uri, bytes_sent, total_bytes=None):
+    """Guardar a sessão resumable e os bytes já confirmados pela plataforma"""
+    upload.resumable_uri = resumable_uri
+    upload.bytes_sent = bytes_sent
+    if total_bytes:
+        upload.total_bytes = total_bytes
+    upload.updated_at = time.time()
+    db.session.commit()
+    return upload
+
+
+def finish_upload(upload, status, remote_video_id=None, error=None):
+    """Guardar o resultado final de um upload
+
+    A sessão resumable de um upload falhado é mantida para o poder retomar.
+    """
+    upload.status = status
+    upload.remote_video_id = remote_video_id
+    upload.error = error
+    if status == 'completed':
+        upload.resumable_uri = None
+        upload.bytes_sent = upload.total_bytes or upload.bytes_sent
+    upload.updated_at = time.time()
+    db.session.commit()
+    return upload
+
+
+job_registry = JobRegistry()
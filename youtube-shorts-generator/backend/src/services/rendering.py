@@ -0,0 +1,143 @@
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from services.tracing import bind_context
+
+# Núcleos que os encodes do processo (de todos os jobs) podem usar no total
+RENDER_CPU_BUDGET = int(os.environ.get('RENDER_CPU_BUDGET', os.cpu_count() or 1))
+# Limite de processos ffmpeg em simultâneo por job (0 = decidido pelo orçamento)
+RENDER_MAX_PARALLEL = int(os.environ.get('RENDER_MAX_PARALLEL', 0))
+# O libx264 perde eficiência abaixo de 2 threads por encode
+MIN_THREADS_PER_ENCODE = 2
+
+
+class CpuPool:
+    """Núcleos do orçamento partilhados por todos os encodes do processo
+
+    Cada encode reserva os núcleos das suas -threads antes de lançar o
+    ffmpeg e espera enquanto o orçamento estiver todo em uso, por isso jobs
+    em simultâneo não passam, juntos, de RENDER_CPU_BUDGET núcleos.
+    """
+
+    def __init__(self, cores=RENDER_CPU_BUDGET):
+        self.cores = max(1, cores)
+        self._used = 0
+        self._available = threading.Condition()
+
+    @contextmanager
+    def reserve(self, cores):
+        cores = min(max(1, cores or 1), self.cores)
+        with self._available:
+            self._available.wait_for(lambda: self._used + cores <= self.cores)
+            self._used += cores
+        try:
+            yield
+        finally:
+            with self._available:
+                self._used -= cores
+                self._available.notify_all()
+
+
+cpu_pool = CpuPool()
+
+
+def plan_cpu_budget(num_tasks, cpu_budget=None, max_parallel=None):
+    """Dividir o orçamento de núcleos entre processos ffmpeg e -threads de cada um
+
+    É o plano de um job; os núcleos são reservados em cpu_pool por cada
+    encode, por isso vários jobs ao mesmo tempo esperam uns pelos outros.
+    """
+    cpu_budget = max(1, cpu_budget or RENDER_CPU_BUDGET)
+    max_parallel = max_parallel or RENDER_MAX_PARALLEL or cpu_budget
+    workers = max(1, min(num_tasks, max_parallel, cpu_budget // MIN_THREADS_PER_ENCODE))
+    threads = max(1, cpu_budget // workers)
+    return workers, threads
+
+
+def run_parallel(fn, items, workers, on_done=None, threads=None):
+    """Executar fn(item) com no máximo `workers` em simultâneo
+
+    Cada chamada lança um processo ffmpeg e fica bloqueada à espera dele, por
+    isso um pool de threads chega para manter vários encoders a correr.
+    Cada chamada reserva `threads` núcleos em cpu_pool enquanto corre.
+    Devolve os resultados pela ordem de `items`, como dicionários com
+    'result' ou 'error'.
+    """
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    def reserved(item):
+        with cpu_pool.reserve(threads):
+            return fn(item)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render') as executor:
+        futures = {executor.submit(bind_context(reserved), item): index for index, item in enumerate(items)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            index = futures[future]
+            try:
+                results[index] = {'result': future.result(), 'error': None}
+            except Exception as e:
+                results[index] = {'result': None, 'error': str(e)}
+            if on_done:
+                on_done(done, len(items))
+
+    return results
+
+
+class RenderProgress:
+    """Progresso agregado dos encodes de um job a partir do -progress do ffmpeg
+
+    durations são os segundos de saída de cada encode. O progresso é a
+    fração desses segundos já escrita e o ETA divide o que falta pela soma
+    das velocidades dos encodes em curso. on_progress(progress, stats) é
+    chamado a cada atualização.
+    """
+
+    def __init__(self, durations, on_progress):
+        self._durations = [max(float(duration), 0.0) for duration in durations]
+        self._total = sum(self._durations) or 1.0
+        self._stats = [None] * len(self._durations)
+        self._finished = [False] * len(self._durations)
+        self._on_progress = on_progress
+        self._lock = threading.Lock()
+
+    def reporter(self, index):
+        """Callback on_progress(stats) para o encode `index`"""
+        return lambda stats: self.update(index, stats)
+
+    def update(self, index, stats):
+        with self._lock:
+            self._stats[index] = stats
+            progress, summary = self._summary()
+        self._on_progress(progress, summary)
+
+    def finish(self, index):
+        """Marcar o encode `index` como terminado (com ou sem sucesso)"""
+        with self._lock:
+            self._finished[index] = True
+            progress, summary = self._summary()
+        self._on_progress(progress, summary)
+
+    def _summary(self):
+        written = 0.0
+        active = []
+        for duration, stats, finished in zip(self._durations, self._stats, self._finished):
+            if finished:
+                written += duration
+            elif stats:
+                written += min(stats['out_time'], duration)
+                active.append(stats)
+        speed = sum(stats['speed'] or 0 for stats in active)
+        summary = {
+            'frame': sum(stats['frame'] for stats in self._stats if stats),
+            'fps': round(sum(stats['fps'] for stats in active), 1),
+            'speed': round(speed, 2) if active else None,
+            'out_time': round(written, 1),
+            'duration': round(self._total, 1),
+            'encodes': len(active),
+            'eta': round((self._total - written) / speed, 1) if speed else None,
+        }
+        return written / self._total, summary
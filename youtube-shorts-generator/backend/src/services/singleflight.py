@@ -0,0 +1,49 @@
+import threading
+
+
+class _Flight:
+    """Chamada em curso partilhada por pedidos concorrentes da mesma chave"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Agrupar chamadas concorrentes com a mesma chave numa só execução"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Executar fn() uma vez por chave em curso
+
+        Devolve (resultado, shared), em que shared indica se o resultado veio
+        de uma execução iniciada por outro pedido. Os erros são propagados a
+        todos os pedidos que esperavam pela mesma execução.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
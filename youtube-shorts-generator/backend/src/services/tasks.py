@@ -0,0 +1,263 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from models.media import Job as JobRecord, Task
+from models.user import db
+from services.jobs import Job, job_queue
+from services.metrics import metrics
+
+# thread: os jobs correm no pool de threads do processo web (JobQueue)
+# worker: os jobs ficam na tabela de tarefas e são executados por worker.py
+TASK_BACKEND = os.environ.get('TASK_BACKEND', 'thread')
+# Duração (segundos) de um lease; um worker que não o renove perde a tarefa
+TASK_LEASE_SECONDS = float(os.environ.get('TASK_LEASE_SECONDS', 60))
+# Intervalo (segundos) entre renovações dos leases de um worker
+TASK_HEARTBEAT_INTERVAL = float(os.environ.get('TASK_HEARTBEAT_INTERVAL', 15))
+# Tentativas de uma tarefa, contando com as interrompidas pela morte de um worker
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', 3))
+# Espera (segundos) antes de repetir uma tarefa que falhou, multiplicada pela tentativa
+TASK_RETRY_DELAY = float(os.environ.get('TASK_RETRY_DELAY', 30))
+# Tarefas candidatas lidas de cada vez ao procurar uma para reclamar
+TASK_CLAIM_BATCH = 10
+
+EMPTY_PAYLOAD = json.dumps({'args': [], 'kwargs': {}})
+
+
+def worker_identity():
+    """Identificador único de um processo worker (máquina, pid e sufixo aleatório)"""
+    return f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+
+class TaskQueue:
+    """Fila de tarefas persistente na base de dados, com leases
+
+    Os workers reclamam tarefas com um UPDATE condicional (só muda a linha
+    se ela ainda estiver disponível), por isso vários processos, na mesma
+    máquina ou noutras com a mesma base de dados e o mesmo armazenamento,
+    podem partilhar a fila sem outro mecanismo de coordenação. Uma tarefa
+    está disponível se estiver em fila ou se o lease de quem a executava
+    tiver expirado. Todos os métodos precisam de um contexto da aplicação.
+    """
+
+    def __init__(self, lease_seconds=TASK_LEASE_SECONDS, max_attempts=TASK_MAX_ATTEMPTS,
+                 retry_delay=TASK_RETRY_DELAY):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def enqueue(self, kind, args=(), kwargs=None, task_id=None, owner=None, max_attempts=None):
+        task = Task(
+            id=task_id or uuid.uuid4().hex,
+            kind=kind,
+            owner=owner,
+            payload=json.dumps({'args': list(args), 'kwargs': kwargs or {}}),
+            max_attempts=max_attempts or self.max_attempts
+        )
+        db.session.add(task)
+        db.session.commit()
+        return task
+
+    def claim(self, worker_id, kinds=None):
+        """Reclamar a tarefa disponível mais antiga e devolvê-la (ou None)
+
+        Tarefas com o lease expirado que já esgotaram as tentativas são
+        marcadas como falhadas em vez de reclamadas, e o job delas também.
+        """
+        now = time.time()
+        available = db.or_(
+            db.and_(Task.status == 'queued', Task.available_at <= now),
+            db.and_(Task.status == 'running', Task.lease_expires_at < now)
+        )
+        query = Task.query.filter(available)
+        if kinds:
+            query = query.filter(Task.kind.in_(list(kinds)))
+        candidates = query.order_by(Task.available_at, Task.created_at).limit(TASK_CLAIM_BATCH).all()
+
+        for candidate in candidates:
+            if candidate.attempts >= candidate.max_attempts:
+                error = f'Lease expirado depois de {candidate.attempts} tentativas'
+                expired = self._update(
+                    [Task.id == candidate.id, available],
+                    commit=False,
+                    status='failed',
+                    payload=EMPTY_PAYLOAD,
+                    error=error,
+                    worker_id=None,
+                    lease_expires_at=None
+                )
+                # Sem isto o job ficava em running (e o stream de eventos aberto) para sempre
+                if expired:
+                    self._update_job(candidate.id, status='failed', error=error)
+                db.session.commit()
+                continue
+            claimed = self._update(
+                [Task.id == candidate.id, Task.attempts == candidate.attempts, available],
+                status='running',
+                worker_id=worker_id,
+                attempts=candidate.attempts + 1,
+                lease_expires_at=now + self.lease_seconds
+            )
+            if claimed:
+                return db.session.get(Task, candidate.id, populate_existing=True)
+        return None
+
+    def heartbeat(self, task_id, worker_id):
+        """Renovar o lease; devolve False se a tarefa já não pertencer a este worker"""
+        return self._update(
+            self._owned(task_id, worker_id),
+            lease_expires_at=time.time() + self.lease_seconds
+        )
+
+    def complete(self, task_id, worker_id):
+        # Os argumentos (que podem incluir credenciais) deixam de ser precisos
+        return self._update(
+            self._owned(task_id, worker_id),
+            status='completed',
+            payload=EMPTY_PAYLOAD,
+            lease_expires_at=None
+        )
+
+    def fail(self, task_id, worker_id, error):
+        """Registar a falha de uma tarefa e voltar a pô-la em fila se ainda houver tentativas
+
+        O job acompanha a tarefa na mesma transação: volta a ficar em fila
+        ou fica falhado com o erro. Devolve True se a tarefa vai ser repetida.
+        """
+        task = db.session.get(Task, task_id, populate_existing=True)
+        if not task or task.worker_id != worker_id:
+            return False
+        retry = task.attempts < task.max_attempts
+        values = {'status': 'queued'} if retry else {'status': 'failed', 'payload': EMPTY_PAYLOAD}
+        failed = self._update(
+            self._owned(task_id, worker_id),
+            commit=False,
+            error=error,
+            lease_expires_at=None,
+            available_at=time.time() + self.retry_delay * task.attempts,
+            **values
+        )
+        if failed:
+            self._update_job(task_id, **({'status': 'queued'} if retry else {'status': 'failed', 'error': error}))
+        db.session.commit()
+        return failed and retry
+
+    def counts(self):
+        """Número de tarefas por (tipo, estado)"""
+        rows = db.session.query(Task.kind, Task.status, db.func.count(Task.id)).group_by(Task.kind, Task.status)
+        return {(kind, status): count for kind, status, count in rows}
+
+    @staticmethod
+    def _owned(task_id, worker_id):
+        return [Task.id == task_id, Task.worker_id == worker_id, Task.status == 'running']
+
+    @staticmethod
+    def _update(conditions, commit=True, **values):
+        values['updated_at'] = time.time()
+        result = db.session.execute(db.update(Task).where(*conditions).values(**values))
+        if commit:
+            db.session.commit()
+        return result.rowcount == 1
+
+    @staticmethod
+    def _update_job(task_id, **values):
+        # Sem commit: faz parte da transação da alteração da tarefa
+        values['updated_at'] = time.time()
+        db.session.execute(db.update(JobRecord).where(JobRecord.id == task_id).values(**values))
+
+
+task_queue = TaskQueue()
+metrics.gauge('shorts_tasks', 'Tarefas da fila persistente por tipo e estado', ('kind', 'status')).add_source(
+    task_queue.counts
+)
+
+
+def submit_job(kind, fn, *args, stages=(), owner=None):
+    """Criar um job de `kind` executado no pool do processo ou por um worker
+
+    Com TASK_BACKEND=worker o job fica registado já em fila na base de dados
+    (para o estado poder ser consultado) e os argumentos, que têm de ser
+    serializáveis em JSON, vão para a tabela de tarefas; fn só é usada no
+    modo thread. Devolve o job (ou o registo dele) com id e status.
+    """
+    if TASK_BACKEND != 'worker':
+        return job_queue.submit(kind, fn, *args, stages=stages, owner=owner)
+
+    job = Job(kind, stages, owner=owner)
+    record = JobRecord(
+        id=job.id,
+        kind=kind,
+        status=job.status,
+        owner=owner,
+        stages=json.dumps(job.stages),
+        created_at=job.created_at,
+        updated_at=job.updated_at
+    )
+    db.session.add(record)
+    db.session.commit()
+    task_queue.enqueue(kind, args, task_id=job.id, owner=owner)
+    return record
+
+
+class LeaseKeeper:
+    """Thread que renova os leases de todas as tarefas em curso num worker
+
+    Uma só thread para o processo, com um UPDATE por tarefa a cada
+    TASK_HEARTBEAT_INTERVAL segundos. Se um lease se perder (o worker esteve
+    parado mais do que o lease e outra instância reclamou a tarefa), o id
+    passa a constar de lost, on_lost(task_id) é chamado para parar a
+    execução e o resultado dela é descartado.
+    """
+
+    def __init__(self, app, queue, worker_id, interval=TASK_HEARTBEAT_INTERVAL, on_lost=None):
+        self._app = app
+        self._queue = queue
+        self._worker_id = worker_id
+        self._interval = interval
+        self._on_lost = on_lost
+        self._tasks = set()
+        self.lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='task-heartbeat', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def add(self, task_id):
+        with self._lock:
+            self._tasks.add(task_id)
+            self.lost.discard(task_id)
+
+    def remove(self, task_id):
+        with self._lock:
+            self._tasks.discard(task_id)
+            return task_id not in self.lost
+
+    def _loop(self):
+        while not self._stop.wait(self._interval):
+            with self._lock:
+                tasks = list(self._tasks)
+            for task_id in tasks:
+                try:
+                    with self._app.app_context():
+                        renewed = self._queue.heartbeat(task_id, self._worker_id)
+                except Exception as e:
+                    # Uma falha pontual da base de dados não faz perder o lease
+                    print(f"Erro ao renovar o lease da tarefa {task_id}: {str(e)}")
+                    continue
+                if not renewed:
+                    print(f"Lease da tarefa {task_id} perdido")
+                    with self._lock:
+                        self.lost.add(task_id)
+                    if self._on_lost:
+                        self._on_lost(task_id)
@@ -0,0 +1,289 @@
+import contextvars
+import cProfile
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Fração dos pedidos rastreados e perfilados mesmo sem os cabeçalhos X-Trace / X-Profile
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+# Aceitar o cabeçalho X-Profile; desligado por omissão, porque qualquer cliente o pode enviar
+PROFILE_HEADER_ENABLED = os.environ.get('PROFILE_HEADER_ENABLED', 'false').lower() == 'true'
+# Diretoria onde ficam os ficheiros .prof do cProfile (abrir com pstats ou snakeviz)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'shorts-profiles'))
+# Ficheiros .prof mantidos em PROFILE_DIR; os mais antigos são apagados
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+# Número de traces guardados em memória para o endpoint de debug
+TRACE_RETENTION = int(os.environ.get('TRACE_RETENTION', 200))
+# Tamanho máximo (bytes) da árvore de spans enviada no cabeçalho X-Trace-Spans
+TRACE_HEADER_MAX_BYTES = int(os.environ.get('TRACE_HEADER_MAX_BYTES', 8192))
+
+TRACE_HEADER = 'X-Trace'
+PROFILE_HEADER = 'X-Profile'
+
+# Span ativo no contexto atual; None quando o pedido não está a ser rastreado
+_current_span = contextvars.ContextVar('current_span', default=None)
+# Pedir o cProfile também no trabalho feito fora do pedido (jobs)
+_profile_requested = contextvars.ContextVar('profile_requested', default=False)
+# O cProfile é por thread; uma thread com perfil ativo não começa outro
+_profiling = threading.local()
+
+
+class Span:
+    """Intervalo de tempo com nome, atributos e spans filhos
+
+    Além da duração guarda o tempo de CPU da thread, para distinguir
+    trabalho em Python de espera (subprocessos, rede, disco).
+    """
+
+    def __init__(self, trace, name, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.thread = threading.current_thread().name
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.duration = None
+        self.cpu_time = None
+
+    def set(self, **attributes):
+        with self.trace.lock:
+            self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        self.cpu_time = time.thread_time() - self.cpu_started
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'start_ms': round((self.started - self.trace.started) * 1000, 2),
+            'duration_ms': round(self.duration * 1000, 2) if self.duration is not None else None,
+            'cpu_ms': round(self.cpu_time * 1000, 2) if self.cpu_time is not None else None,
+            'thread': self.thread,
+            'attributes': self.attributes,
+            'children': [child.to_dict() for child in self.children]
+        }
+
+
+class Trace:
+    """Árvore de spans de um pedido e do trabalho que ele lança"""
+
+    def __init__(self, name, owner=None, attributes=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.created_at = time.time()
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.root = Span(self, name, attributes)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'trace_id': self.id,
+                'created_at': self.created_at,
+                'root': self.root.to_dict()
+            }
+
+
+class TraceStore:
+    """Últimos traces em memória, para consulta no endpoint de debug"""
+
+    def __init__(self, retention=TRACE_RETENTION):
+        self._traces = OrderedDict()
+        self._retention = retention
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        with self._lock:
+            self._traces[trace.id] = trace
+            while len(self._traces) > self._retention:
+                self._traces.popitem(last=False)
+
+    def get(self, trace_id):
+        with self._lock:
+            return self._traces.get(trace_id)
+
+    def list(self, owner=None):
+        with self._lock:
+            traces = list(self._traces.values())
+        return [trace for trace in reversed(traces) if owner is None or trace.owner == owner]
+
+
+trace_store = TraceStore()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Registar um span filho do span atual, se o pedido estiver a ser rastreado
+
+    Sem trace ativo não faz nada, por isso pode ficar no código de produção.
+    Devolve o span (ou None) para se acrescentarem atributos no fim.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    current = Span(parent.trace, name, attributes)
+    with parent.trace.lock:
+        parent.children.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e)[:200])
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+
+
+def current_trace():
+    current = _current_span.get()
+    return current.trace if current else None
+
+
+def bind_context(fn):
+    """Envolver fn para correr com o contexto (trace e perfil) de quem a agenda
+
+    As threads dos pools não herdam as contextvars, por isso as funções
+    submetidas a um executor devem passar por aqui.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def profile_path(label):
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'request'
+    return os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}.prof")
+
+
+@contextmanager
+def profiled(label, force=False):
+    """Correr o bloco com o cProfile e gravar o resultado em PROFILE_DIR
+
+    Só perfila se force for verdadeiro ou se o pedido de origem tiver pedido
+    perfil; blocos encaixados noutro perfil da mesma thread não são
+    perfilados outra vez. Devolve o caminho do ficheiro (ou None).
+    """
+    if not (force or _profile_requested.get()) or getattr(_profiling, 'active', False):
+        yield None
+        return
+
+    profiler = cProfile.Profile()
+    path = profile_path(label)
+    _profiling.active = True
+    profiler.enable()
+    try:
+        yield path
+    finally:
+        profiler.disable()
+        _profiling.active = False
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(path)
+            prune_profiles()
+        except OSError as e:
+            print(f"Erro ao gravar o perfil {path}: {str(e)}")
+
+
+def prune_profiles(max_files=PROFILE_MAX_FILES):
+    """Apagar os ficheiros .prof mais antigos de PROFILE_DIR para lá dos max_files mais recentes"""
+    profiles = []
+    for name in os.listdir(PROFILE_DIR):
+        path = os.path.join(PROFILE_DIR, name)
+        if name.endswith('.prof'):
+            try:
+                profiles.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+    profiles.sort(reverse=True)
+    for _, path in profiles[max(max_files, 0):]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class RequestTracer:
+    """Rastreio e perfil opcionais de cada pedido
+
+    Com o cabeçalho X-Trace: 1 (ou por amostragem, TRACE_SAMPLE_RATE) o
+    pedido é rastreado: a resposta traz X-Trace-Id e, se couber,
+    X-Trace-Spans com a árvore de spans em JSON. Com PROFILE_SAMPLE_RATE
+    (ou X-Profile: 1, se PROFILE_HEADER_ENABLED) o pedido e os jobs que
+    lança correm com o cProfile; o nome do ficheiro vem em X-Profile-File.
+    """
+
+    def __init__(self, trace_sample_rate=TRACE_SAMPLE_RATE, profile_sample_rate=PROFILE_SAMPLE_RATE,
+                 profile_header=PROFILE_HEADER_ENABLED):
+        self.trace_sample_rate = trace_sample_rate
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_header = profile_header
+
+    def init_app(self, app, owner=None):
+        """owner() identifica o dono de cada trace para o endpoint de debug"""
+
+        @app.before_request
+        def start_trace():
+            profile = self._requested(PROFILE_HEADER if self.profile_header else None, self.profile_sample_rate)
+            if not profile and not self._requested(TRACE_HEADER, self.trace_sample_rate):
+                return
+
+            # Um perfil traz sempre o trace, para se saber o que foi perfilado
+            trace = Trace(request.endpoint or 'request', owner() if owner else None, {
+                'method': request.method,
+                'path': request.path
+            })
+            trace_store.add(trace)
+            g.trace = trace
+            g.trace_tokens = [_current_span.set(trace.root), _profile_requested.set(profile)]
+            if profile:
+                g.profile = profiled(f'{request.method}-{request.endpoint or request.path}', force=True)
+                g.profile_file = g.profile.__enter__()
+                trace.root.set(profile=os.path.basename(g.profile_file))
+
+        @app.after_request
+        def finish_trace(response):
+            trace = g.get('trace')
+            if trace is None:
+                return response
+
+            trace.root.set(status=response.status_code)
+            trace.root.finish()
+            response.headers['X-Trace-Id'] = trace.id
+            spans = json.dumps(trace.to_dict()['root'], separators=(',', ':'))
+            if len(spans) <= TRACE_HEADER_MAX_BYTES:
+                response.headers['X-Trace-Spans'] = spans
+            if g.get('profile_file'):
+                response.headers['X-Profile-File'] = os.path.basename(g.profile_file)
+            return response
+
+        @app.teardown_request
+        def reset_trace(exc=None):
+            profile = g.pop('profile', None)
+            if profile is not None:
+                profile.__exit__(None, None, None)
+            for token in reversed(g.pop('trace_tokens', [])):
+                token.var.reset(token)
+
+    @staticmethod
+    def _requested(header, sample_rate):
+        value = request.headers.get(header, '').lower() if header else ''
+        if value in ('1', 'true', 'yes'):
+            return True
+        return sample_rate > 0 and random.random() < sample_rate
+
+
+request_tracer = RequestTracer()
@@ -0,0 +1,273 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from services.tracing import bind_context, span
+
+# O googleapiclient e o httplib2 só são importados quando há uploads, para
+# não atrasarem o arranque da aplicação
+
+# Uploads em simultâneo num pedido de upload em massa
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+# Tentativas extra de um upload com erro temporário
+UPLOAD_MAX_RETRIES = int(os.environ.get('UPLOAD_MAX_RETRIES', 5))
+# Tamanho de cada pedido de um upload resumable (por omissão 8 MiB); a API exige múltiplos de 256 KiB
+UPLOAD_CHUNK_SIZE = max(1, int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)) // (256 * 1024)) * 256 * 1024
+# Espera inicial e máxima (segundos) do backoff exponencial entre tentativas
+UPLOAD_BACKOFF_BASE = float(os.environ.get('UPLOAD_BACKOFF_BASE', 1.0))
+UPLOAD_BACKOFF_MAX = float(os.environ.get('UPLOAD_BACKOFF_MAX', 64.0))
+
+# Limites por plataforma: uploads por segundo, rajada, quota diária e custo
+# de cada upload nessa quota (o videos.insert do YouTube custa 1600 unidades
+# das 10000 diárias de um projeto)
+PLATFORM_LIMITS = {
+    'youtube': {
+        'rate': float(os.environ.get('YOUTUBE_UPLOAD_RATE', 0.5)),
+        'burst': int(os.environ.get('YOUTUBE_UPLOAD_BURST', 2)),
+        'daily_quota': int(os.environ.get('YOUTUBE_DAILY_QUOTA', 10000)),
+        'cost': 1600,
+    },
+    'tiktok': {
+        'rate': float(os.environ.get('TIKTOK_UPLOAD_RATE', 0.2)),
+        'burst': int(os.environ.get('TIKTOK_UPLOAD_BURST', 1)),
+        'daily_quota': None,
+        'cost': 1,
+    },
+}
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Motivos de um 403 do YouTube que são limites de ritmo e não falta de permissões
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+QUOTA_REASONS = ('quotaExceeded', 'dailyLimitExceeded')
+
+
+class QuotaExceeded(Exception):
+    """A quota diária da plataforma está esgotada"""
+
+
+class RateLimiter:
+    """Token bucket por plataforma com quota diária
+
+    acquire() bloqueia até haver um token livre e desconta o custo do upload
+    na quota do dia (as repetições do mesmo upload passam charge=False). Um
+    429 ou a resposta de quota esgotada da plataforma atrasam ou bloqueiam
+    todos os uploads seguintes, não só o que falhou.
+    """
+
+    def __init__(self, rate, burst=1, daily_quota=None, cost=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.daily_quota = daily_quota
+        self.cost = cost
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._not_before = 0.0
+        self._day = None
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, charge=True):
+        while True:
+            with self._lock:
+                if charge:
+                    self._check_quota()
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = max(self._not_before - now, 0.0)
+                if not wait and self._tokens >= 1:
+                    self._tokens -= 1
+                    if charge:
+                        self._used += self.cost
+                    return
+                if not wait:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def defer(self, seconds):
+        """Não deixar sair nenhum upload nos próximos `seconds` segundos"""
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + seconds)
+
+    def exhaust(self):
+        """Marcar a quota do dia como esgotada"""
+        with self._lock:
+            self._check_quota()
+            self._used = self.daily_quota or float('inf')
+
+    def _check_quota(self):
+        today = time.strftime('%Y-%m-%d', time.gmtime())
+        if today != self._day:
+            self._day = today
+            self._used = 0
+        if self.daily_quota is not None and self._used + self.cost > self.daily_quota:
+            raise QuotaExceeded('Quota diária de uploads esgotada, tente amanhã')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'daily_quota': self.daily_quota,
+                'quota_used': self._used
+            }
+
+
+rate_limiters = {platform: RateLimiter(**limits) for platform, limits in PLATFORM_LIMITS.items()}
+
+
+def http_error_reason(error):
+    """Motivo ('reason') de um HttpError da Google API, se existir"""
+    try:
+        errors = json.loads(error.content.decode('utf-8'))['error'].get('errors') or []
+        return errors[0].get('reason') if errors else None
+    except (AttributeError, KeyError, ValueError, TypeError):
+        return None
+
+
+def is_retryable(error):
+    """Verificar se um erro de upload é temporário e vale a pena repetir"""
+    import httplib2
+    from googleapiclient.errors import HttpError
+    
+    if isinstance(error, HttpError):
+        if error.resp.status in RETRYABLE_STATUS:
+            return True
+        return error.resp.status == 403 and http_error_reason(error) in RATE_LIMIT_REASONS
+    return isinstance(error, (ConnectionError, TimeoutError, httplib2.HttpLib2Error))
+
+
+def backoff_delay(attempt, base=UPLOAD_BACKOFF_BASE, maximum=UPLOAD_BACKOFF_MAX):
+    """Espera antes da tentativa attempt + 1 (exponencial com jitter)"""
+    return min(maximum, base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def retry_delay(error, attempt):
+    """Espera antes de repetir depois de error, respeitando o Retry-After de um 429"""
+    delay = backoff_delay(attempt)
+    resp = getattr(error, 'resp', None)
+    if resp is not None and resp.status == 429 and resp.get('retry-after', '').isdigit():
+        delay = max(delay, int(resp['retry-after']))
+    return delay
+
+
+def check_quota(error, limiter):
+    """Levantar QuotaExceeded (e bloquear o limiter) se error for a quota diária esgotada"""
+    resp = getattr(error, 'resp', None)
+    if resp is not None and resp.status == 403 and http_error_reason(error) in QUOTA_REASONS:
+        if limiter:
+            limiter.exhaust()
+        raise QuotaExceeded('Quota diária de uploads esgotada, tente amanhã')
+
+
+def call_with_backoff(fn, limiter, retries=UPLOAD_MAX_RETRIES):
+    """Chamar fn() dentro dos limites da plataforma, repetindo erros temporários
+
+    O custo entra na quota só na primeira tentativa. Não usar com
+    resumable_upload, que já repete os erros temporários bloco a bloco.
+    """
+    from googleapiclient.errors import HttpError
+    
+    for attempt in range(retries + 1):
+        limiter.acquire(charge=attempt == 0)
+        try:
+            return fn()
+        except HttpError as e:
+            check_quota(e, limiter)
+            if attempt == retries or not is_retryable(e):
+                raise
+            # O limite é da plataforma, por isso atrasa todos os uploads do lote
+            limiter.defer(retry_delay(e, attempt))
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            time.sleep(backoff_delay(attempt))
+
+
+def resumable_upload(insert_request, on_progress=None, resumable_uri=None, http=None, retries=UPLOAD_MAX_RETRIES,
+                     limiter=None):
+    """Enviar um pedido com media resumable bloco a bloco com next_chunk()
+
+    on_progress(resumable_uri, bytes_sent, total_bytes) é chamado depois de
+    cada bloco confirmado e quando é aberta uma sessão nova, para o estado
+    da sessão ser persistido. Com resumable_uri o upload continua essa sessão: o primeiro pedido
+    pergunta à plataforma quantos bytes já recebeu. Os erros temporários são
+    repetidos com backoff exponencial a partir do último byte confirmado; se
+    a sessão tiver expirado (404/410) o upload recomeça do zero. É a única
+    camada de repetição de um upload: com limiter, um 429 atrasa os uploads
+    seguintes da plataforma e a quota esgotada levanta QuotaExceeded (o
+    custo é descontado por quem chama, uma vez, com limiter.acquire()).
+    """
+    from googleapiclient.errors import HttpError
+    
+    total_bytes = insert_request.resumable.size()
+    if resumable_uri:
+        insert_request.resumable_uri = resumable_uri
+        insert_request._in_error_state = True
+
+    reported_uri = resumable_uri
+
+    def report_session():
+        # A sessão é gravada assim que existe, mesmo que o bloco falhe, para uma
+        # nova tentativa (do worker ou por /resume) a continuar em vez de recomeçar
+        nonlocal reported_uri
+        if on_progress and insert_request.resumable_uri and insert_request.resumable_uri != reported_uri:
+            reported_uri = insert_request.resumable_uri
+            on_progress(reported_uri, insert_request.resumable_progress, total_bytes)
+
+    response = None
+    failures = 0
+    while response is None:
+        had_session = insert_request.resumable_uri is not None
+        try:
+            with span('upload_chunk', offset=insert_request.resumable_progress) as chunk:
+                _, response = insert_request.next_chunk(http=http)
+                if chunk:
+                    chunk.set(confirmed=total_bytes if response is not None else insert_request.resumable_progress)
+        except HttpError as e:
+            report_session()
+            if e.resp.status in (404, 410) and had_session and failures < retries:
+                # Sessão expirada: começar uma nova
+                insert_request.resumable_uri = None
+                insert_request.resumable_progress = 0
+                insert_request._in_error_state = False
+                failures += 1
+                continue
+            check_quota(e, limiter)
+            if failures >= retries or not is_retryable(e):
+                raise
+            delay = retry_delay(e, failures)
+            if limiter:
+                limiter.defer(delay)
+            time.sleep(delay)
+            failures += 1
+            continue
+        except Exception as e:
+            report_session()
+            if failures >= retries or not is_retryable(e):
+                raise
+            # Sem resposta não se sabe o que chegou; perguntar antes de reenviar
+            insert_request._in_error_state = insert_request.resumable_uri is not None
+            time.sleep(backoff_delay(failures))
+            failures += 1
+            continue
+
+        failures = 0
+        if on_progress:
+            sent = total_bytes if response is not None else insert_request.resumable_progress
+            reported_uri = insert_request.resumable_uri
+            on_progress(reported_uri, sent, total_bytes)
+    return response
+
+
+def run_bounded(fn, items, max_workers=UPLOAD_WORKERS):
+    """Executar fn(item) num pool limitado e devolver (item, resultado) à medida que terminam"""
+    if not items:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))), thread_name_prefix='upload') as executor:
+        futures = {executor.submit(bind_context(fn), item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
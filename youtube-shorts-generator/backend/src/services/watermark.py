@@ -0,0 +1,147 @@
+import os
+import re
+
+# Posições possíveis da marca d'água e margem (píxeis) em relação aos cantos
+WATERMARK_POSITIONS = ('top-left', 'top-right', 'bottom-left', 'bottom-right', 'center')
+WATERMARK_MARGIN = 10
+
+# Valores por omissão, iguais aos da antiga passagem separada de drawtext
+DEFAULT_WATERMARK = {
+    'text': None,
+    'font': None,
+    'font_size': 24,
+    'font_color': 'white',
+    'position': 'bottom-left',
+    'image': None,
+    'image_scale': 0.2,  # largura da imagem em relação à largura do vídeo
+    'opacity': 1.0,
+}
+
+COLOR_PATTERN = re.compile(r'^(#[0-9A-Fa-f]{6}([0-9A-Fa-f]{2})?|[A-Za-z]+)(@[0-9.]+)?$')
+
+
+def parse_watermark(options):
+    """Validar as opções de marca d'água de um pedido
+
+    Aceita um texto simples ou um dicionário com text, font (ficheiro ou
+    nome de fonte), font_size, font_color, position, image, image_scale e
+    opacity. Devolve None se não houver marca d'água e levanta ValueError
+    se as opções forem inválidas.
+    """
+    if not options:
+        return None
+    if isinstance(options, str):
+        options = {'text': options}
+    if not isinstance(options, dict):
+        raise ValueError('watermark deve ser um texto ou um objeto')
+
+    unknown = set(options) - set(DEFAULT_WATERMARK)
+    if unknown:
+        raise ValueError(f"Opções de marca d'água desconhecidas: {', '.join(sorted(unknown))}")
+
+    watermark = {**DEFAULT_WATERMARK, **{key: value for key, value in options.items() if value is not None}}
+    if not watermark['text'] and not watermark['image']:
+        raise ValueError("A marca d'água precisa de text ou image")
+    if watermark['position'] not in WATERMARK_POSITIONS:
+        raise ValueError(f"position inválida, use uma de: {', '.join(WATERMARK_POSITIONS)}")
+    if watermark['image'] and not os.path.isfile(watermark['image']):
+        raise ValueError("Imagem da marca d'água não encontrada")
+    if not COLOR_PATTERN.match(str(watermark['font_color'])):
+        raise ValueError('font_color inválida')
+
+    try:
+        watermark['font_size'] = int(watermark['font_size'])
+        watermark['image_scale'] = float(watermark['image_scale'])
+        watermark['opacity'] = float(watermark['opacity'])
+    except (TypeError, ValueError):
+        raise ValueError('font_size, image_scale e opacity devem ser números')
+    if not 8 <= watermark['font_size'] <= 200:
+        raise ValueError('font_size deve estar entre 8 e 200')
+    if not 0 < watermark['image_scale'] <= 1:
+        raise ValueError('image_scale deve estar entre 0 e 1')
+    if not 0 <= watermark['opacity'] <= 1:
+        raise ValueError('opacity deve estar entre 0 e 1')
+    return watermark
+
+
+def escape_filter_value(value):
+    """Escapar o valor de uma opção de filtro dentro de um grafo do ffmpeg
+
+    O valor é escapado duas vezes: para a opção do filtro (\\ ' :) e para o
+    grafo de filtros (\\ ' [ ] , ;).
+    """
+    value = re.sub(r"([\\':])", r'\\\1', str(value))
+    return re.sub(r"([\\'\[\],;])", r'\\\1', value)
+
+
+def _position(position, width, height, item_width, item_height):
+    margin = WATERMARK_MARGIN
+    x = {
+        'left': f'{margin}',
+        'right': f'{width}-{item_width}-{margin}',
+        'center': f'({width}-{item_width})/2',
+    }
+    y = {
+        'top': f'{margin}',
+        'bottom': f'{height}-{item_height}-{margin}',
+        'center': f'({height}-{item_height})/2',
+    }
+    vertical, _, horizontal = position.partition('-')
+    if position == 'center':
+        vertical = horizontal = 'center'
+    return x[horizontal], y[vertical]
+
+
+def drawtext_filter(watermark):
+    """Filtro drawtext do texto da marca d'água"""
+    x, y = _position(watermark['position'], 'w', 'h', 'tw', 'th')
+    options = [
+        f"text={escape_filter_value(watermark['text'])}",
+        'expansion=none',
+        f"fontsize={watermark['font_size']}",
+        f"fontcolor={watermark['font_color']}",
+        f'x={escape_filter_value(x)}',
+        f'y={escape_filter_value(y)}',
+    ]
+    font = watermark['font']
+    if font:
+        key = 'fontfile' if os.path.isfile(font) else 'font'
+        options.append(f'{key}={escape_filter_value(font)}')
+    return 'drawtext=' + ':'.join(options)
+
+
+def watermark_graph(watermark, inputs, outputs, image_input=None, video_width=720):
+    """Grafo que aplica a marca d'água a cada vídeo inputs[i] com saída outputs[i]
+
+    inputs e outputs são etiquetas do grafo (sem parênteses retos). Com uma
+    imagem, image_input é o índice da entrada do ffmpeg com a imagem; a
+    imagem é redimensionada para image_scale * video_width uma só vez e
+    repartida por todas as saídas.
+    """
+    graph = []
+    image = watermark['image'] and image_input is not None
+    if image:
+        labels = ''.join(f'[wm{i}]' for i in range(len(inputs)))
+        image_width = max(2, int(video_width * watermark['image_scale']) // 2 * 2)
+        graph.append(
+            f"[{image_input}:v]scale={image_width}:-1,format=rgba,"
+            f"colorchannelmixer=aa={watermark['opacity']},split={len(inputs)}{labels}"
+        )
+
+    for i, (source, output) in enumerate(zip(inputs, outputs)):
+        chain = source
+        if watermark['text']:
+            target = f'wt{i}' if image else output
+            graph.append(f'[{chain}]{drawtext_filter(watermark)}[{target}]')
+            chain = target
+        if image:
+            x, y = _position(watermark['position'], 'W', 'H', 'w', 'h')
+            graph.append(f'[{chain}][wm{i}]overlay=x={x}:y={y}[{output}]')
+    return ';'.join(graph)
+
+
+def image_inputs(watermark):
+    """Argumentos de entrada do ffmpeg para a imagem da marca d'água"""
+    if watermark and watermark['image']:
+        return ['-i', watermark['image']]
+    return []
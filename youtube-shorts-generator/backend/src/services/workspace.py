@@ -0,0 +1,291 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Sem flock (Windows) os ficheiros em uso só são conhecidos no próprio processo
+    fcntl = None
+
+# Diretório onde ficam as diretorias de trabalho de cada job
+WORKSPACE_DIR = os.environ.get(
+    'WORKSPACE_DIR',
+    os.path.join(tempfile.gettempdir(), 'shorts-workspace')
+)
+# Idade máxima (segundos) de uma diretoria de trabalho sem alterações
+WORKSPACE_MAX_AGE = int(os.environ.get('WORKSPACE_MAX_AGE', 6 * 3600))
+# Espaço total máximo das diretorias de trabalho (por omissão 20 GiB)
+WORKSPACE_MAX_BYTES = int(os.environ.get('WORKSPACE_MAX_BYTES', 20 * 1024 ** 3))
+# Intervalo (segundos) entre limpezas automáticas
+WORKSPACE_SWEEP_INTERVAL = int(os.environ.get('WORKSPACE_SWEEP_INTERVAL', 300))
+# Espaço livre mínimo no disco para aceitar trabalho novo (por omissão 2 GiB)
+WORKSPACE_MIN_FREE_BYTES = int(os.environ.get('WORKSPACE_MIN_FREE_BYTES', 2 * 1024 ** 3))
+
+# Espera (segundos) entre tentativas de marcar em uso um ficheiro que está a ser apagado
+LOCK_RETRY_INTERVAL = 0.05
+
+
+class InsufficientDiskSpace(Exception):
+    """Não há espaço livre suficiente para aceitar trabalho novo"""
+
+
+class Workspace:
+    """Diretorias de trabalho por job com limpeza automática
+
+    Os ficheiros em uso (por exemplo a fonte de um render a decorrer) são
+    marcados com acquire/release; o sweeper nunca apaga uma diretoria que
+    contenha ficheiros em uso. As restantes são apagadas quando ficam mais
+    antigas do que max_age ou, das mais antigas para as mais recentes,
+    enquanto o total ocupar mais do que max_bytes.
+
+    Além da contagem em memória, um ficheiro em uso tem um flock partilhado
+    aberto pelo processo, por isso os outros processos com o mesmo
+    armazenamento (servidor web e workers) também o veem em uso. Para
+    apagar, remove() pega num flock exclusivo em tudo o que vai apagar e
+    desiste se algum ficheiro estiver em uso.
+    """
+
+    def __init__(self, root=WORKSPACE_DIR, max_age=WORKSPACE_MAX_AGE,
+                 max_bytes=WORKSPACE_MAX_BYTES, min_free_bytes=WORKSPACE_MIN_FREE_BYTES):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.removed = 0
+        self._refs = {}
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def job_dir(self, name=None):
+        """Criar a diretoria de trabalho de um job, depois da verificação de espaço
+
+        A diretoria fica em uso durante todo o bloco with, por isso a limpeza
+        não a apaga enquanto o job escreve nela.
+        """
+        self.check_admission()
+        name = name or uuid.uuid4().hex
+        path = os.path.join(self.root, name)
+        # A limpeza apaga as entradas de primeiro nível, por isso é essa que
+        # fica em uso; pode ser apagada antes do acquire e só conta se ainda
+        # existir depois dele
+        top = os.path.join(self.root, name.split(os.sep)[0])
+        while True:
+            os.makedirs(top, exist_ok=True)
+            self.acquire(top)
+            if os.path.isdir(top):
+                break
+            self.release(top)
+        try:
+            os.makedirs(path, exist_ok=True)
+            yield path
+        finally:
+            self.release(top)
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def check_admission(self):
+        """Levantar InsufficientDiskSpace se o disco estiver abaixo do mínimo
+
+        Antes de recusar tenta libertar espaço com uma limpeza imediata.
+        """
+        if self.free_bytes() >= self.min_free_bytes:
+            return
+        self.sweep()
+        if self.free_bytes() < self.min_free_bytes:
+            raise InsufficientDiskSpace(
+                f'Espaço livre abaixo de {self.min_free_bytes // 1024 ** 2} MB, tente mais tarde'
+            )
+
+    def acquire(self, path):
+        path = os.path.abspath(path)
+        while True:
+            with self._lock:
+                if path in self._refs:
+                    self._refs[path] += 1
+                    return
+                try:
+                    self._handles[path] = _lock_path(path)
+                except BlockingIOError:
+                    pass
+                else:
+                    self._refs[path] = 1
+                    return
+            # A ser apagado por uma limpeza (deste ou de outro processo); quando
+            # ela terminar o ficheiro já não existe e fica só a contagem
+            time.sleep(LOCK_RETRY_INTERVAL)
+
+    def release(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            count = self._refs.get(path, 0) - 1
+            if count > 0:
+                self._refs[path] = count
+                return
+            self._refs.pop(path, None)
+            handle = self._handles.pop(path, None)
+        if handle is not None:
+            os.close(handle)
+
+    @contextmanager
+    def using(self, *paths):
+        """Marcar ficheiros como em uso durante o bloco with"""
+        paths = [path for path in paths if path]
+        for path in paths:
+            self.acquire(path)
+        try:
+            yield
+        finally:
+            for path in paths:
+                self.release(path)
+
+    def is_in_use(self, path):
+        """Verificar se path (ficheiro ou diretoria) tem ficheiros em uso neste processo"""
+        path = os.path.abspath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            return any(ref == path or ref.startswith(prefix) for ref in self._refs)
+
+    def sweep(self):
+        """Apagar diretorias antigas e, se preciso, as mais antigas até caber no limite"""
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                size, mtime = _dir_usage(path)
+                entries.append((mtime, path, size))
+        entries.sort()
+
+        total = sum(size for _, _, size in entries)
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for mtime, path, size in entries:
+            if mtime >= cutoff and total <= self.max_bytes:
+                continue
+            if not self.remove(path):
+                continue
+            total -= size
+            removed += 1
+
+        with self._lock:
+            self.removed += removed
+        return removed
+
+    def remove(self, path):
+        """Apagar path (ficheiro ou diretoria) se nada nele estiver em uso, neste ou noutro processo
+
+        Os flocks exclusivos ficam abertos enquanto apaga, por isso um
+        acquire concorrente espera em vez de ficar com um ficheiro a meio de
+        ser apagado. Devolve True se apagou.
+        """
+        if self.is_in_use(path):
+            return False
+        handles = _lock_tree(path)
+        if handles is None:
+            return False
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        finally:
+            for handle in handles:
+                os.close(handle)
+        return True
+
+    def start_sweeper(self, interval=WORKSPACE_SWEEP_INTERVAL):
+        """Iniciar a limpeza periódica numa thread em segundo plano"""
+        if self._sweeper:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Erro na limpeza das diretorias de trabalho: {str(e)}")
+
+        self._sweeper = threading.Thread(target=loop, name='workspace-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stats(self):
+        size = sum(_dir_usage(os.path.join(self.root, name))[0] for name in os.listdir(self.root))
+        with self._lock:
+            return {
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'free_bytes': self.free_bytes(),
+                'min_free_bytes': self.min_free_bytes,
+                'files_in_use': len(self._refs),
+                'removed': self.removed
+            }
+
+
+def _lock_path(path, exclusive=False):
+    """Abrir path e pegar num flock sem esperar; devolve o descritor ou None
+
+    None se não houver flock ou o ficheiro já não existir. Levanta
+    BlockingIOError se outro descritor tiver um flock incompatível.
+    """
+    if fcntl is None:
+        return None
+    try:
+        handle = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(handle, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(handle)
+        raise
+    except OSError:
+        # Sistema de ficheiros sem flock: fica só a contagem em memória
+        os.close(handle)
+        return None
+    return handle
+
+
+def _lock_tree(path):
+    """flock exclusivo em path e em tudo o que está dentro; None se algum estiver em uso"""
+    paths = [path]
+    for dirpath, dirnames, filenames in os.walk(path):
+        paths.extend(os.path.join(dirpath, name) for name in dirnames + filenames)
+
+    handles = []
+    try:
+        for item in paths:
+            handle = _lock_path(item, exclusive=True)
+            if handle is not None:
+                handles.append(handle)
+    except BlockingIOError:
+        for handle in handles:
+            os.close(handle)
+        return None
+    return handles
+
+
+def _dir_usage(path):
+    """Tamanho total e data da última alteração dos ficheiros de uma diretoria"""
+    size = 0
+    mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+workspace = Workspace()
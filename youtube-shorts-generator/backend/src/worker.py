@@ -0,0 +1,169 @@
+"""Worker que executa os jobs da fila persistente (TASK_BACKEND=worker)
+
+Corre separado do servidor web, na mesma máquina ou noutras que partilhem a
+base de dados e o armazenamento (downloads, diretorias de trabalho):
+
+    python worker.py --concurrency 2
+    python worker.py --kinds upload_youtube
+
+O estado e o progresso dos jobs ficam na base de dados, onde a API os lê.
+Com SIGTERM/SIGINT o worker deixa de reclamar tarefas e termina as que tem
+em curso; um segundo sinal termina já, e essas tarefas são reclamadas por
+outro worker quando o lease expirar.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+
+# Adicionar o diretório 'src' ao PYTHONPATH, como no main.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
+
+from main import app
+from models.media import Job as JobRecord
+from models.user import db
+from routes.upload import UPLOAD_STAGES, run_youtube_upload
+from routes.video_processing import (
+    BATCH_STAGES, PROCESS_VIDEO_STAGES, SOURCE_PREVIEW_STAGES, WATERMARK_STAGES, run_process_batch, run_process_video,
+    run_source_preview, run_watermark_batch
+)
+from services.jobs import job_queue
+from services.registry import job_registry
+from services.tasks import LeaseKeeper, task_queue, worker_identity
+
+# Tarefas executadas em simultâneo por processo; cada render já usa vários núcleos
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 1))
+# Espera (segundos) entre consultas à fila quando não há tarefas
+WORKER_POLL_INTERVAL = float(os.environ.get('WORKER_POLL_INTERVAL', 2.0))
+
+# Tipo de tarefa -> (função do job, etapas reportadas)
+TASK_HANDLERS = {
+    'process_video': (run_process_video, PROCESS_VIDEO_STAGES),
+    'process_batch': (run_process_batch, BATCH_STAGES),
+    'source_preview': (run_source_preview, SOURCE_PREVIEW_STAGES),
+    'watermark': (run_watermark_batch, WATERMARK_STAGES),
+    'upload_youtube': (run_youtube_upload, UPLOAD_STAGES),
+}
+
+
+class Worker:
+    """Reclamar tarefas da fila e executá-las como jobs, com o lease renovado"""
+
+    def __init__(self, app, queue, handlers, concurrency=WORKER_CONCURRENCY, kinds=None,
+                 poll_interval=WORKER_POLL_INTERVAL):
+        self.app = app
+        self.queue = queue
+        self.handlers = handlers
+        self.concurrency = max(1, concurrency)
+        self.kinds = list(kinds or handlers)
+        self.poll_interval = poll_interval
+        self.worker_id = worker_identity()
+        self.leases = LeaseKeeper(app, queue, self.worker_id, on_lost=self._lease_lost)
+        self.stopping = threading.Event()
+
+    def run(self):
+        print(f"Worker {self.worker_id}: {self.concurrency} em simultâneo, tarefas {', '.join(self.kinds)}")
+        self.leases.start()
+        threads = [
+            threading.Thread(target=self._loop, name=f'worker-{n}', daemon=True)
+            for n in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.leases.stop()
+        job_registry.flush()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            try:
+                with self.app.app_context():
+                    task = self.queue.claim(self.worker_id, self.kinds)
+                    if task:
+                        self._execute(task)
+                        continue
+            except Exception as e:
+                print(f"Erro no worker {self.worker_id}: {str(e)}")
+            self.stopping.wait(self.poll_interval)
+
+    def _execute(self, task):
+        print(f"Tarefa {task.id} ({task.kind}), tentativa {task.attempts}/{task.max_attempts}")
+        try:
+            payload = task.load_payload()
+            fn, stages = self.handlers[task.kind]
+        except (KeyError, ValueError) as e:
+            self.queue.fail(task.id, self.worker_id, f'Tarefa inválida: {str(e)}')
+            return
+        record = db.session.get(JobRecord, task.id)
+
+        self.leases.add(task.id)
+        try:
+            job = job_queue.run(
+                task.kind,
+                fn,
+                *payload['args'],
+                job_id=task.id,
+                created_at=record.created_at if record else None,
+                attempt=task.attempts,
+                stages=stages,
+                owner=task.owner,
+                **payload['kwargs']
+            )
+        finally:
+            kept = self.leases.remove(task.id)
+
+        if not kept:
+            # Outro worker reclamou a tarefa entretanto; o estado e o resultado dele é que contam
+            job_registry.discard(task.id)
+            print(f"Tarefa {task.id}: lease perdido, resultado descartado")
+            return
+        # O estado final do job tem de estar gravado antes de a tarefa sair da fila
+        job_registry.flush()
+        if job.status == 'completed':
+            self.queue.complete(task.id, self.worker_id)
+        elif self.queue.fail(task.id, self.worker_id, job.error):
+            # Vai ser repetida: o job volta a aparecer em fila e não como falhado
+            print(f"Tarefa {task.id} falhou ({job.error}), vai ser repetida")
+
+
+    def _lease_lost(self, task_id):
+        # Parar o job já (os encodes em curso são terminados) e não gravar mais nada dele
+        job = job_queue.get(task_id)
+        if job:
+            job.cancel()
+        job_registry.discard(task_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Executar os jobs da fila persistente')
+    parser.add_argument('--concurrency', type=int, default=WORKER_CONCURRENCY,
+                        help='tarefas executadas em simultâneo')
+    parser.add_argument('--kinds', default=None,
+                        help=f"tipos de tarefa separados por vírgulas ({', '.join(TASK_HANDLERS)})")
+    args = parser.parse_args()
+
+    kinds = args.kinds.split(',') if args.kinds else None
+    unknown = set(kinds or ()) - set(TASK_HANDLERS)
+    if unknown:
+        parser.error(f"tipos de tarefa desconhecidos: {', '.join(sorted(unknown))}")
+
+    worker = Worker(app, task_queue, TASK_HANDLERS, args.concurrency, kinds)
+
+    def shutdown(signum, frame):
+        if worker.stopping.is_set():
+            sys.exit(1)
+        print('A terminar depois das tarefas em curso (repita o sinal para sair já)')
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import os
+import sys
+import tempfile
+
+# Os módulos da aplicação importam-se a partir de src, como em main.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+# As diretorias partilhadas são criadas quando os serviços são importados
+_scratch = tempfile.mkdtemp(prefix='shorts-tests-')
+os.environ.setdefault('WORKSPACE_DIR', os.path.join(_scratch, 'workspace'))
+os.environ.setdefault('DOWNLOAD_CACHE_DIR', os.path.join(_scratch, 'download-cache'))
+
+import pytest  # noqa: E402
+from flask import Flask  # noqa: E402
+
+from models import media  # noqa: E402,F401  (regista as tabelas)
+from models.user import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Aplicação mínima com uma base de dados SQLite temporária"""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'app.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
@@ -0,0 +1,53 @@
+import pytest
+
+import routes.upload
+import services.tasks
+from models.media import Task
+from routes.upload import upload_bp
+from services.credentials import open_credentials, seal_credentials
+
+CREDENTIALS = {
+    'token': 'access-token',
+    'refresh_token': 'refresh-secret',
+    'client_id': 'client-id',
+    'client_secret': 'client-secret'
+}
+
+
+def test_sealed_credentials_round_trip(app):
+    sealed = seal_credentials(CREDENTIALS)
+
+    assert 'refresh-secret' not in sealed
+    assert open_credentials(sealed) == CREDENTIALS
+
+
+def test_credentials_sealed_with_another_key_are_rejected(app):
+    sealed = seal_credentials(CREDENTIALS)
+    app.config['SECRET_KEY'] = 'other'
+
+    with pytest.raises(ValueError):
+        open_credentials(sealed)
+
+
+def test_worker_upload_stores_only_sealed_credentials(app, tmp_path, monkeypatch):
+    def no_client(credentials):
+        raise AssertionError('o cliente só é preciso no upload síncrono')
+
+    monkeypatch.setattr(routes.upload, 'TASK_BACKEND', 'worker')
+    monkeypatch.setattr(services.tasks, 'TASK_BACKEND', 'worker')
+    monkeypatch.setattr(routes.upload, 'youtube_client', no_client)
+    app.register_blueprint(upload_bp, url_prefix='/api/upload')
+    video = tmp_path / 'short_1.mp4'
+    video.write_bytes(b'video')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['google_credentials'] = CREDENTIALS
+
+    response = client.post('/api/upload/youtube', json={'video_path': str(video)})
+
+    assert response.status_code == 202
+    task = Task.query.one()
+    assert 'refresh-secret' not in task.payload
+    upload_id, sealed = task.load_payload()['args']
+    assert upload_id == response.get_json()['upload_id']
+    assert open_credentials(sealed) == CREDENTIALS
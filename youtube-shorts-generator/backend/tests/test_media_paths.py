@@ -0,0 +1,33 @@
+import os
+
+from routes.video_processing import resolve_media_path
+from services.workspace import workspace
+
+
+def test_accepts_files_in_the_workspace():
+    with workspace.job_dir() as job_dir:
+        path = os.path.join(job_dir, 'short_1.mp4')
+        open(path, 'wb').close()
+
+        assert resolve_media_path(path) == os.path.realpath(path)
+        assert resolve_media_path(os.path.join(job_dir, 'missing.mp4')) is None
+
+
+def test_rejects_paths_outside_the_app_storage(tmp_path):
+    outside = tmp_path / 'video.mp4'
+    outside.write_bytes(b'')
+
+    assert resolve_media_path(str(outside)) is None
+    assert resolve_media_path('/etc/passwd') is None
+    assert resolve_media_path(os.path.join(workspace.root, '..', 'video.mp4')) is None
+    assert resolve_media_path(None) is None
+
+
+def test_rejects_symlinks_out_of_the_workspace(tmp_path):
+    outside = tmp_path / 'video.mp4'
+    outside.write_bytes(b'')
+    with workspace.job_dir() as job_dir:
+        link = os.path.join(job_dir, 'link.mp4')
+        os.symlink(outside, link)
+
+        assert resolve_media_path(link) is None
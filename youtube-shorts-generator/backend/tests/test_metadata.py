@@ -0,0 +1,79 @@
+import sys
+import types
+
+from services.metadata import MetadataCache, extract_with_ytdlp
+
+
+class StubExtractor:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, url):
+        self.calls.append(url)
+        return {'id': 'dQw4w9WgXcQ', 'duration': 212, 'formats': []}
+
+
+def test_miss_then_hit():
+    extractor = StubExtractor()
+    cache = MetadataCache(extractor=extractor)
+
+    first = cache.get('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+    second = cache.get('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+
+    assert first == second == {'id': 'dQw4w9WgXcQ', 'duration': 212, 'formats': []}
+    assert len(extractor.calls) == 1
+    assert (cache.misses, cache.hits) == (1, 1)
+
+
+def test_playlist_and_short_urls_share_the_video_entry():
+    extractor = StubExtractor()
+    cache = MetadataCache(extractor=extractor)
+
+    cache.get('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf&index=3')
+    cache.get('https://youtu.be/dQw4w9WgXcQ')
+    cache.get('https://www.youtube.com/shorts/dQw4w9WgXcQ')
+
+    assert len(extractor.calls) == 1
+    assert (cache.misses, cache.hits) == (1, 2)
+
+
+def test_different_videos_miss():
+    extractor = StubExtractor()
+    cache = MetadataCache(extractor=extractor)
+
+    cache.get('https://youtu.be/dQw4w9WgXcQ')
+    cache.get('https://youtu.be/9bZkp7q19f0')
+
+    assert len(extractor.calls) == 2
+    assert cache.misses == 2
+
+
+def test_copies_are_independent():
+    cache = MetadataCache(extractor=StubExtractor())
+
+    cache.get('https://youtu.be/dQw4w9WgXcQ')['formats'].append('changed')
+
+    assert cache.get('https://youtu.be/dQw4w9WgXcQ')['formats'] == []
+
+
+def test_extractor_ignores_the_playlist(monkeypatch):
+    options = {}
+
+    class FakeYoutubeDL:
+        def __init__(self, opts):
+            options.update(opts)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download):
+            return {'id': 'dQw4w9WgXcQ'}
+
+    monkeypatch.setitem(sys.modules, 'yt_dlp', types.SimpleNamespace(YoutubeDL=FakeYoutubeDL))
+
+    extract_with_ytdlp('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf')
+
+    assert options['noplaylist'] is True
@@ -0,0 +1,57 @@
+import os
+
+import services.probe
+from services.downloads import DownloadCache
+from services.probe import MediaProbeCache
+
+
+def fake_download(target_dir):
+    path = os.path.join(target_dir, 'video.mp4')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(256 * 1024))
+    return path
+
+
+def test_download_cache_hits_keep_the_probe_cached(tmp_path, monkeypatch):
+    downloads = DownloadCache(root=str(tmp_path / 'cache'))
+    probes = MediaProbeCache()
+    probed = []
+    fingerprints = []
+    original_fingerprint = services.probe.content_fingerprint
+
+    def fingerprint(*args):
+        fingerprints.append(args)
+        return original_fingerprint(*args)
+
+    monkeypatch.setattr(services.probe, 'content_fingerprint', fingerprint)
+
+    def probe(path):
+        probed.append(path)
+        return {'duration': 10.0}
+
+    path = downloads.get_or_download('video', 'best', fake_download)
+    mtime = os.stat(path).st_mtime_ns
+    for _ in range(3):
+        assert downloads.get_or_download('video', 'best', fake_download) == path
+        assert probes._get(path, 'media', probe) == {'duration': 10.0}
+
+    assert os.stat(path).st_mtime_ns == mtime
+    assert len(probed) == 1
+    assert len(fingerprints) == 1
+    assert (probes.misses, probes.hits) == (1, 2)
+
+
+def test_rewritten_file_is_probed_again(tmp_path):
+    path = str(tmp_path / 'video.mp4')
+    fake_download(str(tmp_path))
+    probes = MediaProbeCache()
+    probed = []
+
+    def probe(path):
+        probed.append(path)
+        return {'duration': float(len(probed))}
+
+    assert probes._get(path, 'media', probe) == {'duration': 1.0}
+    with open(path, 'ab') as f:
+        f.write(b'more')
+    assert probes._get(path, 'media', probe) == {'duration': 2.0}
@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+import socket
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from routes.video_processing import download_segment_windows
+
+pytestmark = pytest.mark.skipif(not shutil.which('ffmpeg'), reason='precisa do ffmpeg')
+
+DURATION = 60
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """Servidor de ficheiros com pedidos Range, que conta os bytes enviados"""
+
+    def setup(self):
+        # Buffers pequenos e envio ao ritmo de uma rede: os bytes contados são
+        # os que o cliente lê, não os que ficam nos buffers do loopback quando
+        # ele fecha a ligação a meio de um pedido bytes=N-
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 64 * 1024)
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        byte_range = self.headers.get('Range')
+        if byte_range and byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].split(',')[0].partition('-')
+            start = int(first) if first else size - int(last)
+            end = int(last) if first and last else size - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        source = open(path, 'rb')
+        source.seek(start)
+        self.remaining = end - start + 1
+        return source
+
+    def copyfile(self, source, outputfile):
+        while self.remaining > 0:
+            chunk = source.read(min(16 * 1024, self.remaining))
+            if not chunk:
+                break
+            try:
+                outputfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                break
+            self.remaining -= len(chunk)
+            with self.server.lock:
+                self.server.bytes_sent += len(chunk)
+            time.sleep(0.001)
+
+
+@pytest.fixture(scope='module')
+def served_video(tmp_path_factory):
+    root = tmp_path_factory.mktemp('http')
+    path = root / 'source.mp4'
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size=320x240:rate=25:duration={DURATION}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={DURATION}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '25', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-movflags', '+faststart', str(path)
+    ], check=True)
+
+    class Server(ThreadingHTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), lambda *args: RangeHandler(*args, directory=str(root)))
+    server.lock = threading.Lock()
+    server.bytes_sent = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/source.mp4'
+    yield server, str(path), url
+    server.shutdown()
+
+
+def video_info(url):
+    return {
+        'id': 'range-test',
+        'title': 'range-test',
+        'extractor': 'generic',
+        'extractor_key': 'Generic',
+        'webpage_url': url,
+        'duration': DURATION,
+        'formats': [{
+            'format_id': 'mp4', 'url': url, 'ext': 'mp4', 'protocol': 'http',
+            'vcodec': 'h264', 'acodec': 'aac', 'width': 320, 'height': 240
+        }]
+    }
+
+
+def frame(path, seconds):
+    """Frame em seconds, em cinzento e reduzido, como bytes"""
+    return subprocess.run([
+        'ffmpeg', '-v', 'error', '-ss', str(seconds), '-i', path, '-frames:v', '1',
+        '-vf', 'scale=32:24,format=gray', '-f', 'rawvideo', '-'
+    ], check=True, capture_output=True).stdout
+
+
+def difference(a, b):
+    return sum(abs(x - y) for x, y in zip(a, b)) / len(a)
+
+
+def test_only_the_windows_are_downloaded(served_video):
+    server, source, url = served_video
+    server.bytes_sent = 0
+
+    segments = download_segment_windows(video_info(url), [{'start': 31, 'end': 34}])
+
+    # RANGE_PADDING (2 s) de cada lado: a janela é [29, 36]
+    segment = segments[0]
+    assert segment['offset'] == 29
+    assert (segment['start'], segment['end']) == (2, 5)
+    assert server.bytes_sent < os.path.getsize(source) * 0.3
+
+    # Os tempos relativos à janela mostram as mesmas imagens da fonte
+    for local, original in ((segment['start'], 31), (segment['end'] - 0.5, 33.5)):
+        expected = frame(source, original)
+        assert difference(frame(segment['source'], local), expected) < 2
+        assert difference(frame(segment['source'], local + 1), expected) > 2
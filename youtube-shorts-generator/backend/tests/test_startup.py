@@ -0,0 +1,24 @@
+import importlib.util
+import os
+import statistics
+
+BENCHMARK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'startup_benchmark.py')
+
+
+def load_benchmark():
+    spec = importlib.util.spec_from_file_location('startup_benchmark', BENCHMARK)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_startup_stays_within_budget(tmp_path):
+    benchmark = load_benchmark()
+
+    # O primeiro arranque cria a base de dados e aquece a cache de bytecode
+    benchmark.measure_startup(str(tmp_path))
+    runs = [benchmark.measure_startup(str(tmp_path)) for _ in range(3)]
+
+    assert not {name for run in runs for name in run['lazy_loaded']}
+    assert statistics.median(run['seconds'] for run in runs) <= benchmark.STARTUP_TIME_BUDGET
+    assert statistics.median(run['max_rss_mb'] for run in runs) <= benchmark.STARTUP_MEMORY_BUDGET
@@ -0,0 +1,134 @@
+import json
+import time
+
+import pytest
+
+import services.tasks
+from models.media import Job as JobRecord, Task
+from models.user import db
+from services.tasks import EMPTY_PAYLOAD, TaskQueue
+
+
+class Clock:
+    """time.time() do módulo das tarefas, avançado à mão
+
+    Começa um segundo à frente, para as tarefas acabadas de criar (com
+    available_at na hora real) já estarem disponíveis.
+    """
+
+    def __init__(self):
+        self.now = time.time() + 1
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(services.tasks, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def queue(app, clock):
+    return TaskQueue(lease_seconds=60, max_attempts=3, retry_delay=30)
+
+
+def enqueue_job(queue, max_attempts=None):
+    """Registar um job em fila com a sua tarefa, como o submit_job no modo worker"""
+    record = JobRecord(id=f'job{JobRecord.query.count() + 1}', kind='process_video', status='queued', stages='{}')
+    db.session.add(record)
+    db.session.commit()
+    queue.enqueue('process_video', args=['https://youtu.be/dQw4w9WgXcQ'], task_id=record.id,
+                  max_attempts=max_attempts)
+    return record.id
+
+
+def load(model, task_id):
+    return db.session.get(model, task_id, populate_existing=True)
+
+
+def test_claim_takes_the_oldest_available_task(queue):
+    first = enqueue_job(queue)
+    second = enqueue_job(queue)
+
+    task = queue.claim('worker-a')
+    assert task.id == first
+    assert (task.status, task.worker_id, task.attempts) == ('running', 'worker-a', 1)
+    assert json.loads(task.payload)['args'] == ['https://youtu.be/dQw4w9WgXcQ']
+
+    assert queue.claim('worker-b').id == second
+    assert queue.claim('worker-c') is None
+
+
+def test_expired_lease_is_reclaimed_and_the_old_owner_rejected(queue, clock):
+    task_id = enqueue_job(queue)
+    queue.claim('worker-a')
+
+    # Enquanto o lease é renovado ninguém mais a reclama
+    clock.advance(45)
+    assert queue.heartbeat(task_id, 'worker-a')
+    clock.advance(45)
+    assert queue.claim('worker-b') is None
+
+    clock.advance(61)
+    task = queue.claim('worker-b')
+    assert (task.id, task.worker_id, task.attempts) == (task_id, 'worker-b', 2)
+
+    # O worker antigo perdeu a tarefa: não a renova nem a termina
+    assert not queue.heartbeat(task_id, 'worker-a')
+    assert not queue.complete(task_id, 'worker-a')
+    assert not queue.fail(task_id, 'worker-a', 'erro')
+    assert load(Task, task_id).worker_id == 'worker-b'
+
+    assert queue.heartbeat(task_id, 'worker-b')
+    assert queue.complete(task_id, 'worker-b')
+    task = load(Task, task_id)
+    assert (task.status, task.payload) == ('completed', EMPTY_PAYLOAD)
+
+
+def test_failed_task_is_retried_after_the_delay(queue, clock):
+    task_id = enqueue_job(queue)
+    queue.claim('worker-a')
+
+    assert queue.fail(task_id, 'worker-a', 'Falha no download do vídeo')
+    task = load(Task, task_id)
+    assert (task.status, task.error, task.worker_id) == ('queued', 'Falha no download do vídeo', 'worker-a')
+    assert load(JobRecord, task_id).status == 'queued'
+
+    # TASK_RETRY_DELAY multiplicado pela tentativa
+    assert queue.claim('worker-b') is None
+    clock.advance(31)
+    task = queue.claim('worker-b')
+    assert (task.id, task.attempts) == (task_id, 2)
+
+
+def test_last_failure_marks_the_job_failed(queue):
+    task_id = enqueue_job(queue, max_attempts=1)
+    queue.claim('worker-a')
+
+    assert not queue.fail(task_id, 'worker-a', 'Vídeo indisponível')
+
+    task = load(Task, task_id)
+    assert (task.status, task.payload) == ('failed', EMPTY_PAYLOAD)
+    record = load(JobRecord, task_id)
+    assert (record.status, record.error) == ('failed', 'Vídeo indisponível')
+    assert queue.claim('worker-b') is None
+
+
+def test_expired_lease_on_the_last_attempt_marks_the_job_failed(queue, clock):
+    task_id = enqueue_job(queue, max_attempts=1)
+    queue.claim('worker-a')
+
+    clock.advance(61)
+    assert queue.claim('worker-b') is None
+
+    task = load(Task, task_id)
+    assert (task.status, task.payload, task.worker_id) == ('failed', EMPTY_PAYLOAD, None)
+    record = load(JobRecord, task_id)
+    assert record.status == 'failed'
+    assert record.error == 'Lease expirado depois de 1 tentativas'
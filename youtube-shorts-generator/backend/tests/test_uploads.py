@@ -0,0 +1,123 @@
+import pytest
+
+import routes.upload
+from models.media import Upload
+from models.user import db
+from routes.upload import send_youtube_upload, upload_bp, youtube_video_body
+from services.registry import create_upload
+from services.uploads import rate_limiters
+
+CHUNK = 256 * 1024
+
+
+class FakeUploadServer:
+    """Lado da plataforma: sessões resumable e os bytes recebidos em cada uma"""
+
+    def __init__(self, fail_after=None):
+        self.sessions = {}
+        self.offsets = []
+        self.fail_after = fail_after
+
+    def open_session(self):
+        uri = f'https://upload.example/session/{len(self.sessions) + 1}'
+        self.sessions[uri] = b''
+        return uri
+
+    def receive(self, uri, offset, chunk):
+        # Sem buracos nem bytes repetidos
+        assert offset == len(self.sessions[uri])
+        self.sessions[uri] += chunk
+        self.offsets.append(offset)
+
+
+class FakeInsertRequest:
+    """Imita o HttpRequest resumable do googleapiclient (next_chunk e o seu estado)"""
+
+    def __init__(self, server, media):
+        self.server = server
+        self.resumable = media
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self._in_error_state = False
+
+    def next_chunk(self, http=None):
+        if self.resumable_uri is None:
+            self.resumable_uri = self.server.open_session()
+        if self._in_error_state:
+            # Como o googleapiclient: perguntar primeiro quantos bytes a sessão já tem
+            self.resumable_progress = len(self.server.sessions[self.resumable_uri])
+            self._in_error_state = False
+        if self.server.fail_after is not None and len(self.server.offsets) >= self.server.fail_after:
+            self.server.fail_after = None
+            raise RuntimeError('Ligação perdida')
+
+        chunk = self.resumable.getbytes(self.resumable_progress, self.resumable.chunksize())
+        self.server.receive(self.resumable_uri, self.resumable_progress, chunk)
+        self.resumable_progress += len(chunk)
+        if self.resumable_progress >= self.resumable.size():
+            return None, {'id': 'remote-video'}
+        return object(), None
+
+
+class FakeYouTube:
+    def __init__(self, server):
+        self.server = server
+
+    def videos(self):
+        return self
+
+    def insert(self, part, body, media_body):
+        return FakeInsertRequest(self.server, media_body)
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / 'short_1.mp4'
+    path.write_bytes(bytes(range(256)) * (4 * CHUNK // 256))
+    return str(path)
+
+
+def test_upload_resumes_from_the_saved_session(app, video, monkeypatch):
+    monkeypatch.setattr(routes.upload, 'UPLOAD_CHUNK_SIZE', CHUNK)
+    server = FakeUploadServer(fail_after=2)
+    upload = create_upload(
+        'short-1', 'youtube', video_path=video, request_body=youtube_video_body('Short', '', ['shorts'])
+    )
+
+    with pytest.raises(RuntimeError):
+        send_youtube_upload(FakeYouTube(server), upload)
+
+    # Um processo novo só tem o que ficou gravado
+    db.session.expire_all()
+    saved = db.session.get(Upload, upload.id)
+    (uri,) = server.sessions
+    assert saved.resumable_uri == uri
+    assert saved.bytes_sent == 2 * CHUNK
+
+    response = send_youtube_upload(FakeYouTube(server), saved)
+
+    assert response == {'id': 'remote-video'}
+    assert list(server.sessions) == [uri]
+    assert server.offsets == [0, CHUNK, 2 * CHUNK, 3 * CHUNK]
+    with open(video, 'rb') as f:
+        assert server.sessions[uri] == f.read()
+
+
+def test_bulk_upload_skips_missing_files_before_charging_quota(app, monkeypatch):
+    monkeypatch.setattr(routes.upload, 'youtube_client', lambda credentials: object())
+    app.register_blueprint(upload_bp, url_prefix='/api/upload')
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['google_credentials'] = {'token': 'test'}
+    quota_used = rate_limiters['youtube'].stats()['quota_used']
+
+    response = client.post('/api/upload/bulk', json={
+        'shorts': [{'id': 'short-1', 'path': '/nonexistent/short_1.mp4'}],
+        'platforms': ['youtube']
+    })
+
+    assert response.status_code == 200
+    result = response.get_json()['results'][0]['platforms']['youtube']
+    assert result == {'error': 'Ficheiro de vídeo não encontrado'}
+    assert rate_limiters['youtube'].stats()['quota_used'] == quota_used
+    assert Upload.query.count() == 0